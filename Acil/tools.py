@@ -1,17 +1,65 @@
+import os, json
 import numpy as np
 import scipy as sc
 
+## vectorized engine
+def paramsBlock(params, k):
+    """
+    split params into the global offset and an (nRes, k) block, one row per resonance
+    """
+    params = np.asarray(params)
+    return params[0], params[1:].reshape(-1, k)
+
+def modelSum(fun, k, x, params):
+    """
+    evaluate offset + sum of fun over all resonances in one broadcast
+    fun is one of the *Fun below, k is its number of params per resonance
+    x can be a scalar or an array of any shape
+    """
+    off, block = paramsBlock(params, k)
+    x = np.asarray(x)
+    return off + fun(x[..., np.newaxis], *block.T).sum(axis=-1)
+
+def modelRes(fun, k, params, xData, yData):
+    """
+    residual of modelSum as an ndarray, leastsq compatible
+    """
+    return modelSum(fun, k, xData, params) - np.asarray(yData)
+
+def modelJac(jacFun, k, params, xData, colDeriv=False):
+    """
+    jacobian of modelSum/modelRes w.r.t. params, shape (len(xData), len(params))
+    jacFun is one of the *JacFun below, returning the k partials of a single resonance
+    colDeriv=True returns the transpose, as expected by leastsq(..., col_deriv=1)
+    """
+    off, block = paramsBlock(params, k)
+    x = np.asarray(xData).ravel()
+    partials = np.broadcast_arrays(*jacFun(x[:, np.newaxis], *block.T)) ## k arrays of (len(x), nRes)
+    jac = np.empty((x.size, 1 + block.size), dtype=np.result_type(*partials))
+    jac[:, 0] = 1
+    jac[:, 1:] = np.stack(partials, axis=-1).reshape(x.size, block.size)
+    return jac.T if colDeriv else jac
+
 ## Heebner
 def heebnerSingleFun(x, a, b):
     return (a**2 - (2*b*a*np.cos(x)) + b**2)/(1 - (2*b*a*np.cos(x)) + b**2*a**2)
 
 def heebnerSingle(x, params):
-    off = params[0]; paramsRest = params[1:]
-    return off + sum([heebnerSingleFun(x, *paramsRest[i:i+2]) for i in range(0, len(paramsRest), 2)])
+    return modelSum(heebnerSingleFun, 2, x, params)
 
 def heebnerSingleRes(params, xData, yData):
-    diff = [heebnerSingle(x, params)-y for x, y in zip(xData, yData)]
-    return diff
+    return modelRes(heebnerSingleFun, 2, params, xData, yData)
+
+def heebnerSingleJacFun(x, a, b):
+    cosX = np.cos(x)
+    nominator = a**2 - 2*a*b*cosX + b**2
+    denominator = 1 - 2*a*b*cosX + a**2*b**2
+    dA = ((2*a - 2*b*cosX)*denominator - nominator*(2*a*b**2 - 2*b*cosX))/denominator**2
+    dB = ((2*b - 2*a*cosX)*denominator - nominator*(2*a**2*b - 2*a*cosX))/denominator**2
+    return dA, dB
+
+def heebnerSingleJac(params, xData, yData=None, colDeriv=False):
+    return modelJac(heebnerSingleJacFun, 2, params, xData, colDeriv)
 
 ## Mihai
 def mihaiDoubletFun(x, a, b, c):
@@ -21,84 +69,458 @@ def mihaiDoubletFun(x, a, b, c):
     return nominator/denominator
 
 def mihaiDoublet(x, params):
-    off = params[0]; paramsRest = params[1:]
-    return off + sum([mihaiDoubletFun(x, *paramsRest[i:i+3]) for i in range(0, len(paramsRest), 3)])
+    return modelSum(mihaiDoubletFun, 3, x, params)
 
 def mihaiDoubletRes(params, xData, yData):
-    diff = [mihaiDoublet(x, params)-y for x, y in zip(xData, yData)]
-    return diff
+    return modelRes(mihaiDoubletFun, 3, params, xData, yData)
+
+def mihaiDoubletJacFun(x, a, b, c):
+    """
+    same expression as mihaiDoubletFun, with sqrt(a*b*c) factored out
+    singular when any of a, b, c is exactly 0
+    """
+    sA, sB, sC = np.sign(a), np.sign(b), np.sign(c)
+    a = np.abs(a); b = np.abs(b); c = np.abs(c)
+    cosX, cos2X = np.cos(x), np.cos(2*x)
+    s = np.sqrt(a*b*c)
+    nominator = a + (1+a)**2*b*c + a*c**2 - 2*s*(1+a)*(1+c)*cosX + 2*a*c*cos2X
+    denominator = 1 + a*c*(4*b + a*c) - 4*s*(1 + a*c)*cosX + 2*a*c*cos2X
+
+    dNomA = 1 + 2*(1+a)*b*c + c**2 - 2*(s/(2*a)*(1+a) + s)*(1+c)*cosX + 2*c*cos2X
+    dNomB = (1+a)**2*c - 2*s/(2*b)*(1+a)*(1+c)*cosX
+    dNomC = (1+a)**2*b + 2*a*c - 2*(s/(2*c)*(1+c) + s)*(1+a)*cosX + 2*a*cos2X
+    dDenA = 4*b*c + 2*a*c**2 - 4*(s/(2*a)*(1 + a*c) + s*c)*cosX + 2*c*cos2X
+    dDenB = 4*a*c - 4*s/(2*b)*(1 + a*c)*cosX
+    dDenC = 4*a*b + 2*a**2*c - 4*(s/(2*c)*(1 + a*c) + s*a)*cosX + 2*a*cos2X
+
+    dA = sA*(dNomA*denominator - nominator*dDenA)/denominator**2
+    dB = sB*(dNomB*denominator - nominator*dDenB)/denominator**2
+    dC = sC*(dNomC*denominator - nominator*dDenC)/denominator**2
+    return dA, dB, dC
+
+def mihaiDoubletJac(params, xData, yData=None, colDeriv=False):
+    return modelJac(mihaiDoubletJacFun, 3, params, xData, colDeriv)
 
 ## Aspelmeyer
 def aspelmeyerSingleFun(x, a, b):
     return 1-(a/(0.5*b + x*1j))
 
 def aspelmeyerSingle(x, params):
-    off = params[0]; paramsRest = params[1:]
-    return off + sum([aspelmeyerSingleFun(x, *paramsRest[i:i+2]) for i in range(0, len(paramsRest), 2)])
+    return modelSum(aspelmeyerSingleFun, 2, x, params)
 
 def aspelmeyerSingleRes(params, xData, yData):
-    diff = [aspelmeyerSingle(x, params)-y for x, y in zip(xData, yData)]
-    return diff
+    return modelRes(aspelmeyerSingleFun, 2, params, xData, yData)
+
+def aspelmeyerSingleJacFun(x, a, b):
+    denominator = 0.5*b + x*1j
+    return -1/denominator, 0.5*a/denominator**2
+
+def aspelmeyerSingleJac(params, xData, yData=None, colDeriv=False):
+    return modelJac(aspelmeyerSingleJacFun, 2, params, xData, colDeriv)
 
 
 def aspelmeyerDoubletFun(x, a, b, c, d, e):
     return 1-(a/(1j*(x-b) + 0.5*c))-(a/(1j*(x-d) + 0.5*e))
 
 def aspelmeyerDoublet(x, params):
-    off = params[0]; paramsRest = params[1:]
-    return off + sum([aspelmeyerDoubletFun(x, *paramsRest[i:i+5]) for i in range(0, len(paramsRest), 5)])
+    return modelSum(aspelmeyerDoubletFun, 5, x, params)
 
 def aspelmeyerDoubletRes(params, xData, yData):
-    diff = [aspelmeyerDoublet(x, params)-y for x, y in zip(xData, yData)]
-    return diff
+    return modelRes(aspelmeyerDoubletFun, 5, params, xData, yData)
+
+def aspelmeyerDoubletJacFun(x, a, b, c, d, e):
+    denominator1 = 1j*(x-b) + 0.5*c
+    denominator2 = 1j*(x-d) + 0.5*e
+    dA = -1/denominator1 - 1/denominator2
+    dB = -1j*a/denominator1**2
+    dC = 0.5*a/denominator1**2
+    dD = -1j*a/denominator2**2
+    dE = 0.5*a/denominator2**2
+    return dA, dB, dC, dD, dE
+
+def aspelmeyerDoubletJac(params, xData, yData=None, colDeriv=False):
+    return modelJac(aspelmeyerDoubletJacFun, 5, params, xData, colDeriv)
 
 
 ## four params Lorentzian, single and multiple
 def lorentzFun(x, a, b, c, d):
     return -a*(c**2/((x-b)**2 + c**2)) + d ## a*pi amplitude, b center, c sigma, d offset
 
+def lorentzJacFun(x, a, b, c, d):
+    detuning = x-b
+    denominator = detuning**2 + c**2
+    dA = -c**2/denominator
+    dB = -2*a*c**2*detuning/denominator**2
+    dC = -2*a*c*detuning**2/denominator**2
+    dD = np.ones_like(denominator)
+    return dA, dB, dC, dD
+
 
 def lorentzSingle(x, params):
-    off = params[0]; paramsRest = params[1:]
-    return off + sum([lorentzFun(x, *paramsRest[i:i+4]) for i in range(0, len(paramsRest), 4)])
+    return modelSum(lorentzFun, 4, x, params)
 
 def lorentzSingleRes(params, xData, yData):
-    diff = [lorentzSingle(x, params)-y for x, y in zip(xData, yData)]
-    return diff
+    return modelRes(lorentzFun, 4, params, xData, yData)
+
+def lorentzSingleJac(params, xData, yData=None, colDeriv=False):
+    return modelJac(lorentzJacFun, 4, params, xData, colDeriv)
 
 
 def lorentzMultiple(x, params):
-    off = params[0]; paramsRest = params[1:]
-    return off + sum([lorentzFun(x, *paramsRest[i:i+4]) for i in range(0, len(paramsRest), 4)])
+    return modelSum(lorentzFun, 4, x, params)
 
 def lorentzMultipleRes(params, xData, yData):
-    diff = [lorentzMultiple(x, params)-y for x, y in zip(xData, yData)]
-    return diff
+    return modelRes(lorentzFun, 4, params, xData, yData)
 
+def lorentzMultipleJac(params, xData, yData=None, colDeriv=False):
+    return modelJac(lorentzJacFun, 4, params, xData, colDeriv)
 
 
+## model name: (function of a single resonance, number of params per resonance)
+fitModels = {
+    'heebnerSingle': (heebnerSingleFun, 2),
+    'mihaiDoublet': (mihaiDoubletFun, 3),
+    'aspelmeyerSingle': (aspelmeyerSingleFun, 2),
+    'aspelmeyerDoublet': (aspelmeyerDoubletFun, 5),
+    'lorentzSingle': (lorentzFun, 4),
+    'lorentzMultiple': (lorentzFun, 4),
+}
+
+## model name: partials of a single resonance, same order as the params of fitModels
+fitJacobians = {
+    'heebnerSingle': heebnerSingleJacFun,
+    'mihaiDoublet': mihaiDoubletJacFun,
+    'aspelmeyerSingle': aspelmeyerSingleJacFun,
+    'aspelmeyerDoublet': aspelmeyerDoubletJacFun,
+    'lorentzSingle': lorentzJacFun,
+    'lorentzMultiple': lorentzJacFun,
+}
+
+def lorentzFixed(nRes):
+    """
+    the global offset and the d of every lorentzFun are collinear, keep the offset at its initial value
+    and only fit the d of the first resonance
+    """
+    return [0] + [4 + 4*i for i in range(1, nRes)]
+
+## model name: indices of the params held at their initial value by default, as a function of the number of resonances
+fitFixed = {
+    'lorentzSingle': lorentzFixed,
+    'lorentzMultiple': lorentzFixed,
+}
+
+
+## fitting
+def fitRes(modelName, params, xData, yData):
+    """
+    real valued residual of a fitModels entry
+    complex models (aspelmeyer) are split into real and imaginary parts, stacked one after the other
+    """
+    fun, k = fitModels[modelName]
+    res = modelRes(fun, k, params, xData, yData)
+    if np.iscomplexobj(res):
+        res = np.concatenate((res.real, res.imag))
+    return res
+
+def fitJac(modelName, params, xData, yData=None, colDeriv=False):
+    """
+    real valued jacobian of a fitModels entry, rows matching fitRes
+    """
+    _, k = fitModels[modelName]
+    jac = modelJac(fitJacobians[modelName], k, params, xData)
+    if np.iscomplexobj(jac):
+        jac = np.concatenate((jac.real, jac.imag))
+    return jac.T if colDeriv else jac
+
+def fitModel(modelName, params, xData, yData, fixed=None, **kwargs):
+    """
+    leastsq fit of a fitModels entry with its analytic jacobian
+    params is the initial guess, kwargs are passed to scipy.optimize.leastsq
+    fixed: indices of params held at their initial value, fitFixed of the model by default, () fits them all
+    return leastsq full output: params, cov_x, infodict, mesg, ier
+    params and cov_x have the full length, fixed params have zero covariance; infodict['free'] masks the fitted ones
+    """
+    from scipy.optimize import leastsq
+
+    xData, yData = np.asarray(xData).ravel(), np.asarray(yData).ravel()
+    params = np.asarray(params, dtype=float)
+    if fixed is None:
+        fixed = fitFixed[modelName]((params.size-1)//fitModels[modelName][1]) if modelName in fitFixed else ()
+    free = np.ones(params.size, dtype=bool)
+    free[list(fixed)] = False
+
+    def fullParams(p):
+        full = params.copy()
+        full[free] = p
+        return full
+
+    kwargs.setdefault('full_output', True)
+    paramsFit, covFree, infoDict, mesg, ier = leastsq(lambda p: fitRes(modelName, fullParams(p), xData, yData), params[free],
+                                                    Dfun=lambda p: fitJac(modelName, fullParams(p), xData)[:, free].T, col_deriv=True, **kwargs)
+    cov = None
+    if covFree is not None:
+        cov = np.zeros((params.size, params.size))
+        cov[np.ix_(free, free)] = covFree
+    infoDict['free'] = free
+    return fullParams(paramsFit), cov, infoDict, mesg, ier
+
+def checkJacobian(modelName, params, xData, step=1e-7):
+    """
+    compare the analytic jacobian of a fitModels entry against central differences
+    return the max abs deviation, relative to the max abs analytic entry
+    """
+    fun, k = fitModels[modelName]
+    params = np.asarray(params, dtype=float)
+    jac = modelJac(fitJacobians[modelName], k, params, xData)
+    jacNum = np.empty_like(jac)
+    for i in range(params.size):
+        delta = np.zeros_like(params); delta[i] = step*max(1, abs(params[i]))
+        jacNum[:, i] = (modelSum(fun, k, xData, params+delta) - modelSum(fun, k, xData, params-delta))/(2*delta[i])
+    return np.max(np.abs(jac-jacNum))/np.max(np.abs(jac))
+
+## batch fitting
+def fitWindow(job):
+    """
+    fit a single window, job is (modelName, params, xData, yData, window, fixed)
+    window is (xMin, xMax) or None for the whole trace, fixed as in fitModel
+    top level so that it can be pickled to a process pool
+
+    return params, scaled covariance, reduced chi square, r squared, ier, nfev
+    """
+    modelName, params, xData, yData, window, fixed = job
+    xData, yData = np.asarray(xData).ravel(), np.asarray(yData).ravel()
+    if window is not None:
+        mask = (xData >= window[0]) & (xData <= window[1])
+        xData, yData = xData[mask], yData[mask]
+
+    nParams = len(params)
+    paramsFit, cov, infoDict, _, ier = fitModel(modelName, params, xData, yData, fixed)
+    res = infoDict['fvec']
+    dof = max(res.size - np.count_nonzero(infoDict['free']), 1)
+    redChiSq = np.sum(res**2)/dof
+    if cov is None: cov = np.full((nParams, nParams), np.nan)
+    else: cov = cov*redChiSq
+
+    yAbs = np.concatenate((yData.real, yData.imag)) if np.iscomplexobj(yData) else yData
+    rSquared = 1 - np.sum(res**2)/np.sum((yAbs-np.mean(yAbs))**2)
+    return paramsFit, cov, redChiSq, rSquared, ier, infoDict['nfev']
+
+def batchFit(modelName, traces, params, windows=None, maxWorkers=None, chunkSize=1, fixed=None):
+    """
+    fit many traces with the same fitModels entry across a process pool
+    traces is a list of (xData, yData), one per resonance
+    params is a single initial guess or a list of them, one per trace; all of the same length
+    windows is None, a single (xMin, xMax) or a list of them, one per trace
+    maxWorkers=1 fits serially in this process, None uses all cores
+    fixed: indices of params held at their initial value, as in fitModel
+
+    return a structured array with one record per trace:
+    params, cov, redChiSq, rSquared, ier, nfev, success
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    nTraces = len(traces)
+    params = np.asarray(params, dtype=float)
+    if params.ndim == 1: params = np.tile(params, (nTraces, 1))
+    if windows is None or np.isscalar(windows[0]): windows = [windows]*nTraces
+    if len(params) != nTraces or len(windows) != nTraces:
+        raise ValueError('params and windows must match the number of traces: {}'.format(nTraces))
+
+    nParams = params.shape[1]
+    jobs = [(modelName, p, x, y, w, fixed) for (x, y), p, w in zip(traces, params, windows)]
+    if maxWorkers == 1:
+        fits = list(map(fitWindow, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+            fits = list(executor.map(fitWindow, jobs, chunksize=chunkSize))
+
+    result = np.zeros(nTraces, dtype=[
+        ('params', float, (nParams,)), ('cov', float, (nParams, nParams)),
+        ('redChiSq', float), ('rSquared', float), ('ier', int), ('nfev', int), ('success', bool)])
+    for i, (paramsFit, cov, redChiSq, rSquared, ier, nfev) in enumerate(fits):
+        result[i] = (paramsFit, cov, redChiSq, rSquared, ier, nfev, ier in (1, 2, 3, 4))
+    return result
+
+
+## resonance detection and initial guesses
+def dipWidth(xData, yData, iMin, level):
+    """
+    full width of the dip around iMin, where yData first rises above level on either side
+    """
+    left = np.flatnonzero(yData[:iMin+1][::-1] > level)
+    right = np.flatnonzero(yData[iMin:] > level)
+    iLeft = iMin - left[0] if left.size else 0
+    iRight = iMin + right[0] if right.size else len(yData)-1
+    return xData[iRight] - xData[iLeft]
+
+def guessLorentzSingle(xData, yData):
+    """
+    initial guess for lorentzSingle from a window holding one dip
+    baseline from the upper decile, center at the minimum, width at half depth
+    the global offset is 0 and stays there in fitModel (fitFixed), the baseline goes to d
+    """
+    xData, yData = np.asarray(xData), np.asarray(yData)
+    iMin = np.argmin(yData)
+    baseline = np.percentile(yData, 90)
+    depth = baseline - yData[iMin]
+    hwhm = 0.5*dipWidth(xData, yData, iMin, baseline - 0.5*depth)
+    return np.array([0, depth, xData[iMin], hwhm, baseline])
+
+def guessHeebnerSingle(xData, yData):
+    """
+    initial guess for heebnerSingle from a window holding one dip, xData is round-trip phase
+    a*b from the finesse 2pi/fwhm, |a-b| from the normalized minimum transmission, a >= b assumed
+    """
+    xData, yData = np.asarray(xData), np.asarray(yData)
+    iMin = np.argmin(yData)
+    baseline = np.percentile(yData, 90)
+    tMin = np.clip(yData[iMin]/baseline, 0, 1)
+    fwhm = dipWidth(xData, yData, iMin, 0.5*(baseline + yData[iMin]))
+    finesse = 2*np.pi/max(fwhm, np.finfo(float).eps)
+    ab = ((-np.pi + np.sqrt(np.pi**2 + 4*finesse**2))/(2*finesse))**2
+    aMinusB = np.sqrt(tMin)*(1-ab)
+    a = 0.5*(aMinusB + np.sqrt(aMinusB**2 + 4*ab))
+    return np.array([0, a, ab/a])
+
+## model name: initial guess from a single-dip window
+fitGuesses = {
+    'lorentzSingle': guessLorentzSingle,
+    'heebnerSingle': guessHeebnerSingle,
+}
+
+def resonanceWindows(lamb, trans, radius, modelName='lorentzSingle', lambStart=None, searchFrac=0.25, windowFrac=0.5, minDepth=0.1, fsrFun=None):
+    """
+    walk along a long transmission trace one FSR at a time and yield one window per resonance
+    lamb is the wavelength axis in m, ascending; trans the linear transmission
+    the first dip is the minimum of the first FSR after lambStart, every next one is only searched
+    within searchFrac*FSR of the center predicted by fsrLambFun, so the whole scan is O(n)
+
+    windows are windowFrac*FSR wide, dips shallower than minDepth (relative to the window baseline) are skipped
+    fsrFun(lamb, radius) defaults to fsrLambFun
+
+    yield (center wavelength, xData, yData, initial guess) with xData in the units of modelName:
+    wavelength for lorentzSingle, round-trip phase detuning for heebnerSingle
+    """
+    lamb, trans = np.asarray(lamb), np.asarray(trans)
+    if fsrFun is None: fsrFun = fsrLambFun
+    guessFun = fitGuesses[modelName]
+
+    center = lamb[0] if lambStart is None else lambStart
+    lo, hi = np.searchsorted(lamb, [center, center + fsrFun(center, radius)])
+    if hi - lo < 1: return
+    center = lamb[lo + np.argmin(trans[lo:hi])]
+
+    while True:
+        fsr = fsrFun(center, radius)
+        lo, hi = np.searchsorted(lamb, [center - 0.5*windowFrac*fsr, center + 0.5*windowFrac*fsr])
+        xData, yData = lamb[lo:hi], trans[lo:hi]
+        if yData.size > 5:
+            baseline = np.percentile(yData, 90)
+            if baseline - np.min(yData) >= minDepth*np.abs(baseline):
+                if modelName == 'heebnerSingle': xData = 2*np.pi*(xData - center)/fsr
+                yield center, xData, yData, guessFun(xData, yData)
+            else:
+                center = 0.5*(lamb[lo] + lamb[hi-1]) ## no dip, keep walking on the prediction
+
+        ## predict the next resonance and only search around it
+        predicted = center + fsr
+        lo, hi = np.searchsorted(lamb, [predicted - searchFrac*fsr, predicted + searchFrac*fsr])
+        if hi - lo < 1 or hi >= lamb.size: return
+        center = lamb[lo + np.argmin(trans[lo:hi])]
+
+def fitSweep(lamb, trans, radius, modelName='lorentzSingle', maxWorkers=None, **kwargs):
+    """
+    detect every resonance of a sweep with resonanceWindows and fit them all with batchFit
+    kwargs are passed to resonanceWindows
+
+    return the center wavelengths and the batchFit structured array
+    """
+    windows = list(resonanceWindows(lamb, trans, radius, modelName, **kwargs))
+    if not windows:
+        raise RuntimeError('no resonance found in the sweep')
+    centers = np.array([window[0] for window in windows])
+    return centers, batchFit(modelName, [window[1:3] for window in windows], [window[3] for window in windows], maxWorkers=maxWorkers)
+
+
+## calibration curves
+## polynomials kept as data in calibrationCurves.json, key 'kind/device/...': scale of the variable and ascending coefficients
+calibrationFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibrationCurves.json')
+
+class CalibrationCurve():
+    """
+    polynomial sum(coeffs[i]*(x*scale)**i), evaluated with Horner on arrays
+    tabulate() adds a cached interpolation grid for hot loops over the same range
+    """
+
+    def __init__(self, coeffs, scale=1.0, description=''):
+        self.coeffs, self.scale, self.description = np.asarray(coeffs, dtype=np.float64), float(scale), description
+        self.grid = None ## (x, y) of tabulate
+
+    def __call__(self, x):
+        """
+        exact evaluation, x scalar or array
+        """
+        xScaled = np.multiply(x, self.scale, dtype=np.float64)
+        result = np.full_like(xScaled, self.coeffs[-1])
+        for coeff in self.coeffs[-2::-1]:
+            result *= xScaled
+            result += coeff
+        return result if result.ndim else float(result)
+
+    def tabulate(self, xMin, xMax, pointNum=4097):
+        """
+        sample the curve once on pointNum points of [xMin, xMax], reused by interpolate
+        """
+        if self.grid is None or self.grid[0][0] != xMin or self.grid[0][-1] != xMax or self.grid[0].size != pointNum:
+            xGrid = np.linspace(xMin, xMax, pointNum)
+            self.grid = (xGrid, self(xGrid))
+        return self
+
+    def interpolate(self, x):
+        """
+        linear interpolation on the tabulated grid, x outside it is clamped to the ends
+        """
+        if self.grid is None: raise RuntimeError('call tabulate(xMin, xMax) first')
+        return np.interp(x, *self.grid)
+
+def loadCalibrations(fileName=calibrationFile):
+    """
+    read a coefficient file into a dict of key: CalibrationCurve
+    a missing or malformed file raises with its path, the special functions below cannot work without it
+    """
+    try:
+        with open(fileName) as fileHandler:
+            return {key: CalibrationCurve(**entry) for key, entry in json.load(fileHandler).items()}
+    except (OSError, ValueError, TypeError) as error:
+        raise RuntimeError('cannot load the calibration curves from {}: {}'.format(fileName, error)) from error
+
+calibrationCurves = loadCalibrations()
+
+def getCalibration(kind, *device):
+    """
+    the curve of kind ('nGroup', 'fsrLamb', 'coup', 'powerVolt') for device keys, e.g. getCalibration('coup', '1000', '2.5', 'self')
+    look it up once and call it on whole arrays, an unknown device raises instead of returning None
+    """
+    key = '/'.join([kind] + [str(part) for part in device])
+    if key not in calibrationCurves:
+        known = sorted(name for name in calibrationCurves if name.startswith(kind + '/'))
+        raise ValueError('no calibration {}, known: {}'.format(key, ', '.join(known)))
+    return calibrationCurves[key]
+
 ## special functions
 def nGroupFun(lamb, radius):
     """
     lamb is wavelength in m
     radius is ring resonator radius. for Antigua, either '1000' or '1600'
     """
-    if radius == '1000':
-        nGroup = 2.30025818 + -8.83471004e-4*(lamb*1e9) + 3.29677825e-7*(lamb*1e9)**2 + -4.01140785e-11*(lamb*1e9)**3
-    elif radius == '1600':
-        nGroup = 2.30326690 + -8.89655823e-4*(lamb*1e9) + 3.33826981e-7*(lamb*1e9)**2 + -4.10158405e-11*(lamb*1e9)**3
-    return nGroup
+    return getCalibration('nGroup', radius)(lamb)
 
 def fsrLambFun(lamb, radius):
     """
     lamb is wavelength in m
     radius is ring resonator radius. for Antigua, either '1000' or '1600'
     """
-    if radius == '1000':
-        fsrLamb = 2.31671444e-11 + -6.40713386e-14*(lamb*1e9) + 1.07582145e-16*(lamb*1e9)**2 + -8.17663669e-21*(lamb*1e9)**3
-    elif radius == '1600':
-        fsrLamb = 2.29404535e-11 + -6.36331377e-14*(lamb*1e9) + 1.07309944e-16*(lamb*1e9)**2 + -8.12338473e-21*(lamb*1e9)**3
-    return fsrLamb
+    return getCalibration('fsrLamb', radius)(lamb)
 
 def coupFun(lamb, radius, gap, coup):
     """
@@ -107,30 +529,15 @@ def coupFun(lamb, radius, gap, coup):
     gap is '2.5' and whatnots
     coup is either 'self' or 'cross
     """
-    if radius == '1000':
-        if gap == '2.5':
-            if coup == 'self': return 18.43249371 + -44176183.1658182*lamb + 41798309256950.29*lamb**2 + -1.7481632853688244e+19*lamb**3 + 2.722848959319754e+24*lamb**4
-            elif coup == 'cross': return 2.00647493 + -6136688.23308723*lamb + 7016127518001.358*lamb**2 + -3.5587855413468104e+18*lamb**3 + 6.764992092898619e+23*lamb**4
-    elif radius == '1600':
-        if gap == '2.5':
-            if coup == 'self': return 20.72516267 + -49451146.80521039*lamb + 46193624302956.73*lamb**2 + -1.902115046243164e+19*lamb**3 + 2.9056194418683216e+24*lamb**4
-            elif coup == 'cross': return 4.98214596 + -14382803.33016569*lamb + 15630442777582.727*lamb**2 + -7.5811363164801e+18*lamb**3 + 1.3851694715287498e+24*lamb**4
+    return getCalibration('coup', radius, gap, coup)(lamb)
 
-def powerVoltCal(x, serial:2103):
+def powerVoltCal(x, serial=2103):
     """
     x is wavelength in m
-    serial is PD's serial number
+    serial is PD's serial number: 2103, 2348 or 2319
     reference: https://www.newport.com/mam/celum/celum_assets/np/resources/Model_2103_Spectral_Calibration_Sample.pdf?0
     """
-
-    if serial == 2348:
-        volt = 3.5251 + 0.0075*(x*1e6) + -0.0179*(x*1e6)**2
-    if serial == 2319:
-        volt = 0.1204 + 4.3954*(x*1e6) + -1.4268*(x*1e6)**2
-    else:
-        volt = 3.3499 + 0.2336*(x*1e6) + -0.0925*(x*1e6)**2
-
-    return volt
+    return getCalibration('powerVolt', serial)(x)
 
 ## stats
 def getStats(x, q:0.95):
@@ -142,9 +549,205 @@ def getStats(x, q:0.95):
     stDevPop = np.std(x, ddof=0)
     stDevSample = np.std(x, ddof=1)
     stError = stDevSample/np.sqrt(len(x))
-    if len(x) >= 30:
-        confInt = sc.stats.norm.ppf(q)*stError
-    else:
-        confInt = sc.stats.t.ppf(1-0.5*(1-q), len(x)-1)*stError
+    confInt = confInterval(stError, len(x), q)
 
     return sampleMean, stDevPop, stDevSample, stError, confInt
+
+def confInterval(stError, sampleNum, q=0.95):
+    """
+    half width of the confidence interval as in getStats: normal quantile q from 30 samples on, two-sided t below
+    sampleNum may be an effective number of samples (float)
+    """
+    if sampleNum >= 30:
+        return sc.stats.norm.ppf(q)*stError
+    return sc.stats.t.ppf(1-0.5*(1-q), sampleNum-1)*stError if sampleNum > 1 else np.nan
+
+def statsFromMoments(sampleNum, mean, m2, q=0.95, effectiveNum=None):
+    """
+    getStats outputs from a count, a mean and the sum of squared deviations m2
+    effectiveNum replaces sampleNum for the standard error of weighted (exponential) statistics
+    """
+    if sampleNum == 0: return (np.nan,)*5
+    effectiveNum = sampleNum if effectiveNum is None else effectiveNum
+    stDevPop = np.sqrt(m2/sampleNum)
+    stDevSample = np.sqrt(m2/sampleNum*effectiveNum/(effectiveNum-1)) if effectiveNum > 1 else np.nan
+    stError = stDevSample/np.sqrt(effectiveNum)
+    return mean, stDevPop, stDevSample, stError, confInterval(stError, effectiveNum, q)
+
+class RunningStats():
+    """
+    streaming getStats: count, mean and sum of squared deviations updated per chunk in O(1) memory (Welford/Chan)
+    accumulators of different threads or processes merge exactly, they pickle as three numbers
+
+    example flow
+    stats = RunningStats()
+    for chunk in chunks: stats.update(chunk)
+    stats.merge(statsOtherProcess)
+    sampleMean, stDevPop, stDevSample, stError, confInt = stats.getStats(0.95)
+    """
+
+    def __init__(self, sampleNum=0, mean=0.0, m2=0.0):
+        self.sampleNum, self.mean, self.m2 = int(sampleNum), float(mean), float(m2)
+
+    def update(self, x):
+        """
+        add a chunk, a scalar or an array of any shape, nan included as in np.mean
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        if x.size == 0: return self
+        chunkMean = x.mean()
+        return self.merge(RunningStats(x.size, chunkMean, np.dot(x-chunkMean, x-chunkMean)))
+
+    def merge(self, other):
+        """
+        add the samples of another accumulator, Chan et al. pairwise update
+        """
+        if other.sampleNum == 0: return self
+        sampleNum = self.sampleNum + other.sampleNum
+        delta = other.mean - self.mean
+        self.mean += delta*other.sampleNum/sampleNum
+        self.m2 += other.m2 + delta**2*self.sampleNum*other.sampleNum/sampleNum
+        self.sampleNum = sampleNum
+        return self
+
+    def __add__(self, other):
+        return RunningStats(self.sampleNum, self.mean, self.m2).merge(other)
+
+    def getStats(self, q=0.95):
+        """
+        sampleMean, stDevPop, stDevSample, stError, confInt, same as getStats(x, q) on all the samples so far
+        """
+        return statsFromMoments(self.sampleNum, self.mean, self.m2, q)
+
+class WindowedStats():
+    """
+    getStats over the last window samples, kept in a ring buffer
+    sums are updated per chunk around a shift value and recomputed from the ring once per window samples against rounding drift
+    """
+
+    def __init__(self, window):
+        self.window = int(window)
+        self.ringBuffer = np.zeros(self.window)
+        self.ringCount = 0
+        self.shift, self.sum, self.sumSq = 0.0, 0.0, 0.0
+        self.sinceRefresh = 0
+
+    def update(self, x):
+        """
+        add a chunk, samples older than the last window are dropped
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()[-self.window:]
+        if x.size == 0: return self
+        if self.ringCount == 0: self.shift = float(x[0])
+
+        index = np.arange(self.ringCount, self.ringCount + x.size) % self.window
+        if self.ringCount >= self.window:
+            leaving = self.ringBuffer[index] - self.shift
+        else:
+            leaving = self.ringBuffer[index[self.ringCount + np.arange(x.size) >= self.window]] - self.shift
+        entering = x - self.shift
+        self.sum += entering.sum() - leaving.sum()
+        self.sumSq += np.dot(entering, entering) - np.dot(leaving, leaving)
+        self.ringBuffer[index] = x
+        self.ringCount += x.size
+
+        self.sinceRefresh += x.size
+        if self.sinceRefresh >= self.window: self.refresh()
+        return self
+
+    def refresh(self):
+        """
+        recompute the sums from the ring, with the current window mean as the shift
+        """
+        values = self.values()
+        self.shift = float(values.mean()) if values.size else 0.0
+        self.sum, self.sumSq = float((values - self.shift).sum()), float(np.dot(values - self.shift, values - self.shift))
+        self.sinceRefresh = 0
+
+    def values(self):
+        """
+        the samples of the window, oldest first
+        """
+        sampleNum = min(self.ringCount, self.window)
+        return self.ringBuffer[np.arange(self.ringCount - sampleNum, self.ringCount) % self.window]
+
+    def getStats(self, q=0.95):
+        """
+        sampleMean, stDevPop, stDevSample, stError, confInt over the window
+        """
+        sampleNum = min(self.ringCount, self.window)
+        if sampleNum == 0: return (np.nan,)*5
+        meanShifted = self.sum/sampleNum
+        return statsFromMoments(sampleNum, self.shift + meanShifted, max(self.sumSq - sampleNum*meanShifted**2, 0.0), q)
+
+class ExponentialStats():
+    """
+    exponentially weighted getStats, each new sample multiplies the weight of the older ones by 1 - alpha
+    alpha = 1 - 0.5**(1/halfLife) with halfLife in samples, the standard error uses the effective number of samples (sum w)**2/sum w**2
+    """
+
+    def __init__(self, alpha=None, halfLife=None):
+        if alpha is None: alpha = 1 - 0.5**(1/halfLife)
+        self.alpha = float(alpha)
+        self.sampleNum, self.weightSum, self.weightSqSum, self.mean, self.m2 = 0, 0.0, 0.0, 0.0, 0.0
+
+    def update(self, x):
+        """
+        add a chunk, in time order, vectorized over the chunk
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        if x.size == 0: return self
+        decay = 1 - self.alpha
+        weights = decay**np.arange(x.size - 1, -1, -1, dtype=np.float64) ## newest sample has weight 1
+        chunkWeight = weights.sum()
+        chunkMean = np.dot(weights, x)/chunkWeight
+        chunkM2 = np.dot(weights, (x - chunkMean)**2)
+
+        ## age the state by the chunk length, then weighted pairwise merge
+        aging = decay**x.size
+        weightSum = self.weightSum*aging
+        total = weightSum + chunkWeight
+        delta = chunkMean - self.mean
+        self.m2 = self.m2*aging + chunkM2 + delta**2*weightSum*chunkWeight/total
+        self.mean += delta*chunkWeight/total
+        self.weightSum = total
+        self.weightSqSum = self.weightSqSum*aging**2 + np.dot(weights, weights)
+        self.sampleNum += x.size
+        return self
+
+    def getStats(self, q=0.95):
+        """
+        sampleMean, stDevPop, stDevSample, stError, confInt with exponential weights
+        """
+        if self.sampleNum == 0: return (np.nan,)*5
+        effectiveNum = self.weightSum**2/self.weightSqSum
+        return statsFromMoments(self.weightSum, self.mean, self.m2, q, effectiveNum)
+
+
+if __name__ == '__main__':
+    ## jacobian self check: every analytic jacobian against central differences, away from the singular points of each model
+    phase, detuning = np.linspace(-np.pi, np.pi, 401), np.linspace(-5, 5, 401)
+    jacobianChecks = {
+        'heebnerSingle': ([0, 0.95, 0.9], phase),
+        'mihaiDoublet': ([0, 0.9, 0.05, 0.8], phase),
+        'aspelmeyerSingle': ([0, 0.5, 1.0], detuning),
+        'aspelmeyerDoublet': ([0, 0.5, -1.0, 1.0, 1.5, 0.8], detuning),
+        'lorentzSingle': ([0, 0.6, 0.3, 0.8, 1.0], detuning),
+        'lorentzMultiple': ([0, 0.6, -2.0, 0.8, 1.0, 0.4, 1.5, 0.5, 0.0], detuning),
+    }
+    for modelName in fitModels:
+        params, xData = jacobianChecks[modelName]
+        error = checkJacobian(modelName, params, xData)
+        print('{:20s} max relative error {:.2e}'.format(modelName, error))
+        assert error < 1e-6, 'analytic jacobian of {} off by {:.2e}'.format(modelName, error)
+
+    ## fitSweep regression: one offset per dip, the covariance of every window must stay finite and bounded
+    rng = np.random.default_rng(0)
+    lamb = np.linspace(1550e-9, 1551e-9, 20001)
+    centers = 1550.05e-9 + fsrLambFun(1550.05e-9, 1000)*np.arange(6)
+    trans = lorentzMultiple(lamb, np.concatenate([[0]] + [[0.5, center, 2e-12, 1.0 if i == 0 else 0.0] for i, center in enumerate(centers)]))
+    found, fits = fitSweep(lamb, trans + rng.normal(0, 0.01, lamb.size), 1000, maxWorkers=1)
+    paramsError = np.sqrt(np.diagonal(fits['cov'], axis1=1, axis2=2))
+    print('fitSweep             {} dips, max center error {:.2e} m'.format(found.size, paramsError[:, 2].max()))
+    assert fits['success'].all() and np.isfinite(paramsError).all(), 'singular covariance in fitSweep'
+    assert (paramsError[:, 1:] < 0.1*np.abs(fits['params'][:, 1:])).all(), 'unbounded parameter errors in fitSweep'
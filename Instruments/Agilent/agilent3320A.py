@@ -1,6 +1,10 @@
 import os, time
+import contextlib
 import pyvisa
 
+from ..instrumentation import instrumented
+from ..visaRegistry import resourcePool, sharedState
+
 ## libraries
 
 ## main
@@ -32,15 +36,31 @@ class agilent3320A():
     funcGen.trigger()                   ## trigger the burst
     funcGen.waitForTrigger()            ## wait until the triggering is finished
     funcGen.beep()                      ## beep
+
+    the settings are cached: setting a value the instrument already has is not sent again
+    or the same configuration in a single bus transaction:
+    funcGen.configure(signalShape='SQUARE', signalFreq=24.5e3, signalAmplitudeUnit='VPP', signalAmplitude=1, signalOffset=0.5,
+                      burstState=1, burstCycle=10, burstMode='TRIGGERED', triggerSource='BUS', enableOutput=True)
     """
 
-    def __init__(self, portAddr):
+    settingNames = ('signalShape', 'signalFreq', 'signalAmplitudeUnit', 'signalAmplitude', 'signalOffset', 'signalSquareDutyCycle',
+                    'burstState', 'burstCycle', 'burstMode', 'triggerSource', 'enableOutput')
+    ## SCPI header: headers the instrument may change when it is written (clipped to the limits of the new shape, unit or offset)
+    coupledState = {'FUNC': ('FREQ', 'VOLT', 'VOLT:OFFS'), 'VOLT:UNIT': ('FREQ', 'VOLT', 'VOLT:OFFS'),
+                    'VOLT': ('VOLT:OFFS',), 'VOLT:OFFS': ('VOLT',)}
+
+    def __init__(self, portAddr, resMan=None):
         """
         constructor
+        resMan: the process-wide visaRegistry pool by default, or e.g. a simulatedInstruments.SimResourceManager
         """
-        resMan = pyvisa.ResourceManager()
+        if resMan is None: resMan = resourcePool()
         self.instHandler = resMan.open_resource(portAddr)
+        self.instrumentName = f'3320A {portAddr}' ## key of the instrumentation statistics
+        self.stateCache = sharedState(self.instHandler, 'stateCache', dict) ## SCPI header: last value sent, shared by all users of a pooled address
+        self.pendingState = None ## SCPI header: value queued by an open transaction
 
+    @instrumented('3320A')
     def write(self, command):
         """
         write command
@@ -55,6 +75,7 @@ class agilent3320A():
         return self.instHandler.read()
 
 
+    @instrumented('3320A')
     def query(self, command):
         """
         query command
@@ -67,6 +88,95 @@ class agilent3320A():
         IDN command
         """
         return self.query('*IDN?').strip()
+
+
+    def setState(self, header, value):
+        """
+        write-behind setter used by all the settings below
+        skipped if the instrument already has this value, queued instead of written if a transaction is open
+        a queued setting goes last in the message, after the settings that may change it
+        """
+        value = str(value)
+        if self.pendingState is not None:
+            cached = self.stateCache.get(header)
+            if any(header in self.coupledState.get(pending, ()) for pending in self.pendingState if pending != header): cached = None
+            self.pendingState.pop(header, None)
+            if cached != value: self.pendingState[header] = value
+        elif self.stateCache.get(header) != value:
+            self.write(header + ' ' + value)
+            self.updateState(header, value)
+        return 0
+
+
+    def updateState(self, header, value):
+        """
+        record a written setting, and forget the coupled ones since the instrument may have changed them
+        """
+        for coupled in self.coupledState.get(header, ()): self.stateCache.pop(coupled, None)
+        self.stateCache[header] = value
+        return 0
+
+
+    def clearState(self):
+        """
+        forget the cached settings, e.g. after changing them from the front panel
+        """
+        self.stateCache.clear()
+        return 0
+
+
+    def beginTransaction(self):
+        """
+        queue the following settings instead of writing them
+        """
+        if self.pendingState is None: self.pendingState = {}
+        return 0
+
+
+    def commitTransaction(self):
+        """
+        send all queued settings as one message, joined with ';:' so that every header starts from the SCPI root
+        return the number of settings sent
+        """
+        pendingState, self.pendingState = self.pendingState, None
+        if pendingState:
+            self.write(';:'.join(header + ' ' + value for header, value in pendingState.items()))
+            for header, value in pendingState.items(): self.updateState(header, value)
+        return len(pendingState or {})
+
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        context manager around beginTransaction/commitTransaction, queued settings are dropped on error
+        trigger, beep and queries are not queued, they are sent immediately
+        """
+        self.beginTransaction()
+        try:
+            yield self
+        except BaseException:
+            self.pendingState = None
+            raise
+        self.commitTransaction()
+
+
+    def configure(self, **settings):
+        """
+        apply several settings in one bus transaction, keys are the setter names of settingNames
+        the settings are sent in the given order, unchanged ones are left out
+        return the number of settings sent
+        """
+        for name in settings:
+            if name not in self.settingNames:
+                raise ValueError('unknown setting: {}'.format(name))
+        self.beginTransaction()
+        try:
+            for name, value in settings.items():
+                getattr(self, name)(value)
+        except BaseException:
+            self.pendingState = None
+            raise
+        return self.commitTransaction()
     
 
     def signalShape(self, shape):
@@ -74,7 +184,7 @@ class agilent3320A():
         control output waveform shape
         can be set to SIN<USOID>, SQU<ARE>, RAMP, PULS<E>, NOIS<E>, DC, USER
         """
-        self.write('FUNC ' + str(shape))
+        self.setState('FUNC', shape)
         return 0
     
 
@@ -89,7 +199,7 @@ class agilent3320A():
         if frequency < 1e-6: frequency = 1e-6
         elif frequency > 20e6: frequency = 20e6
 
-        self.write('FREQ ' + str(frequency))
+        self.setState('FREQ', frequency)
         return 0
 
 
@@ -98,7 +208,7 @@ class agilent3320A():
         control unit of the amplitude
         can be set to VPP, VRMS, DBM
         """
-        self.write('VOLT:UNIT ' + str(amplitudeUnit))
+        self.setState('VOLT:UNIT', amplitudeUnit)
         return 0
     
 
@@ -113,7 +223,7 @@ class agilent3320A():
         if amplitude < 10e-3: amplitude = 10e-3
         elif amplitude > 10.0: amplitude = 10.0
 
-        self.write('VOLT ' + str(amplitude))
+        self.setState('VOLT', amplitude)
         return 0
     
 
@@ -129,7 +239,7 @@ class agilent3320A():
         if offset < -4.995: offset = -4.995
         elif offset > 4.995: offset = 4.995
 
-        self.write('VOLT:OFFS ' + str(offset))
+        self.setState('VOLT:OFFS', offset)
         return 0
     
 
@@ -147,7 +257,7 @@ class agilent3320A():
         if dutyCycle < 20: dutyCycle = 20
         elif dutyCycle > 80: dutyCycle = 80
 
-        self.write('FUNC:SQU:DCYC ' + str(dutyCycle))
+        self.setState('FUNC:SQU:DCYC', dutyCycle)
         return 0
 
 
@@ -155,7 +265,7 @@ class agilent3320A():
         """
         turns on/off the burst state
         """
-        self.write('BURS:STAT ' + str(burstState))
+        self.setState('BURS:STAT', burstState)
         return 0
     
 
@@ -170,7 +280,7 @@ class agilent3320A():
         if burstCycle < 1: burstCycle = 1
         elif burstCycle > 50001: burstCycle = 50001
 
-        self.write('BURS:NCYC ' + str(burstCycle))
+        self.setState('BURS:NCYC', burstCycle)
         return 0
     
 
@@ -179,7 +289,7 @@ class agilent3320A():
         control the burst mode
         can be set to TRIG<GERED>, GAT<ED>
         """
-        self.write('BURS:MODE ' + burstMode)
+        self.setState('BURS:MODE', burstMode)
         return 0
     
 
@@ -188,7 +298,7 @@ class agilent3320A():
         set the source of the trigger
         can be set to IMM<EDIATE>, EXT<ERNAL>, BUS
         """
-        self.write('TRIG:SOUR ' + triggerSource)
+        self.setState('TRIG:SOUR', triggerSource)
         return 0
     
 
@@ -196,7 +306,7 @@ class agilent3320A():
         """
         turns on/off the output
         """
-        self.write('OUTP ' + str(enableOutput))
+        self.setState('OUTP', enableOutput)
         return 0
     
 
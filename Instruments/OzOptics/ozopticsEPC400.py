@@ -1,5 +1,8 @@
 import re, os, time
-import pyvisa
+import threading
+
+from ..instrumentation import instrumented
+from ..visaRegistry import resourcePool, PooledResource, sharedState
 
 ## libraries
 
@@ -13,13 +16,19 @@ class ozopticsEPC400():
     |---------------|----------|------------|------------------|------|---------------------------------------------|
     """
 
-    def __init__(self, portAddr, timeout=30000):
+    def __init__(self, portAddr, timeout=30000, resMan=None):
         """
         constructor
         portAddr: string
+        resMan: the process-wide visaRegistry pool by default, or e.g. a simulatedInstruments.SimResourceManager
         """
-        resMan = pyvisa.ResourceManager()
+        if resMan is None: resMan = resourcePool()
         self.instHandler = resMan.open_resource(portAddr, write_termination='\r\n', read_termination='\r\n', timeout=timeout)
+        self.queryLock = self.instHandler.lock if isinstance(self.instHandler, PooledResource) else threading.RLock() ## shared by all users of a pooled port
+        self.instrumentName = f'EPC400 {portAddr}' ## key of the instrumentation statistics
+        self.channelNum = 4
+        self.voltageCache = sharedState(self.instHandler, 'voltageCache', lambda: [None]*self.channelNum) ## last mV sent per channel, None if unknown, shared by all users of a pooled port
+        self.lastLatency, self.lastCommandNum = 0.0, 0
 
 
     def write(self, command):
@@ -36,6 +45,7 @@ class ozopticsEPC400():
         return self.instHandler.read()
 
 
+    @instrumented('EPC400')
     def query(self, command):
         """
         query command. basically write then read
@@ -43,13 +53,14 @@ class ozopticsEPC400():
         """
         response = ''
         if self.instHandler is not None:
-            self.write(command)
-            if command == 'RST': [self.read() for _ in range(2)]
-            else:
-                while True:
-                    next_line = self.read()
-                    if next_line == 'Done': break
-                    else: response += f',{next_line}'
+            with self.queryLock: ## no other write between ours and its 'Done'
+                self.write(command)
+                if command == 'RST': [self.read() for _ in range(2)]
+                else:
+                    while True:
+                        next_line = self.read()
+                        if next_line == 'Done': break
+                        else: response += f',{next_line}'
         return command, response[1:]
         
     
@@ -57,6 +68,7 @@ class ozopticsEPC400():
         """
         reset
         """
+        self.voltageCache[:] = [None]*self.channelNum
         return self.query('RST')
     
     
@@ -108,6 +120,7 @@ class ozopticsEPC400():
         with MAC or MDC
         """
         self.query(f'M{str(value)}')[0]
+        self.voltageCache[:] = [None]*self.channelNum
         return 0
 
 
@@ -125,6 +138,7 @@ class ozopticsEPC400():
         dataVoltages = re.findall(r"CH\d\s*([\d+-]+)", response)
         if len(dataVoltages) != 4:
             raise RuntimeError('unexpected voltage query response: {}'.format(response))
+        self.voltageCache[:] = [int(i) for i in dataVoltages]
         return [float(i)/1e3 for i in dataVoltages]
 
 
@@ -143,21 +157,55 @@ class ozopticsEPC400():
         
         self.query('V{:d},{:04d}'.format(channel+1, int(voltage*1e3)))[0]
         self.query(f'MDC')[0] ## not sure why but we need this one
+        self.voltageCache[channel] = int(voltage*1e3)
         return 0
     
 
     def setVoltages(self, voltages):
         """
         set the voltages for all channel
-        basically calling setVoltage for enumerate of the given voltage array
+        goes through setVoltagesBulk, so unchanged channels are skipped and MDC is sent once
 
         todo: get the number of channel of the device and assert if array length match
         """
-        
-        for chan, voltage in enumerate(voltages):
-            self.setVoltage(chan, voltage)
+        self.setVoltagesBulk(voltages)
         return 0
 
+
+    def setVoltagesBulk(self, voltages, readback=False, force=False):
+        """
+        set the voltages for several channels with the least round trips
+        one V command per channel whose target differs from the last value sent, then a single MDC for the batch
+        None in voltages leaves that channel untouched, force=True resends every given channel
+        readback=True adds one V? query and refreshes the cache from the device
+
+        return the update latency in s, also kept in lastLatency together with lastCommandNum
+        """
+        timeInit = time.perf_counter()
+        commandNum = 0
+        for chan, voltage in enumerate(voltages):
+            if voltage is None: continue
+
+            ## lower & upper limit
+            if voltage < -5.0: voltage = -5.0
+            elif voltage > 5.0: voltage = 5.0
+
+            milliVolt = int(voltage*1e3)
+            if not force and self.voltageCache[chan] == milliVolt: continue
+            self.query('V{:d},{:04d}'.format(chan+1, milliVolt))
+            self.voltageCache[chan] = milliVolt
+            commandNum += 1
+
+        if commandNum > 0:
+            self.query('MDC') ## not sure why but we need this one, once per batch is enough
+            commandNum += 1
+        if readback:
+            self.getVoltages()
+            commandNum += 1
+
+        self.lastLatency, self.lastCommandNum = time.perf_counter()-timeInit, commandNum
+        return self.lastLatency
+
     
     def closeDevice(self):
         """
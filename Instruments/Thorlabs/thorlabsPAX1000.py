@@ -1,10 +1,19 @@
-import os, time
-import pyvisa
+import time
+import threading
+import numpy as np
 from ctypes import *
 
+from .tlpaxBinding import TLPAXLibrary, bufferSize
+from ..visaRegistry import resourcePool
+
 ## libraries
-os.add_dll_directory(r'C:\Program Files\IVI Foundation\VISA\Win64\Bin')
-libPAX = cdll.LoadLibrary('TLPAX_64.dll')
+libPAX = TLPAXLibrary() ## prototypes from TLPAX.h, the DLL is only loaded on the first call
+
+## one record per scan in the acquisition ring buffer, same quantities as getSingleMeas
+dtypeScan = np.dtype([
+    ('scanID', '<i8'), ('hostTime', '<f8'), ('timeStamp', '<i8'),
+    ('S1', '<f8'), ('S2', '<f8'), ('S3', '<f8'),
+    ('power', '<f8'), ('DOP', '<f8'), ('azimuth', '<f8'), ('ellipticity', '<f8')])
 
 ## main
 class thorlabsPAX1000():
@@ -16,38 +25,60 @@ class thorlabsPAX1000():
     |---------------|----------|------------|------------------|------|---------------------------------------------|
     """
 
-    def __init__(self, portAddr=c_char_p(b''), measMode=c_int(9), wavelength=c_double(1550e-9), scanRate=c_double(100)):
+    def __init__(self, portAddr=None, measMode=c_int(9), wavelength=c_double(1550e-9), scanRate=c_double(100)):
         """
         constructor
+        portAddr: bytes resource name, found by initDev if None
         measMode: int, wavelength: double, scanRate: double
         """
-        self.instrHandler = c_ulong()
-        self.deviceCount = c_int()
-        self.manuName = c_char_p(b'')
-        self.modelName = c_char_p(b'')
-        self.serialNumber = c_char_p(b'')
-        self.manufacturer = c_char_p(b'')
-        self.deviceAvailable = c_bool()
-        self.latestScanID = c_int()
+        self.instrHandler = c_uint32()
+        self.deviceCount = c_uint32()
+        self.modelName = create_string_buffer(bufferSize)
+        self.serialNumber = create_string_buffer(bufferSize)
+        self.manufacturer = create_string_buffer(bufferSize)
+        self.deviceAvailable = c_uint16()
+        self.latestScanID = c_uint32()
+
+        ## output buffers of the single-shot getters, allocated once and reused under dllLock
+        self.scanID, self.timeStamp = c_uint32(), c_uint32()
+        self.s1, self.s2, self.s3 = c_double(), c_double(), c_double()
+        self.power, self.powerPolarized, self.powerUnpolarized = c_double(), c_double(), c_double()
+        self.dop, self.dolp, self.docp = c_double(), c_double(), c_double()
+        self.azimuthal, self.ellipticity = c_double(), c_double()
 
-        self.portAddr = portAddr
+        self.portAddr = create_string_buffer(bufferSize) if portAddr is None else create_string_buffer(portAddr, bufferSize)
+        self.setInstrumentName()
         self.IDQuery, self.resetDevice = True, False
         self.measMode, self.wavelength, self.scanRate = measMode, wavelength, scanRate
 
+        self.dllLock = threading.Lock() ## the scan calls are not shared between threads
+        self.ringLock = threading.Lock()
+        self.ringBuffer, self.ringCount, self.droppedScans = np.zeros(0, dtype=dtypeScan), 0, 0
+        self.acqThread, self.acqStopEvent = None, threading.Event()
+
+
+    def setInstrumentName(self):
+        """
+        key of the instrumentation statistics from the resource name, calls go through a libPAX view under that name
+        """
+        portAddr = self.portAddr.value.decode(errors='replace')
+        self.instrumentName = f'PAX1000 {portAddr}' if portAddr else 'PAX1000'
+        self.libPAX = libPAX.device(self.instrumentName)
+        return 0
+
 
     def getResourceID(self):
         """
-        get pyvisa resources
+        get pyvisa resources, discovered once per process
         """
-        resMan = pyvisa.ResourceManager()
-        return resMan.list_resources()
+        return resourcePool().list_resources()
 
 
     def getDevsNum(self):
         """
         get PAXs available in the system
         """
-        libPAX.TLPAX_findRsrc(self.handler, byref(self.deviceCount))
+        self.libPAX.TLPAX_findRsrc(self.instrHandler, byref(self.deviceCount))
         return self.deviceCount.value
 
 
@@ -55,9 +86,7 @@ class thorlabsPAX1000():
         """
         get device model
         """
-        libPAX.TLPAX_getRsrcInfo(0, 0, self.modelName, 0, 0, byref(self.deviceAvailable))
-        libPAX.TLPAX_getRsrcInfo(0, 0, 0, 0, self.manufacturer, byref(self.deviceAvailable))
-        libPAX.TLPAX_getRsrcInfo(0, 0, 0, self.serialNumber, 0, byref(self.deviceAvailable))
+        self.libPAX.TLPAX_getRsrcInfo(self.instrHandler, 0, self.modelName, self.serialNumber, self.manufacturer, byref(self.deviceAvailable))
         print('availability: {}, model: {}, manufacturer: {}, serial number: {}'\
                 .format(self.deviceAvailable.value, self.modelName.value, self.manufacturer.value, self.serialNumber.value))
         
@@ -72,22 +101,23 @@ class thorlabsPAX1000():
         benchmark the time delay
         """
         ## try to find any connected PAX
-        libPAX.TLPAX_findRsrc(self.instrHandler, byref(self.deviceCount))
+        self.libPAX.TLPAX_findRsrc(self.instrHandler, byref(self.deviceCount))
         if self.deviceCount.value < 1 :
             print('no PAX1000IR2 device found...')
             exit()
 
         ## if found, get the resource and connect to the first in the list
-        libPAX.TLPAX_getRsrcName(self.instrHandler, 0, self.portAddr) 
-        if libPAX.TLPAX_init(self.portAddr, self.IDQuery, self.resetDevice, byref(self.instrHandler)) != 0: 
+        self.libPAX.TLPAX_getRsrcName(self.instrHandler, 0, self.portAddr) 
+        self.setInstrumentName()
+        if self.libPAX.TLPAX_init(self.portAddr, self.IDQuery, self.resetDevice, byref(self.instrHandler)) != 0: 
             print('error with init...')
             exit()
         time.sleep(2)
 
         ## set default
-        libPAX.TLPAX_setMeasurementMode(self.instrHandler, self.measMode) ## default: < 2 revs for one measurement, 2048 points for FFT
-        libPAX.TLPAX_setWavelength(self.instrHandler, self.wavelength) ## default: 1550nm
-        libPAX.TLPAX_setBasicScanRate(self.instrHandler, self.scanRate) ## default: 100Hz
+        self.libPAX.TLPAX_setMeasurementMode(self.instrHandler, self.measMode) ## default: < 2 revs for one measurement, 2048 points for FFT
+        self.libPAX.TLPAX_setWavelength(self.instrHandler, self.wavelength) ## default: 1550nm
+        self.libPAX.TLPAX_setBasicScanRate(self.instrHandler, self.scanRate) ## default: 100Hz
         time.sleep(5)
     
 
@@ -95,10 +125,10 @@ class thorlabsPAX1000():
         """
         get current setting
         """
-        wavelength, mode, scanrate = c_double(), c_int(), c_double()
-        libPAX.TLPAX_getWavelength(self.instrHandler, byref(wavelength))
-        libPAX.TLPAX_getMeasurementMode(self.instrHandler, byref(mode))
-        libPAX.TLPAX_getBasicScanRate(self.instrHandler, byref(scanrate))
+        wavelength, mode, scanrate = c_double(), c_int32(), c_double()
+        self.libPAX.TLPAX_getWavelength(self.instrHandler, byref(wavelength))
+        self.libPAX.TLPAX_getMeasurementMode(self.instrHandler, byref(mode))
+        self.libPAX.TLPAX_getBasicScanRate(self.instrHandler, byref(scanrate))
         return '*CFG?', {
             'wavelength [nm]': wavelength.value*1e9,
             'mode': mode.value,
@@ -114,23 +144,18 @@ class thorlabsPAX1000():
         normalized S1, normalized S2, normalized S3 [floats]
         power, degree of polarization, azimuth, ellipticity [floats]
         """
-        currID = c_int()
-        datetime = c_int()
-        s1, s2, s3 = c_double(), c_double(), c_double()
-        power, powerPolarized, powerUnpolarized = c_double(), c_double(), c_double()
-        dop, dolp, docp = c_double(), c_double(), c_double()
-        azimuthal, ellipticity = c_double(), c_double()
-
-        libPAX.TLPAX_getLatestScan(self.instrHandler, byref(currID))
-        libPAX.TLPAX_getTimeStamp(self.instrHandler, currID.value, byref(datetime))
-        libPAX.TLPAX_getStokesNormalized(self.instrHandler, currID.value, byref(s1), byref(s2), byref(s3))
-        libPAX.TLPAX_getPower(self.instrHandler, currID.value, byref(power), byref(powerPolarized), byref(powerUnpolarized))
-        libPAX.TLPAX_getDOP(self.instrHandler, currID.value, byref(dop), byref(dolp), byref(docp))
-        libPAX.TLPAX_getPolarization(self.instrHandler, currID.value, byref(azimuthal), byref(ellipticity))
-        
-        libPAX.TLPAX_releaseScan(self.instrHandler, currID)
-        self.latestScanID = currID
-        return [int(datetime.value), float(s1.value), float(s2.value), float(s3.value), float(power.value), float(dop.value), float(azimuthal.value), float(ellipticity.value)]
+        with self.dllLock:
+            self.libPAX.TLPAX_getLatestScan(self.instrHandler, byref(self.scanID))
+            currID = self.scanID.value
+            self.libPAX.TLPAX_getTimeStamp(self.instrHandler, currID, byref(self.timeStamp))
+            self.libPAX.TLPAX_getStokesNormalized(self.instrHandler, currID, byref(self.s1), byref(self.s2), byref(self.s3))
+            self.libPAX.TLPAX_getPower(self.instrHandler, currID, byref(self.power), byref(self.powerPolarized), byref(self.powerUnpolarized))
+            self.libPAX.TLPAX_getDOP(self.instrHandler, currID, byref(self.dop), byref(self.dolp), byref(self.docp))
+            self.libPAX.TLPAX_getPolarization(self.instrHandler, currID, byref(self.azimuthal), byref(self.ellipticity))
+            
+            self.libPAX.TLPAX_releaseScan(self.instrHandler, currID)
+            self.latestScanID.value = currID
+            return [self.timeStamp.value, self.s1.value, self.s2.value, self.s3.value, self.power.value, self.dop.value, self.azimuthal.value, self.ellipticity.value]
     
 
     def getPower(self):
@@ -139,15 +164,14 @@ class thorlabsPAX1000():
         
         return power in float
         """
-        currID = c_int()
-        power, powerPolarized, powerUnpolarized = c_double(), c_double(), c_double()
-
-        libPAX.TLPAX_getLatestScan(self.instrHandler, byref(currID))
-        libPAX.TLPAX_getPower(self.instrHandler, currID.value, byref(power), byref(powerPolarized), byref(powerUnpolarized))
-        
-        libPAX.TLPAX_releaseScan(self.instrHandler, currID)
-        self.latestScanID = currID
-        return float(power.value)
+        with self.dllLock:
+            self.libPAX.TLPAX_getLatestScan(self.instrHandler, byref(self.scanID))
+            currID = self.scanID.value
+            self.libPAX.TLPAX_getPower(self.instrHandler, currID, byref(self.power), byref(self.powerPolarized), byref(self.powerUnpolarized))
+            
+            self.libPAX.TLPAX_releaseScan(self.instrHandler, currID)
+            self.latestScanID.value = currID
+            return self.power.value
 
 
     def getStokes(self):
@@ -157,21 +181,107 @@ class thorlabsPAX1000():
         return an array of floats:
         normalized S1, normalized S2, normalized S3
         """
-        currID = c_int()
-        power, powerPolarized, powerUnpolarized = c_double(), c_double(), c_double()
+        with self.dllLock:
+            self.libPAX.TLPAX_getLatestScan(self.instrHandler, byref(self.scanID))
+            currID = self.scanID.value
+            self.libPAX.TLPAX_getPower(self.instrHandler, currID, byref(self.power), byref(self.powerPolarized), byref(self.powerUnpolarized))
+            self.libPAX.TLPAX_getStokesNormalized(self.instrHandler, currID, byref(self.s1), byref(self.s2), byref(self.s3))
+            
+            self.libPAX.TLPAX_releaseScan(self.instrHandler, currID)
+            self.latestScanID.value = currID
+            return [self.power.value, self.s1.value, self.s2.value, self.s3.value]
+
+
+    def startAcquisition(self, bufferSize=2**16, pollInterval=None):
+        """
+        continuous acquisition: a dedicated thread drains every new scan ID into a preallocated ring buffer of dtypeScan
+        the DLL only exposes the latest scan, so IDs skipped between two polls are counted in droppedScans
+        pollInterval defaults to half a scan period
+
+        read with latest() and readSince(scanID), neither blocks on the DLL
+        """
+        if self.acqThread is not None: return 0
+        if pollInterval is None: pollInterval = 0.5/getattr(self.scanRate, 'value', self.scanRate)
+
+        self.ringBuffer, self.ringCount, self.droppedScans = np.zeros(bufferSize, dtype=dtypeScan), 0, 0
+        self.acqStopEvent.clear()
+        self.acqThread = threading.Thread(target=self.acquisitionLoop, args=(pollInterval,), daemon=True)
+        self.acqThread.start()
+        return 0
+
+
+    def acquisitionLoop(self, pollInterval):
+        """
+        body of the acquisition thread, output buffers are allocated once
+        """
+        currID, timeStamp = c_uint32(), c_uint32()
         s1, s2, s3 = c_double(), c_double(), c_double()
+        power, powerPolarized, powerUnpolarized = c_double(), c_double(), c_double()
+        dop, dolp, docp = c_double(), c_double(), c_double()
+        azimuthal, ellipticity = c_double(), c_double()
+        lastID = None
 
-        libPAX.TLPAX_getLatestScan(self.instrHandler, byref(currID))
-        libPAX.TLPAX_getPower(self.instrHandler, currID.value, byref(power), byref(powerPolarized), byref(powerUnpolarized))
-        libPAX.TLPAX_getStokesNormalized(self.instrHandler, currID.value, byref(s1), byref(s2), byref(s3))
-        
-        libPAX.TLPAX_releaseScan(self.instrHandler, currID)
-        self.latestScanID = currID
-        return [float(power.value), float(s1.value), float(s2.value), float(s3.value)]
+        while not self.acqStopEvent.is_set():
+            with self.dllLock:
+                newScan = self.libPAX.TLPAX_getLatestScan(self.instrHandler, byref(currID)) == 0
+                if newScan:
+                    newScan = currID.value != lastID
+                    if newScan:
+                        self.libPAX.TLPAX_getTimeStamp(self.instrHandler, currID.value, byref(timeStamp))
+                        self.libPAX.TLPAX_getStokesNormalized(self.instrHandler, currID.value, byref(s1), byref(s2), byref(s3))
+                        self.libPAX.TLPAX_getPower(self.instrHandler, currID.value, byref(power), byref(powerPolarized), byref(powerUnpolarized))
+                        self.libPAX.TLPAX_getDOP(self.instrHandler, currID.value, byref(dop), byref(dolp), byref(docp))
+                        self.libPAX.TLPAX_getPolarization(self.instrHandler, currID.value, byref(azimuthal), byref(ellipticity))
+                    self.libPAX.TLPAX_releaseScan(self.instrHandler, currID.value)
+
+            if not newScan:
+                self.acqStopEvent.wait(pollInterval)
+                continue
+
+            if lastID is not None and currID.value > lastID+1: self.droppedScans += currID.value-lastID-1
+            lastID = currID.value
+            with self.ringLock:
+                self.ringBuffer[self.ringCount % self.ringBuffer.size] = (
+                    currID.value, time.time(), timeStamp.value, s1.value, s2.value, s3.value,
+                    power.value, dop.value, azimuthal.value, ellipticity.value)
+                self.ringCount += 1
+
+
+    def stopAcquisition(self):
+        """
+        stop the acquisition thread, the ring buffer stays readable
+        """
+        if self.acqThread is None: return 0
+        self.acqStopEvent.set()
+        self.acqThread.join()
+        self.acqThread = None
+        return 0
+
+
+    def latest(self):
+        """
+        copy of the newest scan record, None if nothing was acquired yet
+        """
+        with self.ringLock:
+            if self.ringCount == 0: return None
+            return self.ringBuffer[(self.ringCount-1) % self.ringBuffer.size].copy()
+
+
+    def readSince(self, scanID=-1):
+        """
+        copy of all buffered records with a scan ID newer than scanID, oldest first
+        records overwritten by the ring before being read are lost, pass the last scanID seen to read incrementally
+        """
+        with self.ringLock:
+            recordNum = min(self.ringCount, self.ringBuffer.size)
+            index = np.arange(self.ringCount-recordNum, self.ringCount) % max(self.ringBuffer.size, 1)
+            start = np.searchsorted(self.ringBuffer['scanID'][index], scanID, side='right')
+            return self.ringBuffer[index[start:]]
 
 
     def closeDevice(self):
         """
         close the device
         """
-        return libPAX.TLPAX_close(self.instrHandler)
\ No newline at end of file
+        self.stopAcquisition()
+        return self.libPAX.TLPAX_close(self.instrHandler)
\ No newline at end of file
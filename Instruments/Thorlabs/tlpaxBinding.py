@@ -0,0 +1,169 @@
+import os, re
+from ctypes import *
+
+from ..instrumentation import instrumentedCall
+
+## libraries
+headerPathDefault = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TLPAX.h')
+dllDirectoryDefault = r'C:\Program Files\IVI Foundation\VISA\Win64\Bin'
+libNameDefault = 'TLPAX_64.dll'
+bufferSize = 1024 ## TLPAX_BUFFER_SIZE
+
+## VISA types of vpptype.h, pointers are either ViP<type>, <type> *name or <type> name[]
+visaTypes = {
+    'ViSession': c_uint32, 'ViStatus': c_int32, 'ViAttr': c_uint32,
+    'ViUInt32': c_uint32, 'ViInt32': c_int32, 'ViUInt16': c_uint16, 'ViInt16': c_int16,
+    'ViBoolean': c_uint16, 'ViReal64': c_double, 'ViReal32': c_float,
+}
+visaStrings = ('ViChar', 'ViRsrc', 'ViString', 'ViConstString', 'ViPChar', 'ViConstRsrc')
+
+
+def parameterType(parameter):
+    """
+    ctypes type of a single C parameter declaration, None if unknown
+    """
+    match = re.match(r'(?:const\s+)?(\w+)\s*(\*)?\s*(\w+)?\s*(\[[^\]]*\])?$', ' '.join(parameter.split()))
+    if match is None: return None
+    typeName, isPointer = match.group(1), bool(match.group(2) or match.group(4))
+    if typeName == 'void' and not isPointer: return ()
+    if typeName in visaStrings: return c_char_p ## accepts bytes and create_string_buffer output buffers
+    if typeName.startswith('ViP') and 'Vi' + typeName[3:] in visaTypes:
+        return POINTER(visaTypes['Vi' + typeName[3:]])
+    if typeName in visaTypes:
+        return POINTER(visaTypes[typeName]) if isPointer else visaTypes[typeName]
+    return None
+
+
+def parseHeader(headerPath=headerPathDefault, prefix='TLPAX_'):
+    """
+    ctypes prototypes of all ViStatus functions declared in a VXIpnp header
+    return dict of name: list of argtypes, functions with an unknown parameter type are left out
+    """
+    with open(headerPath, encoding='latin-1') as fileHandler:
+        header = fileHandler.read()
+    header = re.sub(r'/\*.*?\*/', '', header, flags=re.S)
+    header = re.sub(r'//[^\n]*', '', header)
+
+    prototypes = {}
+    for name, parameters in re.findall(r'ViStatus\s+_VI_FUNC\s+(' + prefix + r'\w+)\s*\(([^)]*)\)\s*;', header):
+        argTypes = [parameterType(parameter) for parameter in parameters.split(',')]
+        if argTypes == [()]: argTypes = []
+        if None not in argTypes: prototypes[name] = argTypes
+    return prototypes
+
+
+## main
+class TLPAXLibrary():
+    """
+    lazily loaded TLPAX driver library with prototypes declared once from TLPAX.h
+    nothing is loaded at import, the library is opened on the first function call
+    every function is bound once, through the instrumentation hook, under instrumentName
+    device(instrumentName) gives a view of the same library recording under the name of one device
+
+    libPath: path or name of the library, the TLPAX_LIBRARY environment variable overrides the default TLPAX_64.dll
+    a stand-in shared library exporting the same symbols can be used on Linux
+    any python object with TLPAX_* methods can also be attached, e.g. a simulator
+
+    example flow
+    libPAX = TLPAXLibrary()
+    libPAX.TLPAX_findRsrc(0, byref(deviceCount))     ## loads the library here
+    libPAX.setLibraryPath('./libtlpax_sim.so')      ## or libPAX.attach(simulatedPAX)
+    libDevice = libPAX.device('PAX1000 ' + portAddr) ## statistics of one PAX apart from the others
+    """
+
+    def __init__(self, libPath=None, dllDirectory=dllDirectoryDefault, headerPath=headerPathDefault, instrumentName='PAX1000'):
+        """
+        constructor
+        """
+        self.libPath, self.instrumentName = libPath, instrumentName
+        self.dllDirectory, self.headerPath = dllDirectory, headerPath
+        self.lib = None
+        self.prototypes = None
+        self.devices = {} ## instrumentName: TLPAXDevice
+
+
+    def load(self):
+        """
+        open the library and bind the prototypes, only the first call does any work
+        """
+        if self.lib is not None: return self.lib
+
+        libPath = self.libPath or os.environ.get('TLPAX_LIBRARY') or libNameDefault
+        if hasattr(os, 'add_dll_directory') and os.path.isdir(self.dllDirectory):
+            os.add_dll_directory(self.dllDirectory)
+        lib = cdll.LoadLibrary(libPath)
+
+        if self.prototypes is None: self.prototypes = parseHeader(self.headerPath)
+        for name, argTypes in self.prototypes.items():
+            try: function = getattr(lib, name)
+            except AttributeError: continue
+            function.argtypes, function.restype = argTypes, c_int32
+        self.lib = lib
+        return lib
+
+
+    def attach(self, lib):
+        """
+        use an already loaded library or a python stand-in instead of loading libPath
+        """
+        self.unload()
+        self.lib = lib
+        return lib
+
+
+    def setLibraryPath(self, libPath):
+        """
+        point at another library, loaded on the next call
+        """
+        self.unload()
+        self.libPath = libPath
+
+
+    def unload(self):
+        """
+        forget the current library and its bound functions
+        """
+        for name in list(vars(self)):
+            if name.startswith('TLPAX_'): delattr(self, name)
+        for device in self.devices.values(): device.unbind()
+        self.lib = None
+
+
+    def device(self, instrumentName):
+        """
+        view of this library whose calls are recorded under instrumentName, one per name
+        """
+        if instrumentName not in self.devices: self.devices[instrumentName] = TLPAXDevice(self, instrumentName)
+        return self.devices[instrumentName]
+
+
+    def __getattr__(self, name):
+        if not name.startswith('TLPAX_'): raise AttributeError(name)
+        function = instrumentedCall(self.instrumentName, name, getattr(self.load(), name))
+        setattr(self, name, function) ## bound once, later calls skip __getattr__
+        return function
+
+
+class TLPAXDevice():
+    """
+    the functions of a TLPAXLibrary recorded under the instrumentName of one device, e.g. 'PAX1000 <resource name>'
+    loading, attach and unload stay with the library, the bound functions are dropped when it unloads
+    """
+
+    def __init__(self, library, instrumentName):
+        """
+        constructor
+        """
+        self.library, self.instrumentName = library, instrumentName
+
+
+    def unbind(self):
+        for name in list(vars(self)):
+            if name.startswith('TLPAX_'): delattr(self, name)
+
+
+    def __getattr__(self, name):
+        if not name.startswith('TLPAX_'): raise AttributeError(name)
+        function = instrumentedCall(self.instrumentName, name, getattr(self.library.load(), name))
+        setattr(self, name, function)
+        return function
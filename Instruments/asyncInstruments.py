@@ -0,0 +1,141 @@
+import asyncio, functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .OzOptics import ozopticsEPC400
+from .Thorlabs import thorlabsPAX1000
+from .Agilent import agilent3320A
+
+## main
+class AsyncInstrument():
+    """
+    asyncio front end of a blocking driver
+    every call runs in a single worker thread owned by this instrument, under its lock, so the calls of one instrument
+    never overlap while different instruments run in parallel: a cycle takes as long as the slowest device, not the sum
+
+    any driver method is available as a coroutine: await asyncEpc.getVoltages()
+    cancelling the awaiting task (or timeout) drops calls still queued; a call already on the bus cannot be interrupted,
+    it finishes in the worker thread and the next call waits for it
+    lock is a threading.RLock, hold it to use the driver from synchronous code (e.g. a widget callback) in between
+    """
+
+    def __init__(self, driver, timeout=None, name=None):
+        """
+        constructor
+        driver: a blocking driver instance, timeout: default s per call, None to wait forever
+        """
+        self.driver, self.timeout = driver, timeout
+        self.name = name or getattr(driver, 'instrumentName', type(driver).__name__)
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+
+
+    @classmethod
+    async def open(cls, driverClass, *args, timeout=None, **kwargs):
+        """
+        construct driverClass(*args, **kwargs) off the event loop, constructors block on the bus too
+        """
+        driver = await asyncio.get_running_loop().run_in_executor(None, functools.partial(driverClass, *args, **kwargs))
+        return cls(driver, timeout)
+
+
+    def locked(self, method, *args, **kwargs):
+        with self.lock:
+            return method(*args, **kwargs)
+
+
+    async def call(self, methodName, *args, timeout=None, **kwargs):
+        """
+        run driver.methodName(*args, **kwargs) in the worker thread
+        timeout in s overrides the default one, asyncio.TimeoutError when exceeded
+        """
+        method = getattr(self.driver, methodName)
+        future = asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(self.locked, method, *args, **kwargs))
+        return await asyncio.wait_for(future, timeout if timeout is not None else self.timeout)
+
+
+    async def run(self, fun, *args, timeout=None):
+        """
+        run fun(driver, *args) in the worker thread under the lock, for sequences that must not interleave with other calls
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(self.locked, fun, self.driver, *args))
+        return await asyncio.wait_for(future, timeout if timeout is not None else self.timeout)
+
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not callable(getattr(self.driver, name, None)): raise AttributeError(name)
+        async def method(*args, timeout=None, **kwargs):
+            return await self.call(name, *args, timeout=timeout, **kwargs)
+        method.__name__ = name
+        return method
+
+
+    async def close(self):
+        """
+        close the device in the worker thread, then drop the queued calls and the thread
+        """
+        try:
+            return await self.call('closeDevice')
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncEPC400(AsyncInstrument):
+    """
+    async ozopticsEPC400
+
+    example flow
+    epc = await AsyncEPC400.connect('ASRL3::INSTR')
+    await epc.setVoltagesBulk([1.0, -0.5, 0.2, 0.0], timeout=5)
+    """
+
+    @classmethod
+    async def connect(cls, portAddr, timeout=None, **kwargs):
+        return await cls.open(ozopticsEPC400, portAddr, timeout=timeout, **kwargs)
+
+
+class AsyncAgilent3320A(AsyncInstrument):
+    """
+    async agilent3320A
+
+    example flow
+    funcGen = await AsyncAgilent3320A.connect('GPIB::10')
+    await funcGen.configure(signalShape='SQUARE', signalFreq=24.5e3, burstState=1, triggerSource='BUS')
+    await funcGen.trigger()
+    """
+
+    @classmethod
+    async def connect(cls, portAddr, timeout=None, **kwargs):
+        return await cls.open(agilent3320A, portAddr, timeout=timeout, **kwargs)
+
+
+class AsyncPAX1000(AsyncInstrument):
+    """
+    async thorlabsPAX1000, the ring buffer of startAcquisition is read without going through the worker thread
+
+    example flow
+    pax = await AsyncPAX1000.connect()
+    await pax.startAcquisition()
+    async for records in pax.scans():
+        ...
+    """
+
+    @classmethod
+    async def connect(cls, timeout=None, **kwargs):
+        pax = await cls.open(thorlabsPAX1000, timeout=timeout, **kwargs)
+        await pax.initDev()
+        return pax
+
+
+    async def scans(self, scanID=-1, pollInterval=None):
+        """
+        async generator of the records acquired since scanID, as batches from readSince
+        pollInterval defaults to one scan period, the generator ends when acquisition is stopped
+        """
+        if pollInterval is None: pollInterval = 1/getattr(self.driver.scanRate, 'value', self.driver.scanRate)
+        while self.driver.acqThread is not None:
+            records = self.driver.readSince(scanID)
+            if records.size:
+                scanID = int(records['scanID'][-1])
+                yield records
+            await asyncio.sleep(pollInterval)
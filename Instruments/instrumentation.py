@@ -0,0 +1,228 @@
+import re, csv, json, time
+import bisect, functools, threading
+
+## libraries
+enabled = False ## checked first by every hook, nothing else runs while False
+histogramEdges = [10**(exponent/4) for exponent in range(-24, 9)] ## s, 1 us to 100 s, 4 bins per decade
+timeoutCodes = (-1073807339,) ## VI_ERROR_TMO
+
+stats = {} ## instrument: {command: CommandStats}
+statsLock = threading.Lock()
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """
+    drop all recorded statistics
+    """
+    with statsLock: stats.clear()
+
+
+def commandHeader(command):
+    """
+    statistics key of a command: its leading header, so that V1,1234 and V2,-50 both count as V
+    """
+    if not isinstance(command, str): return str(command)
+    return re.match(r'\s*([*:A-Za-z?_]*)', command).group(1) or command.strip()[:16]
+
+
+def payloadSize(value):
+    """
+    bytes of a command or response, the last item of a (command, response) tuple
+    """
+    if isinstance(value, tuple) and value: value = value[-1]
+    if isinstance(value, (str, bytes)): return len(value)
+    return 0
+
+
+def isTimeout(error):
+    return isinstance(error, TimeoutError) or getattr(error, 'error_code', None) in timeoutCodes
+
+
+class CommandStats():
+    """
+    counters and latency histogram of one command of one instrument
+    """
+
+    def __init__(self):
+        """
+        constructor
+        """
+        self.count, self.errors, self.timeouts = 0, 0, 0
+        self.bytesOut, self.bytesIn, self.totalTime, self.maxTime = 0, 0, 0.0, 0.0
+        self.histogram = [0]*(len(histogramEdges)+1) ## bin i counts latencies below histogramEdges[i]
+        self.lock = threading.Lock()
+
+
+    def add(self, latency, bytesOut=0, bytesIn=0, error=None):
+        with self.lock:
+            self.count += 1
+            self.totalTime += latency
+            if latency > self.maxTime: self.maxTime = latency
+            self.bytesOut += bytesOut
+            self.bytesIn += bytesIn
+            self.histogram[bisect.bisect_right(histogramEdges, latency)] += 1
+            if error is not None:
+                self.errors += 1
+                if isTimeout(error): self.timeouts += 1
+
+
+    def percentile(self, q):
+        """
+        upper edge of the histogram bin holding the q quantile, q in 0..1
+        """
+        target, cumulated = q*self.count, 0
+        for i, binCount in enumerate(self.histogram):
+            cumulated += binCount
+            if cumulated >= target and binCount: return histogramEdges[i] if i < len(histogramEdges) else self.maxTime
+        return 0.0
+
+
+    def snapshot(self):
+        with self.lock:
+            return {'count': self.count, 'errors': self.errors, 'timeouts': self.timeouts,
+                    'bytesOut': self.bytesOut, 'bytesIn': self.bytesIn, 'totalTime': self.totalTime,
+                    'mean': self.totalTime/self.count if self.count else 0.0, 'max': self.maxTime,
+                    'p50': self.percentile(0.5), 'p99': self.percentile(0.99), 'histogram': list(self.histogram)}
+
+
+def commandStats(instrument, command):
+    instrumentStats = stats.get(instrument)
+    if instrumentStats is None:
+        with statsLock: instrumentStats = stats.setdefault(instrument, {})
+    entry = instrumentStats.get(command)
+    if entry is None:
+        with statsLock: entry = instrumentStats.setdefault(command, CommandStats())
+    return entry
+
+
+def record(instrument, command, latency, bytesOut=0, bytesIn=0, error=None):
+    """
+    add one call to the statistics, for code paths that time themselves
+    """
+    if not enabled: return
+    commandStats(instrument, command).add(latency, bytesOut, bytesIn, error)
+
+
+def snapshot():
+    """
+    copy of all statistics: {instrument: {command: {count, errors, timeouts, bytesOut, bytesIn, totalTime, mean, max, p50, p99, histogram}}}
+    latencies in s, p50/p99 are the upper edges of histogramEdges bins
+    """
+    with statsLock: items = [(instrument, list(commands.items())) for instrument, commands in stats.items()]
+    return {instrument: {command: entry.snapshot() for command, entry in commands} for instrument, commands in items}
+
+
+## hooks
+def instrumented(instrument):
+    """
+    decorator for driver methods taking the command as first argument (query, write)
+    the instance attribute instrumentName, if set, is used instead of instrument, e.g. to tell two EPC400 apart
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, command, *args):
+            if not enabled: return method(self, command, *args)
+
+            timeInit = time.perf_counter()
+            try:
+                result = method(self, command, *args)
+            except Exception as error:
+                commandStats(getattr(self, 'instrumentName', instrument), commandHeader(command)).add(time.perf_counter()-timeInit, payloadSize(command), 0, error)
+                raise
+            commandStats(getattr(self, 'instrumentName', instrument), commandHeader(command)).add(time.perf_counter()-timeInit, payloadSize(command), payloadSize(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def instrumentedCall(instrument, name, function):
+    """
+    wrap a library function, e.g. a TLPAX_* DLL call, a non-zero integer status counts as an error
+    """
+    def wrapper(*args):
+        if not enabled: return function(*args)
+
+        timeInit = time.perf_counter()
+        try:
+            status = function(*args)
+        except Exception as error:
+            commandStats(instrument, name).add(time.perf_counter()-timeInit, error=error)
+            raise
+        commandStats(instrument, name).add(time.perf_counter()-timeInit, error=status if isinstance(status, int) and status != 0 else None)
+        return status
+    wrapper.__name__ = name
+    return wrapper
+
+
+## sinks
+columnNamesSink = ['time', 'instrument', 'command', 'count', 'errors', 'timeouts', 'bytesOut', 'bytesIn', 'totalTime', 'mean', 'max', 'p50', 'p99']
+
+def snapshotRows(snap=None, timeStamp=None):
+    """
+    flat rows of a snapshot, one per instrument and command, without the histogram
+    """
+    if snap is None: snap = snapshot()
+    if timeStamp is None: timeStamp = time.time()
+    return [dict({key: value for key, value in entry.items() if key != 'histogram'}, time=timeStamp, instrument=instrument, command=command)
+            for instrument, commands in snap.items() for command, entry in commands.items()]
+
+
+def writeSnapshot(fileName, snap=None):
+    """
+    append the current statistics to fileName, as csv rows if it ends with .csv, otherwise as one json line per row
+    """
+    rows = snapshotRows(snap)
+    if fileName.endswith('.csv'):
+        with open(fileName, 'a', newline='') as fileHandler:
+            writer = csv.DictWriter(fileHandler, columnNamesSink)
+            if fileHandler.tell() == 0: writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(fileName, 'a') as fileHandler:
+            fileHandler.writelines(json.dumps(row) + '\n' for row in rows)
+    return len(rows)
+
+
+class StatsSink():
+    """
+    background thread appending a snapshot to fileName every interval s, for long runs
+
+    example flow
+    instrumentation.enable()
+    sink = instrumentation.StatsSink('loop-stats.jsonl', interval=60)
+    ... feedback loop ...
+    sink.stop()
+    instrumentation.snapshot()['EPC400 ASRL3::INSTR']['V']['p99']
+    """
+
+    def __init__(self, fileName, interval=10.0):
+        """
+        constructor, starts the thread
+        """
+        self.fileName, self.interval = fileName, interval
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+
+    def loop(self):
+        while not self.stopEvent.wait(self.interval):
+            writeSnapshot(self.fileName)
+
+
+    def stop(self):
+        """
+        stop the thread and write a last snapshot
+        """
+        self.stopEvent.set()
+        self.thread.join()
+        writeSnapshot(self.fileName)
@@ -0,0 +1,463 @@
+import re, time
+import threading
+import numpy as np
+
+## libraries
+## default timing, rough figures to be replaced by measured ones: (base s per command, exponential jitter s, bytes/s on the bus)
+latencyEPC400 = (2e-3, 0.5e-3, 11520) ## USB-serial at 115200 baud, 8N1
+perCommandEPC400 = {'MDC': 10e-3, 'RST': 100e-3} ## MDC latches the DACs
+latencyPAX1000 = (50e-6, 20e-6, None) ## one DLL call, the scans themselves come at scanRate
+latency3320A = (1e-3, 0.2e-3, 1e6) ## GPIB message overhead, plus parseTime per SCPI header
+
+def setRef(ref, value):
+    """
+    write an output argument passed by byref(...) or as a string buffer
+    """
+    target = getattr(ref, '_obj', ref)
+    target.value = value
+
+
+def rotationMatrix(axis, angle):
+    """
+    rotation of the Poincare sphere by angle in rad around a unit axis, Rodrigues formula
+    """
+    x, y, z = np.asarray(axis, dtype=np.float64)/np.linalg.norm(axis)
+    cross = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    return np.eye(3) + np.sin(angle)*cross + (1-np.cos(angle))*(cross @ cross)
+
+
+class SimClock():
+    """
+    time base shared by the simulated instruments
+    realTime=True sleeps for every modelled delay, realTime=False only advances a virtual time, for fast regression runs
+    """
+
+    def __init__(self, realTime=True):
+        """
+        constructor
+        """
+        self.realTime = realTime
+        self.timeInit = time.perf_counter()
+        self.virtualTime = 0.0
+        self.lock = threading.Lock()
+
+
+    def now(self):
+        """
+        seconds since the clock was created
+        """
+        if self.realTime: return time.perf_counter() - self.timeInit
+        return self.virtualTime
+
+
+    def sleep(self, seconds):
+        """
+        spend seconds of instrument time
+        """
+        if seconds <= 0: return
+        if self.realTime:
+            timeEnd = time.perf_counter() + seconds
+            if seconds > 2e-3: time.sleep(seconds - 1e-3) ## time.sleep overshoots, spin the last ms
+            while time.perf_counter() < timeEnd: pass
+        else:
+            with self.lock: self.virtualTime += seconds
+
+
+class LatencyModel():
+    """
+    delay of one command: base (or perCommand[command]) + exponential jitter + byteNum/throughput
+    the exponential tail gives a p99 well above the median, like a USB/GPIB stack under load
+    """
+
+    def __init__(self, base=1e-3, jitter=0.0, throughput=None, perCommand=None, seed=None):
+        """
+        constructor
+        base, jitter: s, throughput: bytes/s or None for no transfer cost, perCommand: dict of command: base in s
+        """
+        self.base, self.jitter, self.throughput = base, jitter, throughput
+        self.perCommand = dict(perCommand or {})
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+
+
+    def delay(self, command=None, byteNum=0):
+        """
+        seconds taken by command with byteNum bytes on the bus
+        """
+        seconds = self.perCommand.get(command, self.base)
+        if self.jitter > 0:
+            with self.lock: seconds += self.rng.exponential(self.jitter)
+        if self.throughput: seconds += byteNum/self.throughput
+        return seconds
+
+
+class OpticalModel():
+    """
+    EPC voltages -> state of polarization on the Poincare sphere -> polarizer power and fringe visibility
+
+    every EPC channel is a fiber squeezer, a linear retarder of phase pi*V/vPi whose axis alternates 0/45 deg,
+    i.e. a rotation around S1 or S2. the input SOP drifts by rotating around driftAxis at driftRate rad/s
+    the reference SOP is the polarizer axis, or the polarization of the other interferometer arm
+    """
+
+    def __init__(self, vPi=2.5, axes=(0, 45, 0, 45), inputSop=(0, 0, 1), referenceSop=(1, 0, 0), power=1e-3, visibilityMax=0.98,
+                 dop=1.0, driftRate=0.0, driftAxis=(0, 1, 0), noise=0.0, clock=None, seed=None):
+        """
+        constructor
+        vPi: V, axes: deg, power: W, driftRate: rad/s, noise: standard deviation of the measured Stokes components
+        """
+        self.vPi = vPi
+        self.channelAxes = [(np.cos(np.deg2rad(2*axis)), np.sin(np.deg2rad(2*axis)), 0.0) for axis in axes]
+        self.inputSop = np.asarray(inputSop, dtype=np.float64)/np.linalg.norm(inputSop)
+        self.referenceSop = np.asarray(referenceSop, dtype=np.float64)/np.linalg.norm(referenceSop)
+        self.power, self.visibilityMax, self.dop = power, visibilityMax, dop
+        self.driftRate, self.driftAxis, self.noise = driftRate, driftAxis, noise
+        self.clock = clock if clock is not None else SimClock()
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.setVoltages([0.0]*len(axes))
+
+
+    def setVoltages(self, voltages):
+        """
+        apply channel voltages in V, the controller transfer matrix is computed once here
+        """
+        matrix = np.eye(3)
+        for axis, voltage in zip(self.channelAxes, voltages):
+            matrix = rotationMatrix(axis, np.pi*voltage/self.vPi) @ matrix
+        with self.lock:
+            self.voltages, self.transferMatrix = list(voltages), matrix
+
+
+    def sop(self, t=None):
+        """
+        normalized Stokes vector after the controller at time t in s (now if None), noiseless
+        """
+        if t is None: t = self.clock.now()
+        sopIn = self.inputSop if self.driftRate == 0 else rotationMatrix(self.driftAxis, self.driftRate*t) @ self.inputSop
+        with self.lock: return self.transferMatrix @ sopIn
+
+
+    def measure(self, t=None):
+        """
+        what a polarimeter reads: normalized S1, S2, S3 with noise, total power in W and DOP
+        """
+        stokes = self.sop(t)
+        if self.noise > 0:
+            with self.lock: stokes = stokes + self.rng.normal(0, self.noise, 3)
+            stokes /= np.linalg.norm(stokes)
+        return stokes, self.power, self.dop
+
+
+    def overlap(self, t=None):
+        """
+        power overlap (1 + s.r)/2 of the output SOP s with the reference SOP r, 1 when aligned
+        """
+        return 0.5*(1 + self.dop*float(self.sop(t) @ self.referenceSop))
+
+
+    def polarizerPower(self, t=None):
+        """
+        power in W behind a polarizer along referenceSop
+        """
+        return self.power*self.overlap(t)
+
+
+    def visibility(self, t=None):
+        """
+        fringe visibility against a reference arm of polarization referenceSop, field overlap times visibilityMax
+        """
+        return self.visibilityMax*np.sqrt(self.overlap(t))
+
+
+## main
+class SimResource():
+    """
+    pyvisa-like message resource: write() queues reply lines, read() pops them
+    subclasses implement reply(command), which returns the list of lines to queue
+    """
+
+    def __init__(self, latency, clock=None):
+        """
+        constructor
+        """
+        self.latency = latency
+        self.clock = clock if clock is not None else SimClock()
+        self.replyLines = []
+        self.write_termination, self.read_termination, self.timeout = '\r\n', '\r\n', 2000
+        self.commandCount, self.busyTime = {}, 0.0
+        self.lock = threading.Lock() ## one bus, one command at a time
+        self.isOpen = True
+
+
+    def spend(self, seconds):
+        self.busyTime += seconds
+        self.clock.sleep(seconds)
+
+
+    ## same names as pyvisa, the drivers only use these
+    def write(self, command):
+        with self.lock:
+            header = re.match(r'[*:A-Za-z?]*', command).group()
+            self.commandCount[header] = self.commandCount.get(header, 0) + 1
+            self.spend(self.latency.delay(header, len(command) + len(self.write_termination)))
+            self.replyLines.extend(self.reply(command))
+        return len(command)
+
+
+    def read(self):
+        with self.lock:
+            if not self.replyLines: raise TimeoutError('simulated read timeout, nothing to read')
+            line = self.replyLines.pop(0)
+            if self.latency.throughput: self.spend((len(line) + len(self.read_termination))/self.latency.throughput)
+            return line
+
+
+    def query(self, command):
+        self.write(command)
+        return self.read()
+
+
+    def close(self):
+        self.isOpen = False
+
+
+    def reply(self, command):
+        raise NotImplementedError
+
+
+class SimEPC400(SimResource):
+    """
+    OZ Optics EPC400 serial protocol, every reply ends with a 'Done' line, RST answers with two lines
+    V commands only reach the squeezers with the following MDC, as on the device
+    voltages are forwarded to optics, an OpticalModel shared with SimTLPAX
+    """
+
+    def __init__(self, optics=None, latency=None, clock=None, serialNumber='E4000001', version='EPC OEM Driver V2.10'):
+        """
+        constructor
+        """
+        super().__init__(latency if latency is not None else LatencyModel(*latencyEPC400, perCommand=perCommandEPC400), clock)
+        self.optics = optics
+        self.serialNumber, self.version = serialNumber, version
+        self.mode = 'DC'
+        self.milliVolts, self.pendingMilliVolts = [0]*4, [0]*4
+
+
+    def reply(self, command):
+        if command == 'RST':
+            self.mode, self.milliVolts, self.pendingMilliVolts = 'DC', [0]*4, [0]*4
+            self.applyVoltages()
+            return ['Reset', 'Done']
+        if command == 'SN?': return [f'SN: {self.serialNumber}', 'Done']
+        if command == 'VER?': return [f'VER: {self.version}', 'Done']
+        if command == 'CD': return [f'SN: {self.serialNumber}', f'VER: {self.version}', f'Mode: {self.mode}', 'Done']
+        if command == 'M?': return [f'Mode: {self.mode}', 'Done']
+        if command in ('MDC', 'MAC'):
+            self.mode = command[1:]
+            self.milliVolts = list(self.pendingMilliVolts)
+            self.applyVoltages()
+            return ['Done']
+        if command == 'V?': return [f'CH{chan+1} {milliVolt}' for chan, milliVolt in enumerate(self.milliVolts)] + ['Done']
+
+        match = re.fullmatch(r'V([1-4]),\s*([+-]?\d+)', command)
+        if match is None: return ['Error: unknown command', 'Done']
+        self.pendingMilliVolts[int(match.group(1))-1] = max(-5000, min(5000, int(match.group(2))))
+        return ['Done']
+
+
+    def applyVoltages(self):
+        if self.optics is not None and self.mode == 'DC': self.optics.setVoltages([milliVolt/1e3 for milliVolt in self.milliVolts])
+
+
+class SimAgilent3320A(SimResource):
+    """
+    SCPI function generator: ';'-separated messages, ':' resets to the root, 'HEADER value' sets, 'HEADER?' queries
+    every header of a message costs parseTime on top of the message overhead
+    """
+
+    def __init__(self, latency=None, clock=None, parseTime=0.2e-3, idn='Agilent Technologies,33220A,MY00000001,2.02-2.02-22-2'):
+        """
+        constructor
+        """
+        super().__init__(latency if latency is not None else LatencyModel(*latency3320A), clock)
+        self.parseTime, self.idn = parseTime, idn
+        self.write_termination = self.read_termination = '\n'
+        self.state, self.triggerCount = {}, 0
+
+
+    def reply(self, command):
+        lines = []
+        for header in filter(None, (part.strip().lstrip(':') for part in command.split(';'))):
+            self.spend(self.parseTime)
+            name, _, value = header.partition(' ')
+            name = name.upper()
+            if name == '*IDN?': lines.append(self.idn)
+            elif name == '*OPC?': lines.append('1')
+            elif name == '*TRG': self.triggerCount += 1
+            elif name == '*RST': self.state = {}
+            elif name.endswith('?'): lines.append(self.state.get(name[:-1], '0'))
+            elif value: self.state[name] = value.strip()
+        return lines
+
+
+class SimTLPAX():
+    """
+    stand-in for the TLPAX DLL, attach it to the driver library:
+    libPAX.attach(SimTLPAX(optics))
+    scan IDs advance with the clock at the basic scan rate, every scan reads the OpticalModel
+    output arguments are the byref(...) objects and string buffers the drivers already pass
+    """
+
+    def __init__(self, optics=None, latency=None, clock=None, scanRate=100.0, resourceName=b'USB0::0x1313::0x8031::M00000001::INSTR'):
+        """
+        constructor
+        """
+        self.optics = optics if optics is not None else OpticalModel(clock=clock)
+        self.latency = latency if latency is not None else LatencyModel(*latencyPAX1000)
+        self.clock = clock if clock is not None else self.optics.clock
+        self.scanRate, self.resourceName = scanRate, resourceName
+        self.wavelength, self.measMode = 1550e-9, 9
+        self.scanTimeInit, self.callCount = self.clock.now(), 0
+        self.scans = {} ## scan ID: (stokes, power, dop), held until released
+
+
+    def spend(self, command):
+        self.callCount += 1
+        self.clock.sleep(self.latency.delay(command))
+        return 0
+
+
+    def TLPAX_findRsrc(self, session, deviceCount):
+        setRef(deviceCount, 1)
+        return self.spend('findRsrc')
+
+    def TLPAX_getRsrcName(self, session, index, resourceName):
+        setRef(resourceName, self.resourceName)
+        return self.spend('getRsrcName')
+
+    def TLPAX_getRsrcInfo(self, session, index, modelName, serialNumber, manufacturer, deviceAvailable):
+        for ref, value in ((modelName, b'PAX1000IR2'), (serialNumber, self.resourceName.split(b'::')[3]), (manufacturer, b'Thorlabs')):
+            if ref is not None: setRef(ref, value)
+        setRef(deviceAvailable, 1)
+        return self.spend('getRsrcInfo')
+
+    def TLPAX_init(self, resourceName, IDQuery, resetDevice, session):
+        setRef(session, 1)
+        return self.spend('init')
+
+    def TLPAX_close(self, session):
+        return self.spend('close')
+
+    def TLPAX_setMeasurementMode(self, session, measMode):
+        self.measMode = getattr(measMode, 'value', measMode)
+        return self.spend('setMeasurementMode')
+
+    def TLPAX_getMeasurementMode(self, session, measMode):
+        setRef(measMode, self.measMode)
+        return self.spend('getMeasurementMode')
+
+    def TLPAX_setWavelength(self, session, wavelength):
+        self.wavelength = getattr(wavelength, 'value', wavelength)
+        return self.spend('setWavelength')
+
+    def TLPAX_getWavelength(self, session, wavelength):
+        setRef(wavelength, self.wavelength)
+        return self.spend('getWavelength')
+
+    def TLPAX_setBasicScanRate(self, session, scanRate):
+        self.scanRate = getattr(scanRate, 'value', scanRate)
+        self.scanTimeInit = self.clock.now()
+        return self.spend('setBasicScanRate')
+
+    def TLPAX_getBasicScanRate(self, session, scanRate):
+        setRef(scanRate, self.scanRate)
+        return self.spend('getBasicScanRate')
+
+    def TLPAX_getLatestScan(self, session, scanID):
+        currID = int((self.clock.now() - self.scanTimeInit)*self.scanRate) % 2**32
+        if currID not in self.scans: self.scans[currID] = self.optics.measure()
+        setRef(scanID, currID)
+        return self.spend('getLatestScan')
+
+    def TLPAX_releaseScan(self, session, scanID):
+        self.scans.pop(getattr(scanID, 'value', scanID), None)
+        return self.spend('releaseScan')
+
+    def TLPAX_getTimeStamp(self, session, scanID, timeStamp):
+        setRef(timeStamp, int(scanID*1e3/self.scanRate) % 2**32) ## ms
+        return self.spend('getTimeStamp')
+
+    def TLPAX_getStokesNormalized(self, session, scanID, s1, s2, s3):
+        stokes = self.scans[scanID][0]
+        for ref, value in zip((s1, s2, s3), stokes): setRef(ref, float(value))
+        return self.spend('getStokesNormalized')
+
+    def TLPAX_getPower(self, session, scanID, power, powerPolarized, powerUnpolarized):
+        _, totalPower, dop = self.scans[scanID]
+        setRef(power, totalPower)
+        setRef(powerPolarized, totalPower*dop)
+        setRef(powerUnpolarized, totalPower*(1-dop))
+        return self.spend('getPower')
+
+    def TLPAX_getDOP(self, session, scanID, dop, dolp, docp):
+        stokes, _, totalDop = self.scans[scanID]
+        setRef(dop, totalDop)
+        setRef(dolp, totalDop*float(np.hypot(stokes[0], stokes[1])))
+        setRef(docp, totalDop*abs(float(stokes[2])))
+        return self.spend('getDOP')
+
+    def TLPAX_getPolarization(self, session, scanID, azimuth, ellipticity):
+        stokes = self.scans[scanID][0]
+        setRef(azimuth, 0.5*float(np.arctan2(stokes[1], stokes[0])))
+        setRef(ellipticity, 0.5*float(np.arcsin(np.clip(stokes[2], -1, 1))))
+        return self.spend('getPolarization')
+
+
+class SimResourceManager():
+    """
+    stands in for pyvisa.ResourceManager, pass it as resMan to the drivers
+    resources: dict of address: SimResource
+    """
+
+    def __init__(self, resources):
+        """
+        constructor
+        """
+        self.resources = dict(resources)
+
+
+    def list_resources(self, query='?*::INSTR'):
+        return tuple(self.resources)
+
+
+    def open_resource(self, portAddr, write_termination=None, read_termination=None, timeout=None):
+        resource = self.resources[portAddr]
+        if write_termination is not None: resource.write_termination = write_termination
+        if read_termination is not None: resource.read_termination = read_termination
+        if timeout is not None: resource.timeout = timeout
+        resource.isOpen = True
+        return resource
+
+
+def simulatedSetup(realTime=True, seed=None, epcAddr='ASRL3::INSTR', funcGenAddr='GPIB::10', **opticsArgs):
+    """
+    EPC400, PAX1000 and 3320A sharing one clock and one OpticalModel
+
+    return the resource manager for the VISA drivers, the TLPAX stand-in and the optical model
+
+    example flow
+    resMan, simPAX, optics = simulatedSetup(driftRate=0.05)
+    epc = ozopticsEPC400('ASRL3::INSTR', resMan=resMan)
+    funcGen = agilent3320A('GPIB::10', resMan=resMan)
+    libPAX.attach(simPAX)                           ## libPAX of Instruments.Thorlabs.thorlabsPAX1000
+    pax = thorlabsPAX1000(); pax.initDev()
+    epc.setVoltages([1.0, -0.5, 0.2, 0.0]); pax.getStokes(); optics.visibility()
+    """
+    clock = SimClock(realTime)
+    optics = OpticalModel(clock=clock, seed=seed, **opticsArgs)
+    resMan = SimResourceManager({
+        epcAddr: SimEPC400(optics, LatencyModel(*latencyEPC400, perCommand=perCommandEPC400, seed=seed), clock),
+        funcGenAddr: SimAgilent3320A(LatencyModel(*latency3320A, seed=seed), clock)})
+    simPAX = SimTLPAX(optics, LatencyModel(*latencyPAX1000, seed=seed), clock)
+    return resMan, simPAX, optics
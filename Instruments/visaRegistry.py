@@ -0,0 +1,246 @@
+import time
+import threading
+
+## libraries
+## VISA status codes after which the session is reopened: connection lost, invalid object/session, resource not found, I/O error
+reconnectCodes = (-1073807194, -1073807346, -1073807342, -1073807343, -1073807298)
+timeoutCode = -1073807339 ## VI_ERROR_TMO, a slow device is not a broken connection
+
+def isConnectionError(error):
+    """
+    errors after which a session is worth reopening, timeouts are not
+    """
+    if isinstance(error, TimeoutError): return False
+    if isinstance(error, (ConnectionError, OSError)): return True
+    if type(error).__name__ == 'InvalidSession': return True
+    return getattr(error, 'error_code', None) in reconnectCodes
+
+
+class PooledResource():
+    """
+    session handed out by ResourcePool, shared by everyone who opens the same address
+    write/read/query are serialized by lock, hold it around a multi-line exchange (write, then read until 'Done')
+    a connection error reopens the session with backoff and retries the write or query once, a lost read is not retried
+    close() only releases this user, the session is closed with its last user
+    deviceState holds what the drivers cache about the device (last values written), shared through sharedState
+    other attributes (timeout, terminations, clear, ...) are those of the pyvisa resource
+    """
+
+    def __init__(self, pool, portAddr, openArgs):
+        """
+        constructor
+        """
+        self.__dict__.update(pool=pool, portAddr=portAddr, openArgs=dict(openArgs), lock=threading.RLock(), userCount=0, resource=None,
+                             reconnectCount=0, deviceState={})
+        self.connect()
+
+
+    def connect(self):
+        self.resource = self.pool.resMan.open_resource(self.portAddr, **self.openArgs)
+
+
+    def reconnect(self):
+        """
+        close and reopen the session, waiting backoff*factor**attempt between failed attempts
+        """
+        with self.lock:
+            try: self.resource.close()
+            except Exception: pass
+
+            for attempt in range(self.pool.retries):
+                try:
+                    self.connect()
+                    self.reconnectCount += 1
+                    return self.resource
+                except Exception as error:
+                    if not isConnectionError(error) or attempt == self.pool.retries-1: raise
+                    time.sleep(min(self.pool.backoff*self.pool.backoffFactor**attempt, self.pool.backoffMax))
+
+
+    def call(self, operation, *args):
+        with self.lock:
+            try:
+                return getattr(self.resource, operation)(*args)
+            except Exception as error:
+                if not isConnectionError(error): raise
+                self.reconnect()
+                if operation == 'read': raise
+                return getattr(self.resource, operation)(*args)
+
+
+    def write(self, command):
+        return self.call('write', command)
+
+
+    def read(self):
+        return self.call('read')
+
+
+    def query(self, command):
+        return self.call('query', command)
+
+
+    def isHealthy(self, healthCheck=None):
+        """
+        run healthCheck, the pool one by default, False if it raises
+        """
+        healthCheck = healthCheck or self.pool.healthCheck
+        if healthCheck is None: raise ValueError('no health check for {}, give the pool a healthCheck such as identityQuery'.format(self.portAddr))
+        with self.lock:
+            try:
+                healthCheck(self.resource)
+                return True
+            except Exception:
+                return False
+
+
+    def close(self):
+        self.pool.release(self)
+
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__: self.__dict__[name] = value
+        else: setattr(self.resource, name, value)
+
+
+def identityQuery(resource):
+    """
+    health check of SCPI instruments: a *IDN? round trip, raises on a dead link or a timeout
+    instruments without *IDN? (OZ Optics) need their own, e.g. lambda res: res.query('V1?')
+    """
+    if not resource.query('*IDN?').strip(): raise ConnectionError('empty *IDN? answer')
+
+
+def sharedState(resource, name, factory):
+    """
+    device state a driver caches under name, e.g. the last values it wrote to skip rewriting them
+    one object per pooled session so that every driver instance on the same address sees the writes of the others,
+    a private factory() for resources not from the pool; update it in place, never rebind it
+    """
+    if not isinstance(resource, PooledResource): return factory()
+    with resource.lock:
+        if name not in resource.deviceState: resource.deviceState[name] = factory()
+        return resource.deviceState[name]
+
+
+## main
+class ResourcePool():
+    """
+    one resource manager and one session per address for the whole process
+    the drivers use it when no resMan is given, it has the ResourceManager methods they call
+
+    resMan: None for pyvisa.ResourceManager(visaLibrary), created on first use, or e.g. a SimResourceManager
+    healthCheck: fun(resource) raising when the session is unusable, a query the instruments answer, e.g. identityQuery
+    there is no default since no single query is understood by all the instruments, checkHealth raises without one
+
+    example flow
+    pool = resourcePool()
+    epc = ozopticsEPC400('ASRL3::INSTR')        ## opens ASRL3 through the pool
+    epcAgain = ozopticsEPC400('ASRL3::INSTR')   ## same session, no second handle on the serial port
+    pool.checkHealth(healthCheck=lambda res: res.query('V1?'))   ## reopen what does not answer
+    """
+
+    def __init__(self, resMan=None, visaLibrary='', healthCheck=None, retries=5, backoff=0.1, backoffFactor=2.0, backoffMax=5.0):
+        """
+        constructor
+        """
+        self.resManInit, self.visaLibrary = resMan, visaLibrary
+        self.healthCheck = healthCheck
+        self.retries, self.backoff, self.backoffFactor, self.backoffMax = retries, backoff, backoffFactor, backoffMax
+        self.sessions = {} ## address: PooledResource
+        self.resourceList = None
+        self.lock = threading.RLock()
+
+
+    @property
+    def resMan(self):
+        """
+        the resource manager, the pool lock is only taken to create it
+        sessions call this while holding their own lock, and locks are always taken pool first then session
+        """
+        resMan = self.resManInit
+        if resMan is not None: return resMan
+        with self.lock:
+            if self.resManInit is None:
+                import pyvisa
+                self.resManInit = pyvisa.ResourceManager(self.visaLibrary)
+            return self.resManInit
+
+
+    def list_resources(self, query='?*::INSTR', refresh=False):
+        """
+        addresses found on the buses, discovered on the first call only unless refresh
+        """
+        with self.lock:
+            if self.resourceList is None or refresh:
+                self.resourceList = tuple(self.resMan.list_resources(query))
+            return self.resourceList
+
+
+    def open_resource(self, portAddr, **openArgs):
+        """
+        pooled session of portAddr, opened on first use with openArgs (write_termination, read_termination, timeout, ...)
+        the session keeps the openArgs of its first user, a later user asking for other values gets a ValueError
+        instead of silently changing them under the first one
+        """
+        with self.lock:
+            session = self.sessions.get(portAddr)
+            if session is None:
+                session = self.sessions[portAddr] = PooledResource(self, portAddr, openArgs)
+            else:
+                conflicts = ['{}={!r} (session has {})'.format(name, value, repr(session.openArgs[name]) if name in session.openArgs else 'the default') for name, value in openArgs.items()
+                             if name not in session.openArgs or session.openArgs[name] != value]
+                if conflicts: raise ValueError('{} is already open with other settings: {}'.format(portAddr, ', '.join(conflicts)))
+            session.userCount += 1
+            return session
+
+
+    def release(self, session):
+        """
+        drop one user of session, closing it with the last one
+        """
+        with self.lock:
+            session.userCount -= 1
+            if session.userCount > 0: return
+            self.sessions.pop(session.portAddr, None)
+            with session.lock: session.resource.close()
+
+
+    def checkHealth(self, portAddr=None, healthCheck=None):
+        """
+        health check of one or all sessions, unhealthy ones are reopened
+        healthCheck: fun(resource) for this call, the pool one by default, ValueError if neither is given
+        return dict of address: healthy before the check
+        """
+        if healthCheck is None and self.healthCheck is None:
+            raise ValueError('no health check, pass healthCheck here or to the pool, e.g. identityQuery')
+        with self.lock: sessions = [self.sessions[portAddr]] if portAddr is not None else list(self.sessions.values())
+        health = {}
+        for session in sessions:
+            health[session.portAddr] = session.isHealthy(healthCheck)
+            if not health[session.portAddr]: session.reconnect()
+        return health
+
+
+    def closeAll(self):
+        with self.lock:
+            for session in list(self.sessions.values()):
+                session.userCount = 1
+                self.release(session)
+
+
+poolDefault = None
+poolLock = threading.Lock()
+
+def resourcePool(**kwargs):
+    """
+    the process-wide ResourcePool, created on the first call, kwargs only apply then
+    """
+    global poolDefault
+    with poolLock:
+        if poolDefault is None: poolDefault = ResourcePool(**kwargs)
+        return poolDefault
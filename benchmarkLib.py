@@ -0,0 +1,285 @@
+import os, sys, time, json
+import platform, subprocess, tempfile, tracemalloc
+import numpy as np
+
+## libraries
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Acil')) ## Acil/tools.py is imported as tools, like in the notebooks
+
+def timeIt(fun, repeat=100, warmup=3):
+    """
+    latency in s of repeat calls of fun, after warmup untimed calls
+    """
+    for _ in range(warmup): fun()
+    latencies = np.empty(repeat)
+    for i in range(repeat):
+        timeInit = time.perf_counter()
+        fun()
+        latencies[i] = time.perf_counter() - timeInit
+    return latencies
+
+
+def peakMemory(fun):
+    """
+    peak python/numpy heap in bytes allocated during one call of fun, memory-mapped pages are not counted
+    run apart from timeIt, tracemalloc slows every allocation down
+    """
+    tracemalloc.start()
+    try:
+        fun()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(latencies, memory=None, **extra):
+    """
+    ops/s, p50/p99/mean/max latency in s and peak memory in bytes of one benchmark case
+    no latencies (e.g. nothing arrived before the timeout) gives nan fields
+    extra overrides the fields above, e.g. opsPerSec when the latencies are not back-to-back calls
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    if latencies.size == 0:
+        summary = {'repeat': 0, 'opsPerSec': np.nan, 'p50': np.nan, 'p99': np.nan, 'mean': np.nan, 'max': np.nan, 'peakMemory': memory}
+        summary.update(extra)
+        return summary
+    summary = {'repeat': int(latencies.size), 'opsPerSec': float(latencies.size/latencies.sum()),
+               'p50': float(np.percentile(latencies, 50)), 'p99': float(np.percentile(latencies, 99)),
+               'mean': float(latencies.mean()), 'max': float(latencies.max()), 'peakMemory': memory}
+    summary.update(extra)
+    return summary
+
+
+def runCase(fun, repeat=100, warmup=3, **extra):
+    return summarize(timeIt(fun, repeat, warmup), peakMemory(fun), **extra)
+
+
+## benchmarks, each returns a dict of case name: summary
+def benchEPC400(repeat=200, realTime=True, seed=0):
+    """
+    EPC400 update latency against the simulated controller: bulk update of 4 changed channels vs 4 setVoltage calls
+    simTime is the modelled instrument time per update, wall time minus simTime is our python
+    """
+    from Instruments.simulatedInstruments import simulatedSetup
+    from Instruments.OzOptics import ozopticsEPC400
+
+    resMan, _, optics = simulatedSetup(realTime=realTime, seed=seed)
+    epc = ozopticsEPC400('ASRL3::INSTR', resMan=resMan)
+    rng = np.random.default_rng(seed)
+    voltages = rng.uniform(-5, 5, (repeat + 10, 4))
+    results = {}
+
+    def casePair(name, update):
+        counter = iter(range(10**9))
+        clockInit = optics.clock.now()
+        latencies = timeIt(lambda: update(voltages[next(counter) % len(voltages)]), repeat, warmup=3)
+        simTime = (optics.clock.now() - clockInit)/(repeat + 3)
+        results[name] = summarize(latencies, peakMemory(lambda: update(voltages[0])), simTime=simTime)
+
+    casePair('epc400.setVoltagesBulk', epc.setVoltagesBulk)
+    casePair('epc400.setVoltage x4', lambda volts: [epc.setVoltage(chan, volt) for chan, volt in enumerate(volts)])
+    return results
+
+
+def benchPAX1000(repeat=200, scanRate=100.0, seed=0):
+    """
+    PAX1000 against the simulated TLPAX library
+    getSingleMeas round trip, and scan-to-python latency: time from the end of a scan until latest() returns it
+    opsPerSec of scanToPython is the rate of scans reaching python, the latencies overlap and do not time it
+    """
+    from Instruments.simulatedInstruments import simulatedSetup
+    from Instruments.Thorlabs import thorlabsPAX1000
+    libPAX = sys.modules['Instruments.Thorlabs.thorlabsPAX1000'].libPAX
+
+    _, simPAX, optics = simulatedSetup(seed=seed)
+    simPAX.scanRate = scanRate
+    libPAX.attach(simPAX)
+    try:
+        pax = thorlabsPAX1000(scanRate=scanRate)
+        results = {'pax1000.getSingleMeas': runCase(pax.getSingleMeas, repeat)}
+
+        pax.startAcquisition()
+        lastID, latencies = None, []
+        timeInit = time.perf_counter()
+        timeEnd = timeInit + 5 + 2*repeat/scanRate
+        while len(latencies) < repeat and time.perf_counter() < timeEnd:
+            record = pax.latest()
+            if record is None or record['scanID'] == lastID:
+                time.sleep(0) ## let the acquisition thread run
+                continue
+            lastID = record['scanID']
+            latencies.append(optics.clock.now() - (simPAX.scanTimeInit + lastID/simPAX.scanRate))
+        elapsed = time.perf_counter() - timeInit
+        pax.stopAcquisition()
+        results['pax1000.scanToPython'] = summarize(latencies, opsPerSec=len(latencies)/elapsed, droppedScans=pax.droppedScans)
+    finally:
+        libPAX.unload()
+    return results
+
+
+def benchFit(repeat=50, pointNum=2000, seed=0):
+    """
+    fit time per resonance: lorentzSingle with its analytic jacobian on a noisy synthetic dip
+    """
+    import tools
+
+    rng = np.random.default_rng(seed)
+    xData = np.linspace(1549.9, 1550.1, pointNum)
+    yData = tools.lorentzSingle(xData, [0, 0.6, 1550.0, 0.004, 1.0]) + rng.normal(0, 0.01, pointNum)
+    guess = tools.guessLorentzSingle(xData, yData)
+    return {'tools.fitModel lorentzSingle': runCase(lambda: tools.fitModel('lorentzSingle', guess, xData, yData), repeat, pointNum=pointNum)}
+
+
+def writePhaseLog(fileName, rowNum, timeInit=1692885240, seed=0):
+    """
+    synthetic phase logger file in the 'd' format: Time, PhaseMax, PhaseMin, PhaseAve at 1 kHz
+    """
+    rng = np.random.default_rng(seed)
+    with open(fileName, 'wb') as fileHandler:
+        fileHandler.write(b'd' + int(timeInit).to_bytes(8, 'little') + (4).to_bytes(4, 'little'))
+        for rowStart in range(0, rowNum, 2**20):
+            chunkRows = min(2**20, rowNum - rowStart)
+            phase = np.cumsum(rng.normal(0, 1e-3, chunkRows))
+            np.column_stack([np.arange(rowStart, rowStart + chunkRows)*1e-3, phase + 0.01, phase - 0.01, phase]).astype('<f8').tofile(fileHandler)
+
+
+def benchPhaseLog(repeat=10, rowNum=2**22, seed=0):
+    """
+    phase .bin parse throughput on a synthetic log: open + full PhaseAve pass, PhaseLog memmap vs np.fromfile as in the notebooks
+    """
+    from phaseLogLib import PhaseLog
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        fileName = os.path.join(tempDir, 'phase.bin')
+        writePhaseLog(fileName, rowNum, seed=seed)
+        fileSize = os.path.getsize(fileName)
+
+        def readMemmap():
+            phaseLog = PhaseLog(fileName)
+            phaseLog.data['PhaseAve'].mean()
+            phaseLog.closeFile()
+
+        def readFromfile():
+            np.fromfile(fileName, dtype='<f8', offset=13).reshape(-1, 4)[:, 3].mean()
+
+        results = {}
+        for name, fun in (('phaseLog.PhaseLog', readMemmap), ('phaseLog.fromfile', readFromfile)):
+            results[name] = runCase(fun, repeat, warmup=1, fileSize=fileSize)
+            results[name]['bytesPerSec'] = fileSize/results[name]['p50']
+    return results
+
+
+def benchFringe(repeat=200, samplingRate=100000, refreshRate=10, seed=0):
+    """
+    DAQ frame processing: FringeEstimator (visibility, mean, 2-tone lock-in) vs the notebook visibility with Python max/min
+    """
+    from fringeLib import FringeEstimator
+
+    samplesPerFrame = samplingRate//refreshRate
+    timeBase = np.arange(samplesPerFrame)/samplingRate
+    frame = 1 + 0.6*np.sin(2*np.pi*100*timeBase) + np.random.default_rng(seed).normal(0, 0.01, samplesPerFrame)
+    estimator = FringeEstimator(samplingRate, samplesPerFrame, (100, 500))
+    estimator.readBuffer[0] = frame
+    readBuffer = frame[None, :]
+
+    def visNotebook():
+        (max(readBuffer[0])-min(readBuffer[0]))/(max(readBuffer[0])+min(readBuffer[0]))
+
+    return {'fringe.FringeEstimator': runCase(estimator.process, repeat, samplesPerFrame=samplesPerFrame),
+            'fringe.notebook': runCase(visNotebook, max(repeat//10, 1), samplesPerFrame=samplesPerFrame)}
+
+
+def benchWaveform(repeat=200, samplingRate=100000, refreshRate=10, chanNum=3):
+    """
+    AO frame generation: WaveformTable frame copy vs the notebook signalGenerator sin per channel and frame
+    """
+    from waveformLib import WaveformTable
+
+    samplesPerFrame = samplingRate//refreshRate
+    timeBase = np.arange(samplesPerFrame)/samplingRate
+    waveform = WaveformTable(samplingRate, samplesPerFrame, [[(100, 0.6, 0), (500, 0.06, 0)]]*chanNum)
+    dataFrame = np.zeros((chanNum, samplesPerFrame))
+
+    def frameTable():
+        np.copyto(waveform.writeBuffer, waveform.nextFrame())
+
+    def frameNotebook():
+        for channel in range(chanNum):
+            dataFrame[channel] = 0.66 + 0.6*np.sin(2*np.pi*100*timeBase + 0.1) + 0.06*np.sin(2*np.pi*500*timeBase + 0.2)
+
+    return {'waveform.WaveformTable': runCase(frameTable, repeat, samplesPerFrame=samplesPerFrame, chanNum=chanNum),
+            'waveform.notebook': runCase(frameNotebook, repeat, samplesPerFrame=samplesPerFrame, chanNum=chanNum)}
+
+
+benchmarks = {'epc400': benchEPC400, 'pax1000': benchPAX1000, 'fit': benchFit, 'phaseLog': benchPhaseLog, 'fringe': benchFringe,
+              'waveform': benchWaveform}
+quickArgs = {'epc400': {'repeat': 20}, 'pax1000': {'repeat': 20}, 'fit': {'repeat': 5}, 'phaseLog': {'repeat': 2, 'rowNum': 2**18}, 'fringe': {'repeat': 20},
+             'waveform': {'repeat': 20}}
+
+## main
+def environment():
+    """
+    what a result file was measured on
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'processor': platform.processor()}
+
+
+def runBenchmarks(names=None, fileName=None, quick=False):
+    """
+    run the benchmarks given by names (all if None), optionally store them as json in fileName
+    quick=True uses few repeats and small files, for a smoke run
+
+    example flow
+    results = runBenchmarks(fileName='bench-main.json')
+    ... switch branch ...
+    results = runBenchmarks(fileName='bench-branch.json')
+    compareResults('bench-main.json', 'bench-branch.json')
+    """
+    results = {'environment': environment(), 'results': {}}
+    for name in (names or benchmarks):
+        kwargs = quickArgs[name] if quick else {}
+        results['results'].update(benchmarks[name](**kwargs))
+
+    if fileName is not None:
+        with open(fileName, 'w') as fileHandler:
+            json.dump(results, fileHandler, indent=2)
+    return results
+
+
+def compareResults(baseline, current, tolerance=0.1, key='p50'):
+    """
+    compare two runBenchmarks results (dicts or json file names) on key
+    return dict of case: (baseline, current, current/baseline), cases slower by more than tolerance are printed
+    """
+    if isinstance(baseline, str):
+        with open(baseline) as fileHandler: baseline = json.load(fileHandler)
+    if isinstance(current, str):
+        with open(current) as fileHandler: current = json.load(fileHandler)
+
+    comparison = {}
+    for case, summary in current['results'].items():
+        if case not in baseline['results']: continue
+        valueBase, valueCurr = baseline['results'][case][key], summary[key]
+        comparison[case] = (valueBase, valueCurr, valueCurr/valueBase)
+        if valueCurr > valueBase*(1 + tolerance):
+            print('regression: {} {} {:.3g} -> {:.3g} s ({:+.0%})'.format(case, key, valueBase, valueCurr, valueCurr/valueBase - 1))
+    return comparison
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='offline benchmarks on simulated instruments and synthetic files')
+    parser.add_argument('names', nargs='*', help='benchmarks to run among {}, all by default'.format(', '.join(benchmarks)))
+    parser.add_argument('--out', default=None, help='json file for the results')
+    parser.add_argument('--compare', default=None, help='baseline json file to compare against')
+    parser.add_argument('--quick', action='store_true', help='few repeats, small files')
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.names or None, args.out, args.quick)
+    for case, summary in results['results'].items():
+        print('{:32s} {:10.1f} ops/s  p50 {:9.3g} s  p99 {:9.3g} s  peak {} B'.format(case, summary['opsPerSec'], summary['p50'], summary['p99'], summary['peakMemory']))
+    if args.compare: compareResults(args.compare, results)
@@ -0,0 +1,106 @@
+import os, json, hashlib, shutil
+import numpy as np
+import pandas as pd
+
+## libraries
+cacheRoot = None ## None: a .npycache folder next to each source file, otherwise one shared folder
+
+
+def codeHash(code):
+    """
+    sha1 of a code object that is the same in every process: bytecode, names and constants,
+    nested code objects (comprehensions, lambdas) by their own codeHash instead of their repr, which holds their address
+    """
+    hasher = hashlib.sha1(code.co_code)
+    hasher.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        hasher.update(codeHash(const).encode() if hasattr(const, 'co_code') else repr(const).encode())
+    return hasher.hexdigest()
+
+
+def cacheDirectory(fileName, reader, readerArgs):
+    """
+    cache folder of one (source file, reader, reader arguments) combination
+    the reader is identified by its optional cacheVersion attribute and the bytecode and constants of its body,
+    so editing the parser invalidates the caches it wrote
+    """
+    fileName = os.path.abspath(fileName)
+    code = getattr(reader, '__code__', None)
+    readerCode = codeHash(code) if code is not None else None
+    readerKey = (reader.__module__, reader.__qualname__, getattr(reader, 'cacheVersion', None), readerCode)
+    key = hashlib.sha1(repr((fileName, readerKey, sorted(readerArgs.items()))).encode()).hexdigest()[:16]
+    root = cacheRoot if cacheRoot is not None else os.path.join(os.path.dirname(fileName), '.npycache')
+    return os.path.join(root, f'{os.path.basename(fileName)}.{key}')
+
+
+def loadCache(cacheDir, fileName):
+    """
+    columns of a cache folder as read-only memmaps, None if missing or stale
+    stale means the source size or mtime changed, a copy with a new mtime is parsed again
+    """
+    try:
+        with open(os.path.join(cacheDir, 'meta.json')) as fileHandler:
+            meta = json.load(fileHandler)
+    except (OSError, ValueError):
+        return None
+
+    fileStats = os.stat(fileName)
+    if meta['size'] != fileStats.st_size or meta['mtime'] != fileStats.st_mtime_ns: return None
+
+    return {name: np.load(os.path.join(cacheDir, f'col{i}.npy'), mmap_mode='r') for i, name in enumerate(meta['columns'])}
+
+
+def saveCache(cacheDir, fileName, columns):
+    """
+    store columns as one .npy each, meta.json is written last so that a half written cache is never loaded
+    """
+    if os.path.isdir(cacheDir): shutil.rmtree(cacheDir)
+    os.makedirs(cacheDir)
+    for i, column in enumerate(columns.values()):
+        np.save(os.path.join(cacheDir, f'col{i}.npy'), column)
+
+    fileStats = os.stat(fileName)
+    meta = {'source': os.path.abspath(fileName), 'size': fileStats.st_size, 'mtime': fileStats.st_mtime_ns, 'columns': list(columns)}
+    with open(os.path.join(cacheDir, 'meta.json'), 'w') as fileHandler:
+        json.dump(meta, fileHandler)
+
+
+def cachedColumns(fileName, reader, **readerArgs):
+    """
+    columns of fileName as parsed by reader(fileName, **readerArgs), which returns a dict of name: 1d array
+    the first call parses and stores the columns as raw .npy, later calls memory-map them
+    object columns are stored as fixed-width strings, parse dates to numbers in the reader to keep them mappable
+    if the cache cannot be written (read-only share), the parsed columns are returned uncached
+
+    example flow
+    columns = cachedColumns(name, readCsvColumns, encoding='unicode_escape')   ## PAX/Keysight polarimeter export
+    phi, khi = columns['Azimuth[°]'], columns['Ellipticity[°]']
+    """
+    cacheDir = cacheDirectory(fileName, reader, readerArgs)
+    columns = loadCache(cacheDir, fileName)
+    if columns is not None: return columns
+
+    columns = {name: np.asarray(column) for name, column in reader(fileName, **readerArgs).items()}
+    columns = {name: (column.astype(str) if column.dtype == object else column) for name, column in columns.items()}
+    try:
+        saveCache(cacheDir, fileName, columns)
+    except OSError:
+        return columns
+    return loadCache(cacheDir, fileName)
+
+
+def clearCache(fileName, reader, **readerArgs):
+    """
+    remove the cache of one (source file, reader, reader arguments) combination
+    """
+    shutil.rmtree(cacheDirectory(fileName, reader, readerArgs), ignore_errors=True)
+
+
+## readers
+def readCsvColumns(fileName, **kwargs):
+    """
+    generic csv reader for cachedColumns, kwargs are passed to pd.read_csv
+    column names are stripped of the spaces the PAX/Keysight exports pad them with
+    """
+    dataFrame = pd.read_csv(fileName, **kwargs)
+    return {str(name).strip(): dataFrame[name].to_numpy() for name in dataFrame.columns}
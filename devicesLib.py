@@ -1,17 +1,20 @@
-import os, re
+import re
 import time
-import pyvisa
 from ctypes import *
 from sys import exit
 
+from Instruments.Thorlabs.tlpaxBinding import TLPAXLibrary, bufferSize
+from Instruments.instrumentation import instrumented
+from Instruments.visaRegistry import resourcePool
+
 ## libraries
-os.add_dll_directory(r'C:\Program Files\IVI Foundation\VISA\Win64\Bin')
-libPAX1000 = cdll.LoadLibrary('TLPAX_64.dll')
+libPAX1000 = TLPAXLibrary() ## prototypes from TLPAX.h, the DLL is only loaded on the first call
 
 class OZOpticsDevice(): ## generic
     def __init__(self, portAddr, timeout=30):
-        rm = pyvisa.ResourceManager()
+        rm = resourcePool()
         self.instr = rm.open_resource(portAddr, write_termination="\r\n", read_termination="\r\n", timeout=timeout)
+        self.instrumentName = f'OZOptics {portAddr}'
      
     def write(self, command):
         self.instr.write(command)
@@ -19,6 +22,7 @@ class OZOpticsDevice(): ## generic
     def read(self):
         return self.instr.read()
 
+    @instrumented('OZOptics')
     def query(self, command):
         response = ''
         if self.instr is not None:
@@ -39,9 +43,10 @@ class OZOpticsDevice(): ## generic
     
 class EPC400(): ## EPC400
     def __init__(self, portAddr, timeout=30000):
-        rm = pyvisa.ResourceManager()
+        rm = resourcePool()
         self.instr = rm.open_resource(portAddr, write_termination='\r\n', 
                                       read_termination='\r\n', timeout=timeout)
+        self.instrumentName = f'EPC400 {portAddr}'
 
     def write(self, command):
         self.instr.write(command)
@@ -49,6 +54,7 @@ class EPC400(): ## EPC400
     def read(self):
         return self.instr.read()
 
+    @instrumented('EPC400')
     def query(self, command):
         response = ''
         if self.instr is not None:
@@ -103,24 +109,25 @@ class EPC400(): ## EPC400
         return self.getVoltages()[channel]
     
     def setVoltages(self, value):
+        ## one V per channel, a single MDC and a single readback for the whole batch
         for chan, volt in enumerate(value):
-            self.setVoltage(chan, volt)
+            self.query('V{:d},{:04d}'.format(chan+1, int(volt*1e3)))
+        self.query('MDC')
         return self.getVoltages()
     
     def closeDevice(self):
         return self.instr.close()
     
 class PAX1000():
-    def __init__(self, portAddr=c_char_p(b''), measMode=c_int(9), wavelength=c_double(1550e-9), scanRate = c_double(100)):
-        self.instrHandler = c_ulong()
-        self.deviceCount = c_int()
-        self.manuName = c_char_p(b'')
-        self.modelName = c_char_p(b'')
-        self.serialNumber = c_char_p(b'')
-        self.deviceAvailable = c_bool()
-        self.latestScanID = c_int()
-
-        self.portAddr = portAddr
+    def __init__(self, portAddr=None, measMode=c_int(9), wavelength=c_double(1550e-9), scanRate = c_double(100)):
+        self.instrHandler = c_uint32()
+        self.deviceCount = c_uint32()
+        self.modelName = create_string_buffer(bufferSize)
+        self.serialNumber = create_string_buffer(bufferSize)
+        self.deviceAvailable = c_uint16()
+        self.latestScanID = c_uint32()
+
+        self.portAddr = create_string_buffer(bufferSize) if portAddr is None else create_string_buffer(portAddr, bufferSize)
         self.IDQuery, self.resetDevice = True, False
         self.measMode, self.wavelength, self.scanRate = measMode, wavelength, scanRate
 
@@ -130,55 +137,57 @@ class PAX1000():
             exit()
 
         libPAX1000.TLPAX_getRsrcName(self.instrHandler, 0, self.portAddr)
-        if libPAX1000.TLPAX_init(self.portAddr, self.IDQuery, self.resetDevice, byref(self.instrHandler)) != 0:
+        self.instrumentName = 'PAX1000 ' + self.portAddr.value.decode(errors='replace')
+        self.libPAX = libPAX1000.device(self.instrumentName) ## statistics per device, like OZOptics and EPC400
+        if self.libPAX.TLPAX_init(self.portAddr, self.IDQuery, self.resetDevice, byref(self.instrHandler)) != 0:
             print('error with init...')
             exit()
         time.sleep(2)
 
-        libPAX1000.TLPAX_setMeasurementMode(self.instrHandler, self.measMode)
-        libPAX1000.TLPAX_setWavelength(self.instrHandler, self.wavelength)
-        libPAX1000.TLPAX_setBasicScanRate(self.instrHandler, self.scanRate)
+        self.libPAX.TLPAX_setMeasurementMode(self.instrHandler, self.measMode)
+        self.libPAX.TLPAX_setWavelength(self.instrHandler, self.wavelength)
+        self.libPAX.TLPAX_setBasicScanRate(self.instrHandler, self.scanRate)
         time.sleep(5)
     
     def getCurrSetting(self):
-        wavelength, mode, scanrate = c_double(), c_int(), c_double()
-        libPAX1000.TLPAX_getWavelength(self.instrHandler, byref(wavelength))
-        libPAX1000.TLPAX_getMeasurementMode(self.instrHandler, byref(mode))
-        libPAX1000.TLPAX_getBasicScanRate(self.instrHandler, byref(scanrate))
+        wavelength, mode, scanrate = c_double(), c_int32(), c_double()
+        self.libPAX.TLPAX_getWavelength(self.instrHandler, byref(wavelength))
+        self.libPAX.TLPAX_getMeasurementMode(self.instrHandler, byref(mode))
+        self.libPAX.TLPAX_getBasicScanRate(self.instrHandler, byref(scanrate))
         return '*CFG?', {
             'wavelength [nm]': wavelength.value*1e9,
             'mode': mode.value,
             'scan rate [Hz]': scanrate.value}
     
     def getSingleMeas(self):
-        currID = c_int()
-        datetime = c_int()
+        currID = c_uint32()
+        datetime = c_uint32()
         s1, s2, s3 = c_double(), c_double(), c_double()
         power, powerPolarized, powerUnpolarized = c_double(), c_double(), c_double()
         dop, dolp, docp = c_double(), c_double(), c_double()
         azimuthal, ellipticity = c_double(), c_double()
 
-        libPAX1000.TLPAX_getLatestScan(self.instrHandler, byref(currID))
-        libPAX1000.TLPAX_getTimeStamp(self.instrHandler, currID.value, byref(datetime))
-        libPAX1000.TLPAX_getStokesNormalized(self.instrHandler, currID.value, byref(s1), byref(s2), byref(s3))
-        libPAX1000.TLPAX_getPower(self.instrHandler, currID.value, byref(power), byref(powerPolarized), byref(powerUnpolarized))
-        libPAX1000.TLPAX_getDOP(self.instrHandler, currID.value, byref(dop), byref(dolp), byref(docp))
-        libPAX1000.TLPAX_getPolarization(self.instrHandler, currID.value, byref(azimuthal), byref(ellipticity))
+        self.libPAX.TLPAX_getLatestScan(self.instrHandler, byref(currID))
+        self.libPAX.TLPAX_getTimeStamp(self.instrHandler, currID.value, byref(datetime))
+        self.libPAX.TLPAX_getStokesNormalized(self.instrHandler, currID.value, byref(s1), byref(s2), byref(s3))
+        self.libPAX.TLPAX_getPower(self.instrHandler, currID.value, byref(power), byref(powerPolarized), byref(powerUnpolarized))
+        self.libPAX.TLPAX_getDOP(self.instrHandler, currID.value, byref(dop), byref(dolp), byref(docp))
+        self.libPAX.TLPAX_getPolarization(self.instrHandler, currID.value, byref(azimuthal), byref(ellipticity))
         
-        libPAX1000.TLPAX_releaseScan(self.instrHandler, currID)
+        self.libPAX.TLPAX_releaseScan(self.instrHandler, currID.value)
         self.latestScanID = currID
         return [int(datetime.value), float(s1.value), float(s2.value), float(s3.value), float(power.value), float(dop.value), float(azimuthal.value), float(ellipticity.value)]
     
     def getPower(self):
-        currID = c_int()
+        currID = c_uint32()
         power, powerPolarized, powerUnpolarized = c_double(), c_double(), c_double()
 
-        libPAX1000.TLPAX_getLatestScan(self.instrHandler, byref(currID))
-        libPAX1000.TLPAX_getPower(self.instrHandler, currID.value, byref(power), byref(powerPolarized), byref(powerUnpolarized))
+        self.libPAX.TLPAX_getLatestScan(self.instrHandler, byref(currID))
+        self.libPAX.TLPAX_getPower(self.instrHandler, currID.value, byref(power), byref(powerPolarized), byref(powerUnpolarized))
         
-        libPAX1000.TLPAX_releaseScan(self.instrHandler, currID)
+        self.libPAX.TLPAX_releaseScan(self.instrHandler, currID.value)
         self.latestScanID = currID
         return float(power.value)
 
     def closeDevice(self):
-        return libPAX1000.TLPAX_close(self.instrHandler)
\ No newline at end of file
+        return self.libPAX.TLPAX_close(self.instrHandler)
\ No newline at end of file
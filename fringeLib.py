@@ -0,0 +1,152 @@
+import time
+import threading
+import numpy as np
+
+## libraries
+def fringeVisibility(frame):
+    """
+    (max - min)/(max + min) of a frame, nan if max + min is 0
+    """
+    frameMax, frameMin = np.maximum.reduce(frame), np.minimum.reduce(frame)
+    return (frameMax - frameMin)/(frameMax + frameMin) if frameMax + frameMin != 0 else np.nan
+
+
+def dtypeFringe(frequencyNum):
+    """
+    one record per frame in the FringeEstimator ring buffer
+    amplitude and phase are those of the lock-in at each dither frequency, amplitude in V (peak), phase in rad
+    """
+    return np.dtype([
+        ('frameNum', '<i8'), ('hostTime', '<f8'), ('sampleNum', '<i8'),
+        ('visibility', '<f8'), ('mean', '<f8'), ('min', '<f8'), ('max', '<f8'),
+        ('amplitude', '<f8', (frequencyNum,)), ('phase', '<f8', (frequencyNum,))])
+
+
+## main
+class FringeEstimator():
+    """
+    per-frame fringe visibility, mean and lock-in amplitude/phase at the dither frequencies of a DAQ reading
+    all buffers are allocated in the constructor, process() only runs NumPy reductions into them
+    results go to a history ring buffer of dtypeFringe, read with latest() and readSince(frameNum) from any thread
+
+    the lock-in references are continuous across frames: phases are referred to the first sample of frame 0
+    amplitudes are exact when a frame holds an integer number of periods of every frequency (100 and 500 Hz in 10000 samples at 100 kS/s),
+    otherwise the other tones leak in by roughly 1/(periods per frame)
+
+    example flow, with the parameters of the phase feedback notebook
+    estimator = FringeEstimator(samplingRate=100000, samplesPerFrame=10000, frequencies=(signalSlowFrequency, signalFastFrequency))
+    readTask.register_every_n_samples_acquired_into_buffer_event(samplesPerFrame, estimator.readingCallback(reader))
+    fringeVis = estimator.latest()['visibility']
+    """
+
+    def __init__(self, samplingRate=100000, samplesPerFrame=10000, frequencies=(100, 500), chanNum=1, channel=0, historySize=2**14):
+        """
+        constructor
+        samplingRate: S/s, samplesPerFrame: samples per channel and callback, frequencies: Hz of the dithers to demodulate
+        chanNum: channels in the reading, channel: the one carrying the fringes
+        """
+        self.samplingRate, self.samplesPerFrame = float(samplingRate), int(samplesPerFrame)
+        self.frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+        self.chanNum, self.channel = chanNum, channel
+
+        self.readBuffer = np.zeros((chanNum, self.samplesPerFrame), dtype=np.float64) ## read_many_sample writes here directly
+        omegaTime = 2*np.pi*np.outer(self.frequencies, np.arange(self.samplesPerFrame)/self.samplingRate)
+        self.reference = np.vstack([np.cos(omegaTime), -np.sin(omegaTime)]) ## rows: cos then -sin of each frequency
+        self.referenceSum = self.reference.sum(axis=1) ## to remove the frame mean without a subtracted copy
+        self.demodulated, self.meanProjection = np.zeros(2*self.frequencies.size), np.zeros(2*self.frequencies.size)
+        self.amplitude, self.phase, self.phaseStart = np.zeros(self.frequencies.size), np.zeros(self.frequencies.size), np.zeros(self.frequencies.size)
+
+        self.ringLock = threading.Lock()
+        self.ringBuffer, self.ringCount = np.zeros(historySize, dtype=dtypeFringe(self.frequencies.size)), 0
+        self.frameNum, self.sampleCount = 0, 0
+
+
+    def process(self, sampleNum=None):
+        """
+        estimate from the first sampleNum samples of readBuffer[channel] (all by default) and append a record
+        return the visibility
+        """
+        sampleNum = self.samplesPerFrame if sampleNum is None else min(int(sampleNum), self.samplesPerFrame)
+        frame = self.readBuffer[self.channel, :sampleNum] ## a view, shorter readings are not copied to match lengths
+        frequencyNum = self.frequencies.size
+
+        frameMax, frameMin = np.maximum.reduce(frame), np.minimum.reduce(frame)
+        frameMean = np.add.reduce(frame)/sampleNum
+        visibility = (frameMax - frameMin)/(frameMax + frameMin) if frameMax + frameMin != 0 else np.nan
+
+        ## lock-in: projections of frame - mean on cos/-sin
+        np.dot(self.reference[:, :sampleNum], frame, out=self.demodulated)
+        if sampleNum == self.samplesPerFrame: np.multiply(self.referenceSum, frameMean, out=self.meanProjection)
+        else: np.multiply(self.reference[:, :sampleNum].sum(axis=1), frameMean, out=self.meanProjection)
+        self.demodulated -= self.meanProjection
+        self.demodulated *= 2/sampleNum
+        np.hypot(self.demodulated[:frequencyNum], self.demodulated[frequencyNum:], out=self.amplitude)
+        np.arctan2(self.demodulated[frequencyNum:], self.demodulated[:frequencyNum], out=self.phase)
+        np.multiply(self.frequencies, 2*np.pi*self.sampleCount/self.samplingRate, out=self.phaseStart) ## reference phase at the frame start
+        self.phase -= self.phaseStart
+        self.phase += np.pi
+        np.remainder(self.phase, 2*np.pi, out=self.phase)
+        self.phase -= np.pi
+
+        with self.ringLock:
+            record = self.ringBuffer[self.ringCount % self.ringBuffer.size]
+            record['frameNum'], record['hostTime'], record['sampleNum'] = self.frameNum, time.time(), sampleNum
+            record['visibility'], record['mean'], record['min'], record['max'] = visibility, frameMean, frameMin, frameMax
+            record['amplitude'], record['phase'] = self.amplitude, self.phase
+            self.ringCount += 1
+        self.frameNum += 1
+        self.sampleCount += sampleNum
+        return visibility
+
+
+    def processFrame(self, frame):
+        """
+        copy a reading of shape (chanNum, n) or (n,) into readBuffer and process it, e.g. frames from a file or a simulation
+        """
+        frame = np.asarray(frame)
+        if frame.ndim == 1: frame = frame[None, :]
+        sampleNum = min(frame.shape[-1], self.samplesPerFrame)
+        np.copyto(self.readBuffer[:frame.shape[0], :sampleNum], frame[:, :sampleNum])
+        return self.process(sampleNum)
+
+
+    def readingCallback(self, reader):
+        """
+        nidaqmx every-n-samples callback reading with reader (an AnalogMultiChannelReader) into readBuffer, then process
+        replaces callbackReadingTask and its fringeVis global
+        """
+        def callbackReadingTask(taskID, eventType, samplesNum, callbackData=None):
+            reader.read_many_sample(self.readBuffer, samplesNum, timeout=-1) ## -1: constants.WAIT_INFINITELY
+            self.process(samplesNum)
+            return 0
+        return callbackReadingTask
+
+
+    def latest(self):
+        """
+        copy of the newest record, None if nothing was processed yet
+        """
+        with self.ringLock:
+            if self.ringCount == 0: return None
+            return self.ringBuffer[(self.ringCount-1) % self.ringBuffer.size].copy()
+
+
+    def readSince(self, frameNum=-1):
+        """
+        copy of all buffered records newer than frameNum, oldest first
+        records overwritten by the ring before being read are lost, pass the last frameNum seen to read incrementally
+        """
+        with self.ringLock:
+            recordNum = min(self.ringCount, self.ringBuffer.size)
+            index = np.arange(self.ringCount-recordNum, self.ringCount) % self.ringBuffer.size
+            start = np.searchsorted(self.ringBuffer['frameNum'][index], frameNum, side='right')
+            return self.ringBuffer[index[start:]]
+
+
+    def reset(self):
+        """
+        clear the history and restart the reference phase at the next frame
+        """
+        with self.ringLock:
+            self.ringCount, self.frameNum, self.sampleCount = 0, 0, 0
+        return 0
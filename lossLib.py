@@ -0,0 +1,140 @@
+import os, glob
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks
+
+from cacheLib import cachedColumns, readCsvColumns
+
+## libraries
+speedOfLight = 299792458 ## m/s
+traceArgs = {'delimiter': '\t', 'skiprows': 11, 'header': 1} ## OFDR/OTDR .txt exports as read in CalculateLoss_2.ipynb
+
+
+def readTrace(fileName, ng=1.5, useCache=True, **readArgs):
+    """
+    trace export with 'Time (ns)' and 'Amplitude' (dB) columns, parsed once and then reopened from the cacheLib cache
+    return position in m (one way, group index ng) and amplitude in dB
+    """
+    readArgs = {**traceArgs, **readArgs}
+    columns = cachedColumns(fileName, readCsvColumns, **readArgs) if useCache else readCsvColumns(fileName, **readArgs)
+    position = np.asarray(columns['Time (ns)'], dtype=np.float64)*1e-9*speedOfLight/ng
+    return position, np.asarray(columns['Amplitude'], dtype=np.float64)
+
+
+def findFacets(position, amplitude, height=-90, prominence=10, distance=2, positionRange=None):
+    """
+    facet reflections: peaks above height (dB) standing prominence (dB) out of the backscatter, instead of a hand-picked range
+    positionRange (m) restricts the search like current_range in the notebook
+    return the peak indices, in position order
+    """
+    mask = np.ones(position.size, dtype=bool) if positionRange is None else (position >= positionRange[0]) & (position <= positionRange[1])
+    offset = np.argmax(mask) if mask.any() else 0
+    peaks, _ = find_peaks(amplitude[mask], height=height, prominence=prominence, distance=distance)
+    return peaks + offset
+
+
+def linearFit(x, y):
+    """
+    least squares y = slope*x + intercept, same slope, intercept, r, stderr as scipy.stats.linregress
+    """
+    xMean, yMean = x.mean(), y.mean()
+    dx, dy = x - xMean, y - yMean
+    sxx, sxy, syy = np.dot(dx, dx), np.dot(dx, dy), np.dot(dy, dy)
+    slope = sxy/sxx
+    r = sxy/np.sqrt(sxx*syy) if syy > 0 else 0.0
+    stderr = np.sqrt(max(syy - slope*sxy, 0.0)/(x.size - 2)/sxx) if x.size > 2 else np.nan
+    return slope, yMean - slope*xMean, r, stderr
+
+
+def bootstrapSlope(x, y, resampleNum=2000, q=0.95, seed=None, maxChunk=2**22):
+    """
+    percentile bootstrap of the regression slope, paired resampling
+    every resample is a row of an index matrix, slopes come from row reductions, no Python loop over resamples
+    rows are processed maxChunk samples at a time to bound the memory
+    return the slopes of all resamples and the (low, high) interval at confidence q
+    """
+    rng = np.random.default_rng(seed)
+    x = x - x.mean() ## centered once, keeps the sums below well conditioned
+    slopes = np.empty(resampleNum)
+    rowNum = max(1, maxChunk//x.size)
+    for start in range(0, resampleNum, rowNum):
+        index = rng.integers(0, x.size, (min(rowNum, resampleNum - start), x.size), dtype=np.int32)
+        xs, ys = x[index], y[index]
+        xMean, yMean = xs.mean(axis=1), ys.mean(axis=1)
+        slopes[start:start+index.shape[0]] = (np.einsum('ij,ij->i', xs, ys)/x.size - xMean*yMean)/(np.einsum('ij,ij->i', xs, xs)/x.size - xMean**2)
+    return slopes, tuple(np.percentile(slopes, [50*(1-q), 50*(1+q)]))
+
+
+def fitSegments(position, amplitude, facets, guard=0.1, minPoints=10, outer=False, resampleNum=2000, q=0.95, seed=None):
+    """
+    propagation loss of the fiber or waveguide between consecutive facets, guard m away from each peak
+    outer=True fits only between the first and the last facet, as the notebook does
+    alpha is slope/2 (dB/m, the trace is round trip), its interval from bootstrapSlope
+
+    return one dict per segment
+    """
+    facets = np.asarray(facets)
+    pairs = [(facets[0], facets[-1])] if outer and facets.size >= 2 else list(zip(facets[:-1], facets[1:]))
+    rows = []
+    for segment, (peakStart, peakStop) in enumerate(pairs):
+        start = np.searchsorted(position, position[peakStart] + guard)
+        stop = np.searchsorted(position, position[peakStop] - guard, side='right')
+        row = {'segment': segment, 'facetStart [m]': position[peakStart], 'facetStop [m]': position[peakStop],
+               'length [m]': position[peakStop] - position[peakStart], 'pointNum': max(stop - start, 0)}
+        if stop - start < minPoints:
+            rows.append({**row, 'error': 'fewer than {} points between the facets'.format(minPoints)})
+            continue
+
+        x, y = position[start:stop], amplitude[start:stop]
+        slope, intercept, r, stderr = linearFit(x, y)
+        _, (slopeLow, slopeHigh) = bootstrapSlope(x, y, resampleNum, q, seed) if resampleNum else (None, (np.nan, np.nan))
+        rows.append({**row, 'slope [dB/m]': slope, 'intercept [dB]': intercept, 'rSquared': r**2, 'stderr [dB/m]': stderr,
+                     'alpha [dB/m]': slope/2, 'alphaLow [dB/m]': slopeLow/2, 'alphaHigh [dB/m]': slopeHigh/2,
+                     'facetStart [dB]': amplitude[peakStart], 'facetStop [dB]': amplitude[peakStop]})
+    return rows
+
+
+def analyzeTrace(job):
+    """
+    all segments of one trace file, job is (fileName, kwargs) with the arguments of readTrace, findFacets and fitSegments
+    top level so that it can be pickled to a process pool, errors are returned as a row instead of stopping the batch
+    """
+    fileName, kwargs = job
+    readArgs = {key: kwargs[key] for key in ('ng', 'useCache') if key in kwargs}
+    facetArgs = {key: kwargs[key] for key in ('height', 'prominence', 'distance', 'positionRange') if key in kwargs}
+    fitArgs = {key: kwargs[key] for key in ('guard', 'minPoints', 'outer', 'resampleNum', 'q', 'seed') if key in kwargs}
+    try:
+        position, amplitude = readTrace(fileName, **readArgs)
+        facets = findFacets(position, amplitude, **facetArgs)
+        if facets.size < 2: return [{'file': fileName, 'facetNum': facets.size, 'error': 'fewer than 2 facet peaks'}]
+        return [{'file': fileName, 'facetNum': facets.size, **row} for row in fitSegments(position, amplitude, facets, **fitArgs)]
+    except Exception as error:
+        return [{'file': fileName, 'error': '{}: {}'.format(type(error).__name__, error)}]
+
+
+## main
+def analyzeDirectory(directory, pattern='*.txt', maxWorkers=None, outName=None, seed=0, **kwargs):
+    """
+    loss of every trace file matching pattern in directory, files spread across a process pool
+    kwargs go to readTrace (ng), findFacets (height, prominence, distance, positionRange) and fitSegments (guard, outer, resampleNum, q, ...)
+    maxWorkers=1 runs serially in this process, None uses all cores; file i bootstraps with seed + i, so results are reproducible
+    outName: csv written with the results table
+
+    example flow
+    results = analyzeDirectory(r'...\\check length of fiber', ng=1.468, guard=0.1, outName='loss.csv')
+    results.groupby('file')['alpha [dB/m]'].mean()
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    fileNames = sorted(glob.glob(os.path.join(directory, pattern)))
+    jobs = [(fileName, {**kwargs, 'seed': None if seed is None else seed + i}) for i, fileName in enumerate(fileNames)]
+    if maxWorkers == 1 or len(jobs) <= 1:
+        results = list(map(analyzeTrace, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+            results = list(executor.map(analyzeTrace, jobs))
+
+    table = pd.DataFrame([row for rows in results for row in rows])
+    if 'file' in table: table['file'] = [os.path.relpath(fileName, directory) for fileName in table['file']]
+    if outName is not None: table.to_csv(outName, index=False)
+    return table
@@ -0,0 +1,235 @@
+import os, bisect, json
+import datetime
+import numpy as np
+
+## libraries
+columnNamesPhase = ['Time', 'PhaseMax', 'PhaseMin', 'PhaseAve'] ## data0 is seconds since the start of the log
+dtypeEnvelope = np.dtype([('min', '<f8'), ('max', '<f8'), ('mean', '<f8'), ('count', '<i8')])
+
+def readHeader(fileName):
+    """
+    parse the phase logger header
+    'c': char, int32 column count
+    'd': char, int64 unix timestamp, int32 column count
+
+    return format char, header size in bytes, column count, unix timestamp of the start
+    """
+    with open(fileName, 'rb') as fileHandler:
+        charHandler = fileHandler.read(1).decode('utf-8')
+        if charHandler == 'c':
+            columnNum = int.from_bytes(fileHandler.read(4), 'little')
+            timeInit = os.path.getctime(fileName) ## no timestamp in the file, use the creation time
+            headerSize = 1 + 4
+        elif charHandler == 'd':
+            timeInit = int.from_bytes(fileHandler.read(8), 'little')
+            columnNum = int.from_bytes(fileHandler.read(4), 'little')
+            headerSize = 1 + 8 + 4
+        else:
+            raise RuntimeError('unknown phase log format: {}'.format(charHandler))
+    return charHandler, headerSize, columnNum, timeInit
+
+## main
+class PhaseLog():
+    """
+    memory-mapped reader for the phase logger .bin files
+    the header is parsed once, the body is exposed as a read-only structured np.memmap, nothing is loaded until sliced
+
+    example flow
+    phaseLog = PhaseLog(fileNamePhase)
+    phaseLog.data['PhaseAve']                       ## zero-copy view of a column
+    phaseLog.datetime()                             ## datetime64 axis, local time as in the notebooks
+    phaseLog.sliceTime(datetime.datetime(2023, 8, 24, 15, 54), datetime.datetime(2023, 8, 25, 4, 0))
+    """
+
+    def __init__(self, fileName):
+        """
+        constructor
+        fileName: string
+        """
+        self.fileName = fileName
+        self.formatChar, self.headerSize, self.columnNum, self.timeInit = readHeader(fileName)
+
+        self.columnNames = columnNamesPhase[:self.columnNum] + [f'data{i}' for i in range(len(columnNamesPhase), self.columnNum)]
+        self.dtype = np.dtype([(name, '<f8') for name in self.columnNames])
+        self.rowNum = (os.path.getsize(fileName) - self.headerSize)//self.dtype.itemsize ## drop a partially written last row
+        if self.rowNum > 0:
+            self.data = np.memmap(fileName, dtype=self.dtype, mode='r', offset=self.headerSize, shape=(self.rowNum,))
+        else:
+            self.data = np.zeros(0, dtype=self.dtype)
+
+
+    def __len__(self):
+        return self.rowNum
+
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+
+    def epoch(self, rows=slice(None)):
+        """
+        unix time in s of the given rows
+        """
+        return self.timeInit + self.data['Time'][rows]
+
+
+    def datetime(self, rows=slice(None)):
+        """
+        datetime64[us] axis of the given rows, in local time like datetime.datetime.fromtimestamp
+        """
+        utcOffset = datetime.datetime.fromtimestamp(self.timeInit) - datetime.datetime.fromtimestamp(self.timeInit, datetime.timezone.utc).replace(tzinfo=None)
+        return ((self.epoch(rows) + utcOffset.total_seconds())*1e6).astype('datetime64[us]')
+
+
+    def timeToRow(self, timeValue):
+        """
+        first row at or after timeValue, which is a local datetime.datetime or a unix time in s
+        binary search on the time column, only touches log(n) rows of the file
+        """
+        if isinstance(timeValue, datetime.datetime): timeValue = timeValue.timestamp()
+        return bisect.bisect_left(self.data['Time'], timeValue - self.timeInit)
+
+
+    def sliceTime(self, start=None, end=None):
+        """
+        zero-copy view of the rows between start and end
+        """
+        rowStart = 0 if start is None else self.timeToRow(start)
+        rowEnd = self.rowNum if end is None else self.timeToRow(end)
+        return self.data[rowStart:rowEnd]
+
+
+    def closeFile(self):
+        """
+        drop the memory map, the file is unmapped once no slice of it is referenced anymore
+        """
+        self.data = np.zeros(0, dtype=self.dtype)
+        self.rowNum = 0
+
+
+def reduceBuckets(chunk, bucketSize):
+    """
+    min/max/mean/count of consecutive buckets of a 1d chunk, the last bucket may be partial
+    """
+    chunk = np.asarray(chunk, dtype=np.float64)
+    fullNum = chunk.size//bucketSize
+    envelope = np.empty(-(-chunk.size//bucketSize), dtype=dtypeEnvelope)
+
+    full = chunk[:fullNum*bucketSize].reshape(fullNum, bucketSize)
+    envelope['min'][:fullNum] = full.min(axis=1)
+    envelope['max'][:fullNum] = full.max(axis=1)
+    envelope['mean'][:fullNum] = full.mean(axis=1)
+    envelope['count'][:fullNum] = bucketSize
+    if envelope.size > fullNum:
+        rest = chunk[fullNum*bucketSize:]
+        envelope[-1] = (rest.min(), rest.max(), rest.mean(), rest.size)
+    return envelope
+
+
+def mergeBuckets(envelope, factor):
+    """
+    merge groups of factor consecutive envelope buckets into one, the last group may be partial
+    """
+    groupNum = -(-envelope.size//factor)
+    padded = np.zeros(groupNum*factor, dtype=dtypeEnvelope)
+    padded['min'], padded['max'] = np.inf, -np.inf
+    padded[:envelope.size] = envelope
+    padded = padded.reshape(groupNum, factor)
+
+    merged = np.empty(groupNum, dtype=dtypeEnvelope)
+    merged['min'] = padded['min'].min(axis=1)
+    merged['max'] = padded['max'].max(axis=1)
+    merged['count'] = padded['count'].sum(axis=1)
+    merged['mean'] = (padded['mean']*padded['count']).sum(axis=1)/merged['count']
+    return merged
+
+
+class EnvelopePyramid():
+    """
+    multi-resolution min/max/mean envelope of a long 1d signal, cached on disk as one .npy per level
+    level 0 has baseBucket samples per bucket, every next level merges factor buckets of the previous one
+    built in fixed-size chunks, so memory use does not depend on the length of the log
+
+    example flow
+    phaseLog = PhaseLog(fileNamePhase)
+    pyramid = EnvelopePyramid.fromPhaseLog(phaseLog, 'PhaseAve')    ## built once, then reopened from the cache
+    rows, envelope = pyramid.view(0, len(phaseLog), maxPoints=200000) ## MAX_NUM_OF_POINTS_TO_PLOT
+    plt.fill_between(phaseLog.datetime(rows), envelope['min'], envelope['max'])
+    """
+
+    def __init__(self, cacheDir):
+        """
+        constructor, open an already built pyramid
+        cacheDir: string
+        """
+        with open(os.path.join(cacheDir, 'meta.json')) as fileHandler:
+            self.meta = json.load(fileHandler)
+        self.cacheDir = cacheDir
+        self.rowNum = self.meta['rowNum']
+        self.bucketSizes = self.meta['bucketSizes']
+        self.levels = [np.load(os.path.join(cacheDir, f'level{i}.npy'), mmap_mode='r') for i in range(len(self.bucketSizes))]
+
+
+    @classmethod
+    def build(cls, source, cacheDir, baseBucket=16, factor=4, minBuckets=1000, chunkSize=2**20, meta=None):
+        """
+        stream source (any sliceable 1d array, e.g. a memmap column) into a pyramid in cacheDir
+        meta is stored along the levels and used by the caller to check the cache
+        """
+        os.makedirs(cacheDir, exist_ok=True)
+        metaPath = os.path.join(cacheDir, 'meta.json')
+        if os.path.exists(metaPath): os.remove(metaPath) ## mark as incomplete while rebuilding
+
+        rowNum = len(source)
+        chunkSize = max(chunkSize//(baseBucket*factor), 1)*baseBucket*factor ## whole buckets of every level
+        bucketSizes = [baseBucket]
+        level = np.lib.format.open_memmap(os.path.join(cacheDir, 'level0.npy'), mode='w+', dtype=dtypeEnvelope, shape=(max(-(-rowNum//baseBucket), 1),))
+        for rowStart in range(0, rowNum, chunkSize):
+            chunk = reduceBuckets(source[rowStart:rowStart+chunkSize], baseBucket)
+            level[rowStart//baseBucket:rowStart//baseBucket + chunk.size] = chunk
+        level.flush()
+
+        while level.size > minBuckets:
+            nextLevel = np.lib.format.open_memmap(os.path.join(cacheDir, f'level{len(bucketSizes)}.npy'), mode='w+', dtype=dtypeEnvelope, shape=(-(-level.size//factor),))
+            bucketStep = chunkSize//baseBucket
+            for bucketStart in range(0, level.size, bucketStep):
+                merged = mergeBuckets(level[bucketStart:bucketStart+bucketStep], factor)
+                nextLevel[bucketStart//factor:bucketStart//factor + merged.size] = merged
+            nextLevel.flush()
+            level = nextLevel
+            bucketSizes.append(bucketSizes[-1]*factor)
+
+        with open(metaPath, 'w') as fileHandler:
+            json.dump(dict(meta or {}, rowNum=rowNum, bucketSizes=bucketSizes), fileHandler)
+        return cls(cacheDir)
+
+
+    @classmethod
+    def fromPhaseLog(cls, phaseLog, column='PhaseAve', cacheDir=None, **kwargs):
+        """
+        open the cached pyramid of a PhaseLog column, (re)building it if the log changed since
+        the cache defaults to a folder next to the log
+        meta.json is checked before any level is mapped: build() rewrites the level files in place,
+        which Windows refuses while they are still mapped
+        """
+        if cacheDir is None: cacheDir = f'{phaseLog.fileName}.{column}.envelope'
+        fileStats = os.stat(phaseLog.fileName)
+        meta = {'source': os.path.abspath(phaseLog.fileName), 'column': column, 'size': fileStats.st_size, 'mtime': fileStats.st_mtime}
+        try:
+            with open(os.path.join(cacheDir, 'meta.json')) as fileHandler: cachedMeta = json.load(fileHandler)
+            if all(cachedMeta.get(key) == value for key, value in meta.items()): return cls(cacheDir)
+        except (OSError, ValueError):
+            pass
+        return cls.build(phaseLog.data[column], cacheDir, meta=meta, **kwargs)
+
+
+    def view(self, rowStart=0, rowEnd=None, maxPoints=200000):
+        """
+        envelope of rows [rowStart, rowEnd) at the finest level with at most maxPoints buckets
+        return the first row of every bucket and a zero-copy slice of the level
+        """
+        if rowEnd is None: rowEnd = self.rowNum
+        for bucketSize, level in zip(self.bucketSizes, self.levels):
+            if (rowEnd - rowStart)/bucketSize <= maxPoints: break
+        bucketStart, bucketEnd = rowStart//bucketSize, -(-rowEnd//bucketSize)
+        return np.arange(bucketStart, bucketEnd)*bucketSize, level[bucketStart:bucketEnd]
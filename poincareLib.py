@@ -0,0 +1,316 @@
+import numpy as np
+
+from cacheLib import cachedColumns, readCsvColumns
+
+## libraries
+## getSingleMeas layout of thorlabsPAX1000: time stamp, normalized S1, S2, S3, power, DOP, azimuth, ellipticity
+measColumns = ['timeStamp', 'S1', 'S2', 'S3', 'power', 'DOP', 'azimuth', 'ellipticity']
+## PAX1000/Keysight csv export columns (names stripped, matched case-insensitively on the start) to the names above
+csvColumns = {'normalized s 1': 'S1', 'normalized s 2': 'S2', 'normalized s 3': 'S3', 's 0': 'power', 'dop': 'DOP',
+              'azimuth': 'azimuth', 'ellipticity': 'ellipticity', 'time': 'time'}
+
+
+def normalizeStokes(stokes):
+    """
+    (n, 3) S1, S2, S3 or (n, 4) S0..S3 to unit (n, 3) vectors, replaces the S0/S0 loop of the notebooks
+    """
+    stokes = np.asarray(stokes, dtype=np.float64)
+    if stokes.shape[-1] == 4: stokes = stokes[..., 1:]
+    return stokes/np.linalg.norm(stokes, axis=-1, keepdims=True)
+
+
+def stokesToAngles(stokes, degrees=False):
+    """
+    (n, 3) Stokes vectors to azimuth in [-pi/2, pi/2] and ellipticity in [-pi/4, pi/4], same as the PAX1000 definition
+    """
+    stokes = np.asarray(stokes, dtype=np.float64)
+    azimuth = 0.5*np.arctan2(stokes[..., 1], stokes[..., 0])
+    ellipticity = 0.5*np.arctan2(stokes[..., 2], np.hypot(stokes[..., 0], stokes[..., 1]))
+    if degrees: return np.rad2deg(azimuth), np.rad2deg(ellipticity)
+    return azimuth, ellipticity
+
+
+def anglesToStokes(azimuth, ellipticity, degrees=False):
+    """
+    azimuth and ellipticity to (n, 3) unit Stokes vectors
+    """
+    azimuth, ellipticity = np.asarray(azimuth, dtype=np.float64), np.asarray(ellipticity, dtype=np.float64)
+    if degrees: azimuth, ellipticity = np.deg2rad(azimuth), np.deg2rad(ellipticity)
+    cos2Chi = np.cos(2*ellipticity)
+    return np.stack([cos2Chi*np.cos(2*azimuth), cos2Chi*np.sin(2*azimuth), np.sin(2*ellipticity)], axis=-1)
+
+
+def unwrapAzimuth(azimuth, degrees=False):
+    """
+    remove the +-90 deg jumps of the azimuth, replaces the jump counter loop of read polarimeter data.ipynb
+    """
+    return np.unwrap(azimuth, period=180.0 if degrees else np.pi)
+
+
+def sphereAngle(stokesA, stokesB):
+    """
+    great-circle angle in rad between Stokes vectors, row by row
+    atan2(|a x b|, a.b) stays accurate for small and near-antipodal angles where arccos of the dot product does not
+    """
+    stokesA, stokesB = np.asarray(stokesA, dtype=np.float64), np.asarray(stokesB, dtype=np.float64)
+    return np.arctan2(np.linalg.norm(np.cross(stokesA, stokesB), axis=-1), np.einsum('...i,...i->...', stokesA, stokesB))
+
+
+def sopChange(stokes, lag=1):
+    """
+    great-circle SOP change in rad between samples i and i+lag, n-lag values
+    """
+    stokes = np.asarray(stokes, dtype=np.float64)
+    return sphereAngle(stokes[:-lag], stokes[lag:])
+
+
+def angularSpeed(stokes, times, lag=1):
+    """
+    SOP angular speed in rad/s between samples i and i+lag, times in s
+    """
+    times = np.asarray(times, dtype=np.float64)
+    return sopChange(stokes, lag)/(times[lag:] - times[:-lag])
+
+
+def driftStats(stokes, times=None, window=1000):
+    """
+    drift statistics over consecutive windows of window samples, the last window may be shorter
+    returns a dict of arrays, one value per window:
+    start, stop: sample index range; time: mean time (s) if times are given
+    meanSop: (k, 3) direction of the mean Stokes vector; spread: 1 - length of the mean of unit vectors (0 for a fixed SOP)
+    maxDeviation: largest angle (rad) from meanSop; pathLength: summed sample-to-sample change (rad)
+    netChange: angle (rad) between the first and the last sample; speed: pathLength over the window duration (rad/s)
+    """
+    stokes = normalizeStokes(stokes)
+    sampleNum = stokes.shape[0]
+    starts = np.arange(0, sampleNum, window)
+    stops = np.minimum(starts + window, sampleNum)
+    counts = stops - starts
+
+    meanVector = np.add.reduceat(stokes, starts, axis=0)/counts[:, None]
+    meanLength = np.linalg.norm(meanVector, axis=1)
+    meanSop = meanVector/np.where(meanLength > 0, meanLength, 1)[:, None]
+    windowIndex = np.repeat(np.arange(starts.size), counts)
+    maxDeviation = np.maximum.reduceat(sphereAngle(stokes, meanSop[windowIndex]), starts)
+
+    stepChange = np.concatenate([[0.0], sopChange(stokes)]) if sampleNum > 1 else np.zeros(sampleNum)
+    stepChange[starts] = 0 ## no step across window borders
+    stats = {'start': starts, 'stop': stops, 'meanSop': meanSop, 'spread': 1 - meanLength, 'maxDeviation': maxDeviation,
+             'pathLength': np.add.reduceat(stepChange, starts), 'netChange': sphereAngle(stokes[starts], stokes[stops-1])}
+    if times is not None:
+        times = np.asarray(times, dtype=np.float64)
+        duration = times[stops-1] - times[starts]
+        stats['time'] = np.add.reduceat(times, starts)/counts
+        stats['speed'] = np.divide(stats['pathLength'], duration, out=np.full(starts.size, np.nan), where=duration > 0)
+    return stats
+
+
+## loaders
+def fromMeasurements(measurements):
+    """
+    dict of arrays from getSingleMeas rows (list or (n, 8) array) or from the PAX1000 ring buffer records (dtypeScan)
+    'stokes' is the (n, 3) unit Stokes array
+    """
+    if isinstance(measurements, np.ndarray) and measurements.dtype.names is not None:
+        columns = {name: measurements[name] for name in measurements.dtype.names}
+    else:
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, len(measColumns))
+        columns = dict(zip(measColumns, measurements.T))
+    columns['stokes'] = normalizeStokes(np.stack([columns['S1'], columns['S2'], columns['S3']], axis=-1))
+    return columns
+
+
+def loadPaxCsv(fileName, useCache=True, encoding='unicode_escape'):
+    """
+    PAX1000/Keysight polarimeter csv export, parsed once and then reopened from the cacheLib cache
+    returns the columns found under the names of measColumns (azimuth and ellipticity in deg, as exported) and 'stokes',
+    taken from the normalized s columns or, without them, from azimuth and ellipticity
+    """
+    raw = cachedColumns(fileName, readCsvColumns, encoding=encoding) if useCache else readCsvColumns(fileName, encoding=encoding)
+    columns = {}
+    for name, column in raw.items():
+        for prefix, key in csvColumns.items():
+            if name.lower().startswith(prefix) and key not in columns:
+                columns[key] = column
+                break
+    if all(key in columns for key in ('S1', 'S2', 'S3')):
+        columns['stokes'] = normalizeStokes(np.stack([columns['S1'], columns['S2'], columns['S3']], axis=-1).astype(np.float64))
+    else:
+        columns['stokes'] = anglesToStokes(columns['azimuth'], columns['ellipticity'], degrees=True)
+    return columns
+
+
+## main
+class PoincareBins():
+    """
+    equal-area binning of the Poincare sphere: counts and dwell times of SOP streams per cell, O(cells) memory whatever the duration
+    the grid is a set of rings around the S3 axis, ring i holds ringCells[i] cells of equal longitude (2*azimuth) width,
+    the ring borders are placed so that every cell has exactly the area 4*pi/cellNum, cells stay roughly square up to the poles
+
+    example flow
+    bins = PoincareBins(bandNum=64)                 ## ~5200 cells of ~2.8 deg
+    bins.add(loadPaxCsv(name)['stokes'], sampleTime=1.0)
+    scanID = bins.addFromPax(pax, scanID)           ## incremental, from the PAX1000 acquisition ring
+    bins.uniformity(); bins.render()
+    """
+
+    def __init__(self, bandNum=64):
+        """
+        constructor
+        bandNum: number of rings, about sqrt(cellNum*pi)/2
+        """
+        colatitude = np.linspace(0, np.pi, bandNum + 1)
+        ringArea = 2*np.pi*(np.cos(colatitude[:-1]) - np.cos(colatitude[1:]))
+        ringWidth = np.pi/bandNum
+        self.ringCells = np.maximum(1, np.round(ringArea/ringWidth**2)).astype(np.int64) ## square cells of side ringWidth
+        self.cellNum = int(self.ringCells.sum())
+        self.cellArea = 4*np.pi/self.cellNum
+        self.ringStart = np.concatenate([[0], np.cumsum(self.ringCells)[:-1]])
+        ## z = S3 borders from the north pole down, ring i covers exactly ringCells[i] cells of area cellArea
+        self.zEdges = 1 - np.concatenate([[0], np.cumsum(self.ringCells)])*self.cellArea/(2*np.pi)
+        self.zEdges[-1] = -1.0
+
+        self.counts = np.zeros(self.cellNum, dtype=np.int64)
+        self.dwell = np.zeros(self.cellNum, dtype=np.float64) ## s
+        self.lastCell, self.lastTime = None, None ## last sample of the stream, its dwell ends with the next sample
+
+
+    def cellIndex(self, stokes):
+        """
+        cell of each Stokes vector (n, 3), need not be normalized
+        """
+        stokes = np.asarray(stokes, dtype=np.float64)
+        norm = np.linalg.norm(stokes, axis=-1)
+        z = stokes[..., 2]/np.where(norm > 0, norm, 1)
+        ring = np.clip(np.searchsorted(-self.zEdges, -z, side='right') - 1, 0, self.ringCells.size - 1)
+        longitude = np.arctan2(stokes[..., 1], stokes[..., 0])/(2*np.pi) % 1.0
+        cell = np.minimum((longitude*self.ringCells[ring]).astype(np.int64), self.ringCells[ring] - 1)
+        return self.ringStart[ring] + cell
+
+
+    def cellCenters(self):
+        """
+        (cellNum, 3) unit vectors of the cell centers
+        """
+        ring = np.repeat(np.arange(self.ringCells.size), self.ringCells)
+        z = 0.5*(self.zEdges[ring] + self.zEdges[ring + 1])
+        longitude = 2*np.pi*(np.arange(self.cellNum) - self.ringStart[ring] + 0.5)/self.ringCells[ring]
+        rho = np.sqrt(1 - z**2)
+        return np.stack([rho*np.cos(longitude), rho*np.sin(longitude), z], axis=-1)
+
+
+    def add(self, stokes, times=None, sampleTime=None):
+        """
+        add a chunk of a SOP stream, (n, 3) or (n, 4) Stokes vectors
+        dwell: times in s of each sample, or a constant sampleTime in s, nothing if neither is given
+        with times, the last sample of a chunk gets its dwell when the next chunk arrives
+        """
+        stokes = np.asarray(stokes, dtype=np.float64)
+        if stokes.shape[-1] == 4: stokes = stokes[..., 1:]
+        if stokes.shape[0] == 0: return 0
+        cells = self.cellIndex(stokes)
+        self.counts += np.bincount(cells, minlength=self.cellNum)
+
+        if times is not None:
+            times = np.asarray(times, dtype=np.float64)
+            if self.lastCell is not None: self.dwell[self.lastCell] += max(times[0] - self.lastTime, 0.0)
+            self.dwell += np.bincount(cells[:-1], weights=np.maximum(np.diff(times), 0.0), minlength=self.cellNum)
+            self.lastCell, self.lastTime = cells[-1], times[-1]
+        elif sampleTime is not None:
+            self.dwell += np.bincount(cells, minlength=self.cellNum)*sampleTime
+        return 0
+
+
+    def addFromPax(self, pax, scanID=-1):
+        """
+        add the records of a thorlabsPAX1000 acquisition ring newer than scanID, dwell from their host times
+        return the last scanID read, pass it to the next call
+        """
+        records = pax.readSince(scanID)
+        if records.size == 0: return scanID
+        self.add(np.stack([records['S1'], records['S2'], records['S3']], axis=-1), records['hostTime'])
+        return int(records['scanID'][-1])
+
+
+    def merge(self, other):
+        """
+        add the counts and dwell times of another PoincareBins of the same bandNum, e.g. another day of the same run
+        """
+        if other.cellNum != self.cellNum: raise ValueError('cannot merge grids of {} and {} cells'.format(self.cellNum, other.cellNum))
+        self.counts += other.counts
+        self.dwell += other.dwell
+        return 0
+
+
+    def uniformity(self, weights='counts'):
+        """
+        coverage metrics of counts or dwell
+        coverage: fraction of cells visited; entropy: Shannon entropy normalized to 1 for a uniform sphere
+        effectiveCells: exp(entropy) as a number of cells; cv: coefficient of variation over all cells (0 when uniform)
+        maxOverMean: densest cell over the mean; chi2: chi-square distance to uniform per cell
+        """
+        values = (self.counts if weights == 'counts' else self.dwell).astype(np.float64)
+        total = values.sum()
+        if total == 0: return {'coverage': 0.0, 'entropy': 0.0, 'effectiveCells': 0.0, 'cv': np.nan, 'maxOverMean': np.nan, 'chi2': np.nan}
+        prob = values/total
+        nonzero = prob[prob > 0]
+        entropy = float(-(nonzero*np.log(nonzero)).sum()) + 0.0 ## no -0.0 for a single cell
+        mean = total/self.cellNum
+        return {'coverage': float(np.count_nonzero(values)/self.cellNum), 'entropy': float(entropy/np.log(self.cellNum)),
+                'effectiveCells': float(np.exp(entropy)), 'cv': float(values.std()/mean), 'maxOverMean': float(values.max()/mean),
+                'chi2': float(((prob*self.cellNum - 1)**2).mean())}
+
+
+    def save(self, fileName):
+        np.savez_compressed(fileName, bandNum=self.ringCells.size, counts=self.counts, dwell=self.dwell)
+
+
+    @classmethod
+    def load(cls, fileName):
+        with np.load(fileName) as data:
+            bins = cls(int(data['bandNum']))
+            bins.counts[:], bins.dwell[:] = data['counts'], data['dwell']
+        return bins
+
+
+    def render(self, ax=None, weights='counts', projection='3d', logScale=True, **scatterArgs):
+        """
+        draw the visited cells colored by counts or dwell, one point per cell instead of one per sample
+        projection '3d' on the sphere, 'map' on the equal-area plane 2*azimuth vs S3
+        """
+        import matplotlib.pyplot as plt
+
+        values = (self.counts if weights == 'counts' else self.dwell).astype(np.float64)
+        visited = values > 0
+        centers, values = self.cellCenters()[visited], values[visited]
+        if logScale: values = np.log10(values)
+        scatterArgs = {'s': 4, 'cmap': 'viridis', **scatterArgs}
+
+        if projection == '3d':
+            if ax is None: ax = plt.figure(figsize=(10, 10)).add_subplot(111, projection='3d')
+            handler = ax.scatter(centers[:, 0], centers[:, 1], centers[:, 2], c=values, **scatterArgs)
+            ax.set_xlabel('S1'); ax.set_ylabel('S2'); ax.set_zlabel('S3'); ax.set_box_aspect((1, 1, 1))
+        else:
+            if ax is None: ax = plt.figure(figsize=(10, 5)).add_subplot(111)
+            handler = ax.scatter(np.rad2deg(np.arctan2(centers[:, 1], centers[:, 0])), centers[:, 2], c=values, **scatterArgs)
+            ax.set_xlabel('2*azimuth [deg]'); ax.set_ylabel('S3'); ax.set_xlim(-180, 180); ax.set_ylim(-1, 1)
+        plt.colorbar(handler, ax=ax, label=('log10 ' if logScale else '') + ('counts' if weights == 'counts' else 'dwell [s]'))
+        return ax
+
+
+## plotting
+def drawPoincare(stokes, ax=None, maxPoints=100000, **scatterArgs):
+    """
+    all samples on the Poincare sphere with one scatter call, decimated to maxPoints, instead of draw_stokes_poincare per sample
+    """
+    import matplotlib.pyplot as plt
+
+    stokes = normalizeStokes(stokes)
+    stokes = stokes[::max(1, -(-stokes.shape[0]//maxPoints))]
+    if ax is None: ax = plt.figure(figsize=(10, 10)).add_subplot(111, projection='3d')
+
+    u, v = np.meshgrid(np.linspace(0, 2*np.pi, 49), np.linspace(0, np.pi, 25))
+    ax.plot_wireframe(np.cos(u)*np.sin(v), np.sin(u)*np.sin(v), np.cos(v), color='gray', alpha=0.2, linewidth=0.5)
+    ax.scatter(stokes[:, 0], stokes[:, 1], stokes[:, 2], **{'s': 2, 'color': 'red', **scatterArgs})
+    ax.set_xlabel('S1'); ax.set_ylabel('S2'); ax.set_zlabel('S3'); ax.set_box_aspect((1, 1, 1))
+    return ax
@@ -0,0 +1,277 @@
+import time
+import numpy as np
+
+## libraries
+voltageLimits = (-5.0, 5.0) ## EPC400 channel range in V
+
+def calculateVertices(center, length, threshold=5):
+    """
+    the 8 vertices of a cube of side length around center, clipped to +-threshold V
+    as in the phase feedback notebook, used by the 'cube' strategy
+    """
+    offsets = np.array(np.meshgrid(*[[-1, 1]]*len(center), indexing='ij')).reshape(len(center), -1).T*round(length/2, 3)
+    return np.clip(np.asarray(center) + offsets, -threshold, threshold)
+
+
+## objectives, functions of nothing returning a float to maximize
+def averaged(objective, sampleNum=4):
+    """
+    mean of sampleNum calls of objective, against detector noise
+    """
+    return lambda: float(np.mean([objective() for _ in range(sampleNum)]))
+
+
+def paxPower(pax):
+    """
+    power in W on a thorlabsPAX1000, e.g. behind a polarizer
+    """
+    return pax.getPower
+
+
+def paxDOP(pax):
+    """
+    degree of polarization on a thorlabsPAX1000
+    """
+    return lambda: pax.getSingleMeas()[5]
+
+
+def paxOverlap(pax, targetSop):
+    """
+    (1 + s.t)/2 of the measured normalized Stokes vector s with targetSop t on a thorlabsPAX1000, 1 when aligned
+    """
+    targetSop = np.asarray(targetSop, dtype=np.float64)/np.linalg.norm(targetSop)
+    return lambda: 0.5*(1 + float(np.dot(pax.getStokes()[1:], targetSop)))
+
+
+## main
+class PolarizationOptimizer():
+    """
+    hill climbing of an objective (fringe visibility from the DAQ, power or DOP from the PAX1000, ...) over EPC400 voltages
+    every evaluation is one setVoltagesBulk call, so only the channels that moved are written, with a single MDC
+
+    strategies, evaluations per step for n channels
+    'coordinate': one channel at a time, +step then -step: 1 to 2
+    'spsa': simultaneous random +-step dither of all channels, gradient from the difference: 2
+    'simplex': one Nelder-Mead iteration: 1 to 2, n+2 on a shrink
+    'cube': the notebook search, all 2**n cube vertices and the center: 2**n+1
+
+    steps are per channel and adapt from the gradient history, rprop-like: grown while the gradient keeps its sign,
+    halved when it flips or nothing improves, between stepMin and stepMax
+
+    example flow
+    optimizer = PolarizationOptimizer(epc, lambda: fringeVis, strategy='spsa', settle=0.01)
+    optimizer.run(maxSteps=500)                      ## until converged
+    optimizer.hold(stopEvent, dropFrac=0.05)         ## lock: watch, re-optimize only when the objective drops
+    """
+
+    def __init__(self, epc, objective, channels=(0, 1, 2), voltages=None, strategy='coordinate', step=0.2, stepMin=5e-3, stepMax=1.0,
+                 settle=0.01, sleep=time.sleep, seed=None):
+        """
+        constructor
+        epc: ozopticsEPC400, objective: fun() -> float to maximize, channels: EPC channels to move
+        voltages: start voltages of the channels in V, read from the device if None
+        settle: s to wait between a write and reading the objective, sleep: fun(s), e.g. a simulated clock
+        """
+        self.epc, self.objective = epc, objective
+        self.channels = list(channels)
+        if voltages is None: voltages = np.asarray(epc.getVoltages())[self.channels]
+        self.voltages = np.clip(np.asarray(voltages, dtype=np.float64), *voltageLimits)
+        self.strategy = strategy
+        self.steps = np.full(len(self.channels), float(step))
+        self.stepMin, self.stepMax = stepMin, stepMax
+        self.settle, self.sleep = settle, sleep
+        self.rng = np.random.default_rng(seed)
+
+        self.evalCount, self.stepCount, self.failCount = 0, 0, 0
+        self.gradientSign = np.zeros(len(self.channels))
+        self.channelIndex = 0
+        self.simplex, self.simplexValues = None, None
+        self.history = [] ## (time, step count, eval count, value, voltages)
+        self.value = self.evaluate(self.voltages)
+
+
+    def evaluate(self, voltages):
+        """
+        set the channel voltages, wait settle and read the objective
+        """
+        voltages = np.clip(voltages, *voltageLimits)
+        target = [None]*self.epc.channelNum
+        for chan, voltage in zip(self.channels, voltages): target[chan] = float(voltage)
+        self.epc.setVoltagesBulk(target)
+        if self.settle: self.sleep(self.settle)
+        self.evalCount += 1
+        return float(self.objective())
+
+
+    def adaptSteps(self, gradient):
+        """
+        rprop step update: grow where the gradient sign repeats, halve where it flips, keep where it is zero
+        """
+        sign = np.sign(gradient)
+        agreement = sign*self.gradientSign
+        self.steps[agreement > 0] *= 1.2
+        self.steps[agreement < 0] *= 0.5
+        self.steps = np.clip(self.steps, self.stepMin, self.stepMax)
+        self.gradientSign = np.where(agreement < 0, 0, sign) ## no second shrink right after a flip
+
+
+    def moveTo(self, voltages, value):
+        self.voltages, self.value = np.clip(voltages, *voltageLimits), value
+        self.failCount = 0
+
+
+    def noImprovement(self):
+        """
+        after len(channels) steps in a row without improvement, re-measure the center, its value may be stale after a drift
+        """
+        self.failCount += 1
+        if self.failCount >= len(self.channels):
+            self.value = self.evaluate(self.voltages)
+            self.failCount = 0
+
+
+    def stepCoordinate(self):
+        """
+        try the next channel one step in the direction that worked last, then the other way, keep the first that improves
+        """
+        i = self.channelIndex
+        self.channelIndex = (i+1) % len(self.channels)
+        for direction in ((1.0, -1.0) if self.gradientSign[i] >= 0 else (-1.0, 1.0)):
+            trial = self.voltages.copy()
+            trial[i] += direction*self.steps[i]
+            value = self.evaluate(trial)
+            if value > self.value:
+                gradient = np.zeros(len(self.channels)); gradient[i] = direction
+                self.adaptSteps(gradient)
+                self.moveTo(trial, value)
+                return
+        ## neither direction improved: the optimum is within the step
+        self.gradientSign[i] = 0
+        self.steps[i] = max(self.steps[i]*0.5, self.stepMin)
+        self.noImprovement()
+
+
+    def stepSPSA(self):
+        """
+        dither all channels by +-step at once, the sign of the reading difference gives the gradient direction of every channel
+        move to the better probe if it beats the current value
+        """
+        delta = self.rng.choice((-1.0, 1.0), len(self.channels))
+        valuePlus = self.evaluate(self.voltages + delta*self.steps)
+        valueMinus = self.evaluate(self.voltages - delta*self.steps)
+        self.adaptSteps((valuePlus - valueMinus)*delta)
+        if max(valuePlus, valueMinus) > self.value:
+            if valuePlus >= valueMinus: self.moveTo(self.voltages + delta*self.steps, valuePlus)
+            else: self.moveTo(self.voltages - delta*self.steps, valueMinus)
+        else:
+            self.steps = np.maximum(self.steps*0.7, self.stepMin)
+            self.noImprovement()
+
+
+    def stepSimplex(self):
+        """
+        one Nelder-Mead iteration on the channel voltages, the simplex is built on the first call with edges of steps
+        """
+        if self.simplex is None:
+            self.simplex = np.vstack([self.voltages] + [self.voltages + np.eye(len(self.channels))[i]*self.steps[i] for i in range(len(self.channels))])
+            self.simplexValues = np.array([self.value] + [self.evaluate(point) for point in self.simplex[1:]])
+
+        order = np.argsort(-self.simplexValues) ## best first
+        self.simplex, self.simplexValues = self.simplex[order], self.simplexValues[order]
+        centroid = self.simplex[:-1].mean(axis=0)
+        worst, worstValue = self.simplex[-1], self.simplexValues[-1]
+
+        reflected = centroid + (centroid - worst)
+        reflectedValue = self.evaluate(reflected)
+        if reflectedValue > self.simplexValues[0]:
+            expanded = centroid + 2*(centroid - worst)
+            expandedValue = self.evaluate(expanded)
+            self.simplex[-1], self.simplexValues[-1] = (expanded, expandedValue) if expandedValue > reflectedValue else (reflected, reflectedValue)
+        elif reflectedValue > self.simplexValues[-2]:
+            self.simplex[-1], self.simplexValues[-1] = reflected, reflectedValue
+        else:
+            contracted = centroid + 0.5*(worst - centroid)
+            contractedValue = self.evaluate(contracted)
+            if contractedValue > worstValue:
+                self.simplex[-1], self.simplexValues[-1] = contracted, contractedValue
+            else: ## shrink towards the best vertex, re-measuring it against drift
+                self.simplex[1:] = self.simplex[0] + 0.5*(self.simplex[1:] - self.simplex[0])
+                self.simplexValues = np.array([self.evaluate(point) for point in self.simplex])
+
+        self.simplex = np.clip(self.simplex, *voltageLimits)
+        best = np.argmax(self.simplexValues)
+        self.steps = np.clip(self.simplex.max(axis=0) - self.simplex.min(axis=0), self.stepMin, self.stepMax) ## simplex size as the step
+        self.moveTo(self.simplex[best], float(self.simplexValues[best]))
+        if np.all(self.steps <= self.stepMin): self.simplex = None ## collapsed: rebuild around the best point next time
+
+
+    def stepCube(self):
+        """
+        notebook search: evaluate the center and all cube vertices of side step, move to the best, halve the step if that is the center
+        """
+        points = np.vstack([self.voltages, calculateVertices(self.voltages, float(self.steps.mean()), voltageLimits[1])])
+        values = np.array([self.evaluate(point) for point in points])
+        if np.argmax(values) == 0: self.steps = np.maximum(self.steps*0.5, self.stepMin) ## the center wins: refine
+        self.moveTo(points[np.argmax(values)], float(values.max()))
+
+
+    def step(self):
+        """
+        one step of the current strategy, return the objective at the new voltages
+        """
+        {'coordinate': self.stepCoordinate, 'spsa': self.stepSPSA, 'simplex': self.stepSimplex, 'cube': self.stepCube}[self.strategy]()
+        self.stepCount += 1
+        self.history.append((time.time(), self.stepCount, self.evalCount, self.value, self.voltages.copy()))
+        return self.value
+
+
+    def converged(self, window=20, tolerance=1e-3):
+        """
+        all steps at stepMin and the objective within tolerance (relative) over the last window steps
+        """
+        if len(self.history) < window or np.any(self.steps > self.stepMin*1.01): return False
+        values = np.array([record[3] for record in self.history[-window:]])
+        return values.max() - values.min() <= tolerance*max(abs(values.max()), 1e-12)
+
+
+    def run(self, maxSteps=1000, window=20, tolerance=1e-3, stopEvent=None, callback=None):
+        """
+        step until converged, maxSteps or stopEvent is set
+        callback(optimizer) is called after every step, e.g. to update a plot
+        return the best voltages of the channels and their objective
+        """
+        for _ in range(maxSteps):
+            if stopEvent is not None and stopEvent.is_set(): break
+            self.step()
+            if callback is not None: callback(self)
+            if self.converged(window, tolerance): break
+        self.value = self.evaluate(self.voltages) ## leave the controller on the best point, not on the last probe
+        return self.voltages.copy(), self.value
+
+
+    def hold(self, stopEvent, dropFrac=0.05, interval=0.1, step=None, **runArgs):
+        """
+        lock-hold mode: keep the voltages and only read the objective every interval s
+        when it falls more than dropFrac below the locked value, re-optimize from there with step (default 4*stepMin)
+        returns when stopEvent is set
+        """
+        lockedValue = self.value
+        while not stopEvent.is_set():
+            value = self.objective()
+            if value < lockedValue*(1 - dropFrac):
+                self.value = value
+                self.steps[:] = step if step is not None else 4*self.stepMin
+                self.simplex = None
+                self.run(stopEvent=stopEvent, **runArgs)
+                lockedValue = self.value
+            stopEvent.wait(interval)
+        return self.voltages.copy(), self.value
+
+
+    def historyArray(self):
+        """
+        history as arrays: time, step count, eval count, value, voltages
+        """
+        if not self.history: return np.zeros(0), np.zeros(0, int), np.zeros(0, int), np.zeros(0), np.zeros((0, len(self.channels)))
+        times, steps, evals, values, voltages = zip(*self.history)
+        return np.array(times), np.array(steps), np.array(evals), np.array(values), np.vstack(voltages)
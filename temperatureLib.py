@@ -0,0 +1,126 @@
+import os, time
+import numpy as np
+import pandas as pd
+
+from cacheLib import cachedColumns
+
+## libraries
+## temperature in K = A + B*ln(R) + C*ln(R)**3, as steinhartHartFun10k/100k in read-phase-bin-and-temp.ipynb
+steinhartHartCoeffs = {
+    '10k': (588.657649, -35.6279664, 0.0487316544),
+    '100k': (517.183511, -35.2072073, 0.0749966054),
+}
+biasCurrents = {'10k': 0.1e-3} ## default thermistor bias current in A
+
+
+def resistanceToTemp(resistance, thermistor='10k'):
+    """
+    thermistor resistance in Ohm to temperature in C, vectorized
+    thermistor is a key of steinhartHartCoeffs
+    """
+    a, b, c = steinhartHartCoeffs[thermistor]
+    logRes = np.log(resistance)
+    return a + b*logRes + c*logRes**3 - 273.15
+
+
+def voltageToTemp(voltage, thermistor='10k', biasCurr=None):
+    """
+    thermistor voltage in V at a constant bias current in A to temperature in C, vectorized
+    """
+    if biasCurr is None: biasCurr = biasCurrents[thermistor]
+    return resistanceToTemp(np.asarray(voltage)/biasCurr, thermistor)
+
+
+def localToEpoch(dateTimes):
+    """
+    naive local time strings or datetime64 to unix time in s as float64
+    the utc offset is taken at the first sample, a log crossing a DST change keeps the offset of its start
+    """
+    dateTimes = np.asarray(dateTimes, dtype='datetime64[us]')
+    if dateTimes.size == 0: return np.zeros(0)
+    firstSecond = dateTimes.flat[0].astype('datetime64[s]')
+    utcOffset = firstSecond.astype(np.int64) - time.mktime(firstSecond.item().timetuple())
+    return (dateTimes - np.datetime64(0, 'us')).astype(np.float64)*1e-6 - utcOffset
+
+
+## loaders
+def readThermistorColumns(fileName):
+    """
+    thermistor csv logged from the DAQ: DateTime ('%Y-%m-%d %H:%M:%S.%f'), Voltage [V]
+    """
+    dataFrameTemp = pd.read_csv(fileName, names=['DateTime', 'Voltage [V]'], skiprows=[0], header=None)
+    return {'epoch': localToEpoch(dataFrameTemp['DateTime'].to_numpy(dtype=str)), 'Voltage [V]': dataFrameTemp['Voltage [V]'].to_numpy(dtype=np.float64)}
+
+
+def readOmegaColumns(fileName):
+    """
+    csv converted from the Omega logger .xlsx, 7 header rows
+    """
+    dataFrameTemp = pd.read_csv(fileName, names=['DateTime1', 'DateTime2', 'ambient Temperature [C]', 'couple Temperature [C]'], skiprows=[0, 1, 2, 3, 4, 5, 6], header=None)
+    return {'epoch': localToEpoch(dataFrameTemp['DateTime1'].to_numpy(dtype=str)),
+            'ambient Temperature [C]': dataFrameTemp['ambient Temperature [C]'].to_numpy(dtype=np.float64),
+            'couple Temperature [C]': dataFrameTemp['couple Temperature [C]'].to_numpy(dtype=np.float64)}
+
+
+def loadThermistor(fileName, thermistor='10k', biasCurr=None, useCache=True):
+    """
+    thermistor log, parsed once and then reopened from the cacheLib cache
+    return unix time in s and temperature in C
+    """
+    columns = cachedColumns(fileName, readThermistorColumns) if useCache else readThermistorColumns(fileName)
+    return columns['epoch'], voltageToTemp(columns['Voltage [V]'], thermistor, biasCurr)
+
+
+def loadOmega(fileName, column='ambient Temperature [C]', useCache=True):
+    """
+    Omega logger export, .xlsx (converted to fileName + '.csv' once) or its csv
+    parsed once and then reopened from the cacheLib cache
+    return unix time in s and the requested temperature column in C
+    """
+    if fileName.endswith('.xlsx'):
+        if not os.path.isfile(fileName + '.csv'):
+            pd.read_excel(fileName).to_csv(fileName + '.csv', index=None, header=True)
+        fileName = fileName + '.csv'
+    columns = cachedColumns(fileName, readOmegaColumns) if useCache else readOmegaColumns(fileName)
+    return columns['epoch'], columns[column]
+
+
+## joins, both time axes must be sorted
+def asofJoin(tLeft, tRight, valuesRight, maxGap=None):
+    """
+    for every tLeft, the last valuesRight at or before it
+    nan before the first right sample, or when the right sample is older than maxGap s
+    one vectorized searchsorted, a binary search of tRight per tLeft, so O(n log m)
+    preferred to an O(n+m) merge: a python two-pointer loop is far slower, a stable argsort merge of both axes is too
+    """
+    tLeft, tRight, valuesRight = np.asarray(tLeft), np.asarray(tRight), np.asarray(valuesRight, dtype=np.float64)
+    index = np.searchsorted(tRight, tLeft, side='right') - 1
+    valid = index >= 0
+    if maxGap is not None: valid &= (tLeft - tRight[np.maximum(index, 0)]) <= maxGap
+    joined = np.full(tLeft.shape, np.nan)
+    joined[valid] = valuesRight[index[valid]]
+    return joined
+
+
+def interpJoin(tLeft, tRight, valuesRight, maxGap=None):
+    """
+    valuesRight linearly interpolated at every tLeft, nan outside the right time range
+    and, with maxGap, inside right gaps longer than maxGap s
+    """
+    tLeft, tRight, valuesRight = np.asarray(tLeft), np.asarray(tRight), np.asarray(valuesRight, dtype=np.float64)
+    joined = np.interp(tLeft, tRight, valuesRight, left=np.nan, right=np.nan)
+    if maxGap is not None and tRight.size > 1:
+        index = np.clip(np.searchsorted(tRight, tLeft, side='right'), 1, tRight.size-1)
+        joined[(tRight[index] - tRight[index-1]) > maxGap] = np.nan
+    return joined
+
+
+def joinPhaseTemp(phaseLog, tempEpoch, tempValues, column='PhaseAve', rows=slice(None), method='interp', maxGap=None):
+    """
+    line up a phaseLogLib.PhaseLog column with a temperature log
+    method is 'interp' or 'asof'
+    return unix time in s, phase and temperature at every phase sample of rows
+    """
+    phaseEpoch = phaseLog.epoch(rows)
+    joinFun = {'interp': interpJoin, 'asof': asofJoin}[method]
+    return phaseEpoch, np.asarray(phaseLog.data[column][rows]), joinFun(phaseEpoch, tempEpoch, tempValues, maxGap)
@@ -0,0 +1,145 @@
+import math
+import configparser
+from fractions import Fraction
+import numpy as np
+
+## libraries
+maxTableSize = 2**26 ## samples per channel, 512 MB of float64, above this the tones are not worth tabulating
+
+def periodSamples(frequency, samplingRate):
+    """
+    samples after which a tone of frequency Hz sampled at samplingRate S/s repeats exactly, i.e. the denominator of frequency/samplingRate
+    """
+    ratio = Fraction(str(frequency))/Fraction(str(samplingRate))
+    return ratio.denominator
+
+
+def readSineConfig(fileName):
+    """
+    [SINE_WAVE], [AMPLIFIER] and the AO channels of an MziPhaseHiSpeed.ini style file, values as floats
+    inline comments and the BOM of the LabVIEW files are handled
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=(';',))
+    config.optionxform = str ## keep the upper case keys
+    with open(fileName, encoding='utf-8-sig') as fileHandler: config.read_file(fileHandler)
+
+    sine = {key: float(value) for key, value in config['SINE_WAVE'].items()}
+    sine['GAIN'] = float(config['AMPLIFIER']['GAIN']) if config.has_section('AMPLIFIER') else 1.0
+    for section in ('PS_AO', 'PC_AO'):
+        if config.has_section(section):
+            sine[section] = [channel.strip() for channel in config[section]['AO_CHNLS'].split(',')]
+    return sine
+
+
+## main
+class WaveformTable():
+    """
+    output frames of sums of sines, precomputed once over the common period of all tones
+    the table holds period + samplesPerFrame samples per channel, so frame k is the contiguous slice starting at k*samplesPerFrame mod period
+    and serving a frame is a view (one channel) or one memcpy into writeBuffer (several channels), no sin per callback
+
+    tones: one list of (frequency Hz, amplitude Vp, phase rad) per channel, offsets: V per channel
+    offsets None: the sum of the amplitudes of each channel, so the output stays positive like signalGenerator
+
+    example flow
+    waveform = WaveformTable(100000, 10000, [[(signalSlowFrequency, signalSlowAmplitude[0], 0), (signalFastFrequency, signalFastAmplitude[0], 0)]])
+    writeTask.register_every_n_samples_transferred_from_buffer_event(samplesPerFrame, waveform.writingCallback(writer))
+    """
+
+    def __init__(self, samplingRate, samplesPerFrame, tones, offsets=None, dtype=np.float64):
+        """
+        constructor
+        samplingRate: S/s, samplesPerFrame: samples per channel and callback
+        """
+        self.samplingRate, self.samplesPerFrame = samplingRate, int(samplesPerFrame)
+        self.tones = [[tuple(tone) for tone in channelTones] for channelTones in tones]
+        self.chanNum = len(self.tones)
+        if offsets is None: offsets = [sum(abs(amplitude) for _, amplitude, _ in channelTones) for channelTones in self.tones]
+        self.offsets = np.broadcast_to(np.asarray(offsets, dtype=np.float64), (self.chanNum,))
+
+        ## common period: lcm of the sample periods of all tones, the table is aligned across channels
+        self.period = 1
+        for channelTones in self.tones:
+            for frequency, _, _ in channelTones: self.period = math.lcm(self.period, periodSamples(frequency, samplingRate))
+        if self.period + self.samplesPerFrame > maxTableSize:
+            raise ValueError('common period of {} samples is too long to tabulate, round the frequencies to divisors of the sampling rate'.format(self.period))
+        self.frameNum = self.period//math.gcd(self.period, self.samplesPerFrame) ## distinct frames before the sequence repeats
+
+        timeBase = np.arange(self.period + self.samplesPerFrame)/samplingRate
+        self.table = np.empty((self.chanNum, timeBase.size), dtype=dtype)
+        for channel, channelTones in enumerate(self.tones):
+            self.table[channel] = self.offsets[channel]
+            for frequency, amplitude, phase in channelTones: self.table[channel] += amplitude*np.sin(2*np.pi*frequency*timeBase + phase)
+        self.table.setflags(write=False)
+
+        self.writeBuffer = np.empty((self.chanNum, self.samplesPerFrame), dtype=dtype)
+        self.frameIndex = 0
+
+
+    @classmethod
+    def fromConfig(cls, fileName, mode='sine', samplingRate=None, samplesPerFrame=None, gain=None, channelNum=None, **kwargs):
+        """
+        table of an MziPhaseHiSpeed.ini [SINE_WAVE] config, amplitudes and offsets in the file are at the amplifier output (Vpp), divided by gain
+        mode='sine': SS + HS tones, samplingRate defaults to HS_FREQUENCY*HS_POINTS_PER_CYCLE, frames to SS_CYCLES_PER_BUFFER slow cycles
+        mode='phaseMod': the button modulation tone with its own PHASE_MOD_* rate and buffer
+        channelNum: channels driven with the same tones, the PS_AO channels of the file by default
+        """
+        sine = readSineConfig(fileName)
+        gain = sine['GAIN'] if gain is None else gain
+        if channelNum is None: channelNum = len(sine.get('PS_AO', [None]))
+
+        if mode == 'sine':
+            if samplingRate is None: samplingRate = sine['HS_FREQUENCY']*sine['HS_POINTS_PER_CYCLE']
+            if samplesPerFrame is None: samplesPerFrame = round(samplingRate*sine['SS_CYCLES_PER_BUFFER']/sine['SS_FREQUENCY'])
+            tones = [(sine['SS_FREQUENCY'], sine['SS_AMPLITUDE']/2/gain, 0.0), (sine['HS_FREQUENCY'], sine['HS_AMPLITUDE']/2/gain, 0.0)]
+            offset = sine['OFFSET']/gain
+        elif mode == 'phaseMod':
+            if samplingRate is None: samplingRate = sine['PHASE_MOD_FREQUENCY']*sine['PHASE_MOD_NUM_OF_SAMPLES_PER_CYCLE']
+            if samplesPerFrame is None: samplesPerFrame = round(samplingRate*sine['PHASE_MOD_CYCLES_PER_BUFFER']/sine['PHASE_MOD_FREQUENCY'])
+            tones = [(sine['PHASE_MOD_FREQUENCY'], sine['PHASE_MOD_AMPLITUDE']/2/gain, 0.0)]
+            offset = sine['PHASE_MOD_OFFSET']/gain
+        else:
+            raise ValueError('unknown mode {}, use sine or phaseMod'.format(mode))
+
+        tones = [[tone for tone in tones if tone[1] != 0]]*channelNum ## drop the tones switched off in the file
+        return cls(samplingRate, samplesPerFrame, tones, [offset]*channelNum, **kwargs)
+
+
+    def frame(self, frameIndex):
+        """
+        read-only view of frame frameIndex, shape (chanNum, samplesPerFrame)
+        """
+        start = (frameIndex*self.samplesPerFrame) % self.period
+        return self.table[:, start:start+self.samplesPerFrame]
+
+
+    def nextFrame(self):
+        """
+        view of the next frame, the first call gives frame 0
+        """
+        frame = self.frame(self.frameIndex)
+        self.frameIndex = (self.frameIndex + 1) % self.frameNum
+        return frame
+
+
+    def writingCallback(self, writer):
+        """
+        nidaqmx every-n-samples callback writing the next frame with writer (an AnalogMultiChannelWriter)
+        replaces callbackWritingTask with signalGenerator, several channels cost one copy into writeBuffer because DAQmx wants them contiguous
+        """
+        def callbackWritingTask(taskID, eventType, samplesNum, callbackData=None):
+            frame = self.nextFrame()
+            if not frame.flags.c_contiguous:
+                np.copyto(self.writeBuffer, frame)
+                frame = self.writeBuffer
+            writer.write_many_sample(frame, timeout=10.0)
+            return 0
+        return callbackWritingTask
+
+
+    def reset(self):
+        """
+        restart from frame 0
+        """
+        self.frameIndex = 0
+        return 0